@@ -1,9 +1,18 @@
 import unittest
 import os
+import re
 import time
 import subprocess
+import tempfile
+import threading
 import psutil
 
+from supervisor import ProcessSupervisor, wait_process
+
+# Lines of VPP CLI output which indicate that a command failed
+VPPCTL_ERROR = re.compile(
+    r"unknown input|unknown command|error|failed|invalid|not found", re.I)
+
 
 class TestInfo:
 
@@ -30,81 +39,106 @@ class TestInfo:
 
 
 def check_wait_kill(name, process, timeout_seconds, test_info):
-    timeout = 0
-    process.poll()
+    supervisor = ProcessSupervisor(test_info)
+    supervisor.add(name, process)
 
     test_info.printt("{}: Process is running, timeout: {} seconds".format(
         name, timeout_seconds))
 
-    while None is process.returncode:
-        if timeout >= timeout_seconds:
-            break
-        time.sleep(1)
-        timeout += 1
-        process.poll()
-
-    if None is process.returncode:
-        test_info.printt(
-            "{}: Process is still running, will be terminated".format(name))
-        process.terminate()
-
-        terminate_timeout = 3  # seconds
-        timeout = 0
-        test_info.printt(
-            "{}: Waiting for process till terminates, timeout: {} seconds"
-            .format(name, terminate_timeout))
-        while None is process.returncode:
-            if timeout >= terminate_timeout:
-                break
-            time.sleep(1)
-            timeout += 1
-            process.poll()
-
-        test_info.printt("{}: Process is still running, will be killed".format(
-            name))
-        if None is process.returncode:
-            test_info.printt("{}: Killing the process".format(name))
-            process.kill()
+    if supervisor.wait(timeout_seconds):
+        supervisor.stop()
 
     test_info.printt("{}: Process stopped".format(name))
 
 
-def docker_cleanup(network, test_info, timeout_seconds=3):
-    test_info.printt("Stopping containers that didn't exit:")
-    timeout = 0
-    devnull = open(os.devnull, "wb")
-    process = subprocess.Popen("docker kill $(docker ps -q)",
-                               shell=True,
-                               stderr=devnull,
-                               close_fds=True)
-    while None is process.returncode:
-        if timeout >= timeout_seconds:
-            break
-        time.sleep(1)
-        timeout += 1
-        process.poll()
-
-    test_info.printt("Removing docker network.")
-    process = subprocess.Popen(("docker", "network", "remove", network),
-                               stdout=subprocess.PIPE)
-    while None is process.returncode:
-        if timeout >= timeout_seconds:
-            break
-        time.sleep(1)
-        timeout += 1
-        process.poll()
+def docker_cleanup(client, labels, test_info):
+    """Remove containers and network of a test run, identified by labels.
+
+    :type client: docker_api.DockerClient
+    :type labels: dict
+    :type test_info: TestInfo
+    """
+
+    test_info.printt("Removing containers and network of the test run.")
+    removed = client.cleanup(labels)
+    test_info.printt("Removed {0} containers.".format(removed))
+
+
+def vppctl(command, timeout=3):
+    """Execute VPP CLI command.
+
+    :param command: CLI command.
+    :param timeout: Maximum time to wait for vppctl, in seconds.
+    :type command: str
+    :type timeout: float
+
+    :return: Return code and output of vppctl.
+    :rtype: tuple
+    :raises RuntimeError: If vppctl timed out.
+    """
+
+    proc = subprocess.Popen(
+        ["vppctl", command],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT)
+    # output is read while waiting, long output (e.g. show session verbose
+    # with thousands of sessions) would otherwise block vppctl on a full
+    # pipe; the watchdog kills vppctl after the timeout
+    expired = threading.Event()
+
+    def watchdog():
+        expired.set()
+        try:
+            proc.kill()
+        except OSError:
+            pass
+
+    timer = threading.Timer(timeout, watchdog)
+    timer.daemon = True
+    timer.start()
+    try:
+        output = proc.communicate()[0]
+    finally:
+        timer.cancel()
+    if expired.is_set():
+        raise RuntimeError("vppctl command timed out.")
+    return proc.returncode, output
+
+
+# per thread session count in show session, e.g. "Thread 0: 3 active
+# sessions" (older VPP), "Thread 0: active sessions 3" or "Thread 0: no
+# sessions"
+SESSION_COUNT = re.compile(
+    r"(\d+) active sessions|active sessions (\d+)|no (?:active )?sessions",
+    re.IGNORECASE)
+
+
+def count_sessions(output):
+    """Number of sessions in output of VPP show session, on all threads.
+
+    :return: Sum of the per thread counts, None if the output contains no
+    count (e.g. an error message).
+    :rtype: int
+    """
+
+    counts = [int(older or newer or 0)
+              for older, newer in SESSION_COUNT.findall(output)]
+    return sum(counts) if counts else None
 
 
 class VPPInstance:
 
     vpp_process = None
     startup_conf = None
+    startup_latency = None
 
-    # TODO: cpu startup conf...
-    def __init__(self, vpp_binary, startup_conf, log_dir, test_info):
+    def __init__(self, vpp_binary, startup_conf, log_dir, test_info,
+                 startup_timeout=30):
         self.test_info = test_info
         self.vpp_binary = vpp_binary
         self.startup_conf = startup_conf
+        self.startup_timeout = startup_timeout
         log = "{0}/vpp/vpp_log.txt".format(log_dir)
         memory_log = "{0}/vpp/vpp_mem_log.txt".format(log_dir)
 
@@ -142,8 +176,8 @@ class VPPInstance:
                                    stdin=subprocess.PIPE,
                                    stdout=self.log,
                                    stderr=self.log)
-        if proc_vpe.poll() is None or proc_vm.poll() is None:
-            time.sleep(1)
+        wait_process(proc_vpe, 1)
+        wait_process(proc_vm, 1)
 
         vpp_process = "VPP-PROCESS"
 
@@ -160,43 +194,168 @@ class VPPInstance:
             [self.vpp_binary, "-c", self.startup_conf],
             stdin=subprocess.PIPE, stdout=self.log, stderr=self.log)
 
-        # TODO: check if VPP is ready (instead of using sleep)
         self.test_info.printt("{0}: Waiting for VPP startup".format(
             vpp_process))
-        time.sleep(10)  # let the VPP startup
-
-        self.vpp_process.poll()
-        if None is not self.vpp_process.returncode:
-            print "{}: Start failed, returncode: {}".format(
-                vpp_process, self.vpp_process.returncode)
+        started = time.time()
+        if not self._wait_ready():
+            if self.vpp_process.poll() is None:
+                self.test_info.printt(
+                    "{}: Not ready after {} seconds".format(
+                        vpp_process, self.startup_timeout))
+                self._stop_vpp()
+            else:
+                print "{}: Start failed, returncode: {}".format(
+                    vpp_process, self.vpp_process.returncode)
             return None
+        self.startup_latency = time.time() - started
 
-        self.test_info.printt("{}: Started".format(vpp_process))
+        self.log.write("READY {} {:.3f}s\n".format(
+            vpp_process, self.startup_latency))
+        self.log.flush()
+        self.test_info.printt("{}: Started, ready after {:.3f} seconds".format(
+            vpp_process, self.startup_latency))
         return self.vpp_process
 
-    def _configure_interface(self, ip_address):
-        def exec_vppctl(command):
-            proc = subprocess.Popen(
-                [
-                    "vppctl",
-                    command,
-                ],
-                stdin=subprocess.PIPE, stdout=self.log, stderr=self.log)
-            for x in range(3):
-                if proc.poll() is not None:
-                    break
-                else:
-                    time.sleep(1)
-            else:
-                raise RuntimeError("vppctl command timed out.")
+    def _wait_ready(self):
+        """Poll the VPP CLI with exponential backoff until it answers.
+
+        :return: True if VPP answered before startup_timeout expired,
+        False on timeout or if the VPP process exited.
+        :rtype: bool
+        """
+
+        deadline = time.time() + self.startup_timeout
+        delay = 0.05
+        while time.time() < deadline:
+            try:
+                returncode, output = self._exec_vppctl("show version")
+            except RuntimeError:
+                returncode, output = None, ""
+            # vppctl may return 0 even if it failed to connect
+            if returncode == 0 and output.startswith("vpp v"):
+                return True
+            # sleep, but wake up immediately if VPP exits
+            if wait_process(self.vpp_process, delay) is not None:
+                return False
+            delay = min(delay * 2, 1)
+        return False
+
+    def _exec_vppctl(self, command, timeout=3):
+        """Execute VPP CLI command, see vppctl(). The output is also written
+        into the VPP log."""
+
+        returncode, output = vppctl(command, timeout)
+        self.log.write(output)
+        return returncode, output
+
+    def _exec_script(self, commands, timeout=3):
+        """Execute a batch of VPP CLI commands in one vppctl call.
+
+        The commands are written into a script which VPP runs with
+        'exec', so the whole batch costs a single round trip.
+
+        :param commands: CLI commands.
+        :param timeout: Maximum time to wait for vppctl, in seconds.
+        :type commands: list of str
+        :type timeout: float
+
+        :return: Output of the commands.
+        :rtype: str
+        :raises RuntimeError: If vppctl timed out or any command failed.
+        """
+
+        with tempfile.NamedTemporaryFile(prefix="vpp_script_",
+                                         suffix=".txt") as script:
+            script.write("\n".join(commands) + "\n")
+            script.flush()
+            # VPP reads the script, make it readable regardless of umask
+            os.chmod(script.name, 0644)
+            returncode, output = self._exec_vppctl(
+                "exec {0}".format(script.name), timeout)
+        # exec stops at the first failing command and prints its error
+        for line in output.splitlines():
+            if VPPCTL_ERROR.search(line):
+                raise RuntimeError(
+                    "VPP CLI script failed: {0}".format(line.strip()))
+        if returncode:
+            raise RuntimeError(
+                "vppctl failed with returncode {0}".format(returncode))
+        return output
+
+    def _configure_interfaces(self, ip_addresses):
+        """Create a loopback interface for each address.
+
+        :param ip_addresses: Addresses to configure, loop<N> will get the
+        N-th address.
+        :type ip_addresses: list of str
+        """
+
+        commands = []
+        for index, ip_address in enumerate(ip_addresses):
+            commands.append("create loopback interface")
+            commands.append("set int state loop{0} up".format(index))
+            commands.append("set int ip address loop{0} {1}/32".format(
+                index, ip_address))
+        started = time.time()
+        self._exec_script(commands, 3 + 0.01 * len(commands))
+        self.test_info.printt(
+            "Configured {0} VPP loopback interface(s) in {1:.3f} seconds"
+            .format(len(ip_addresses), time.time() - started))
 
-        exec_vppctl("create loopback interface")
-        exec_vppctl("set int state loop0 up")
-        exec_vppctl("set int ip address loop0 {0}/32".format(ip_address))
+    def _configure_interface(self, ip_address):
+        self._configure_interfaces([ip_address])
         self.test_info.printt(
             "Configured VPP loopback interface with address {0}/32"
             .format(ip_address))
 
+    def _is_running(self):
+        return self.vpp_process is not None and self.vpp_process.poll() is None
+
+    def _session_count(self):
+        """Count sessions open in VPP session layer, including listeners.
+
+        :return: Number of sessions on all threads, None if it can not be
+        read.
+        :rtype: int
+        """
+
+        try:
+            returncode, output = self._exec_vppctl("show session")
+        except RuntimeError as e:
+            self.test_info.printt("VPP-PROCESS: {0}".format(e))
+            return None
+        if returncode:
+            return None
+        return count_sessions(output)
+
+    def _wait_sessions_drained(self, timeout):
+        """Wait until all sessions are closed, polling with exponential
+        backoff.
+
+        :param timeout: Maximum time to wait, in seconds.
+        :type timeout: float
+
+        :return: True if no sessions are open, False on timeout or if the VPP
+        process exited. Sessions which can not be counted are not drained.
+        :rtype: bool
+        """
+
+        deadline = time.time() + timeout
+        delay = 0.1
+        while True:
+            count = self._session_count()
+            if count == 0:
+                return True
+            if time.time() >= deadline:
+                self.test_info.printt(
+                    "VPP-PROCESS: {} sessions still open after {} seconds"
+                    .format("unknown number of" if count is None else count,
+                            timeout))
+                return False
+            if wait_process(self.vpp_process, delay) is not None:
+                return False
+            delay = min(delay * 2, 1)
+
     def _stop_vpp(self):
         if self.vpp_process is None:
             print "No VPP process on this instance."
@@ -243,6 +402,8 @@ class TCPStackBaseTestCase(unittest.TestCase):
     server_log_file = None
     client_mem_log_file = None
     server_mem_log_file = None
+    # gzip log of server and client output, written by LogCollector
+    output_log_file = None
 
     def __init__(self, test_config, use_vpp=None):
         unittest.TestCase.__init__(self)
@@ -262,38 +423,53 @@ class TCPStackBaseTestCase(unittest.TestCase):
 
     def setUp(self):
 
-        for logfile in (
-                self.client_log_file,
-                self.client_mem_log_file,
-                self.server_log_file,
-                self.server_mem_log_file):
-            if not os.path.isdir(os.path.dirname(logfile)):
-                os.makedirs(os.path.dirname(logfile))
+        if self.output_log_file and not os.path.isdir(
+                os.path.dirname(self.output_log_file)):
+            os.makedirs(os.path.dirname(self.output_log_file))
+        # test cases collecting output with LogCollector have no server and
+        # client logs
+        for log in ("client_log", "client_mem_log", "server_log",
+                    "server_mem_log"):
+            logfile = getattr(self, log + "_file")
+            if not logfile:
+                continue
             if not os.path.isdir(os.path.dirname(logfile)):
                 os.makedirs(os.path.dirname(logfile))
-        try:
-            os.remove(self.client_log_file)
-        except OSError:
-            pass
-        self.client_log = open(self.client_log_file, 'w+')
-
-        try:
-            os.remove(self.server_log_file)
-        except OSError:
-            pass
-        self.server_log = open(self.server_log_file, 'w+')
-
-        try:
-            os.remove(self.client_mem_log_file)
-        except OSError:
-            pass
-        self.client_mem_log = open(self.client_mem_log_file, 'w+')
-
-        try:
-            os.remove(self.server_mem_log_file)
-        except OSError:
-            pass
-        self.server_mem_log = open(self.server_mem_log_file, 'w+')
+            try:
+                os.remove(logfile)
+            except OSError:
+                pass
+            setattr(self, log, open(logfile, 'w+'))
+
+    def start_vpp(self):
+        """Start VPP and configure its interface, retrying up to three
+        times.
+
+        :return: True if VPP is running and configured.
+        :rtype: bool
+        """
+
+        for x in range(3):
+            self.vpp_instance = VPPInstance(
+                self.test_config['vpp']['binary'],
+                self.test_config['vpp']['startup_conf'],
+                self.test_config['global']['log_dir'],
+                self.test_info,
+                self.test_config['vpp']['startup_timeout'])
+            if self.vpp_instance._start_vpp() is None:
+                continue
+            try:
+                self.vpp_instance._configure_interface(
+                    self.test_config['global']['host'])
+            except RuntimeError:
+                self.vpp_instance._stop_vpp()
+                # Cleanup and restart VPP
+                continue
+            self.vpp_instance._write_memory()
+            return True
+        self.test_info.printt("VPP startup/configuration failed after "
+                              "retrying.")
+        return False
 
     def tearDown(self):
         if self.client_log:
@@ -0,0 +1,216 @@
+"""Live monitoring of iperf3 throughput for adaptive test duration."""
+
+import re
+import threading
+import time
+
+import stats
+
+# iperf3 interval report, e.g.
+# [  5]   3.00-4.00   sec  1.10 GBytes  9.42 Gbits/sec
+# [SUM]   3.00-4.00   sec  2.20 GBytes  18.8 Gbits/sec
+INTERVAL_LINE = re.compile(
+    r"^\[\s*(SUM|\d+)\]\s+([\d.]+)-([\d.]+)\s+sec\s+[\d.]+\s+\S+\s+"
+    r"([\d.]+)\s+([KMG]?)bits/sec")
+UNITS = {"": 1.0, "K": 1e3, "M": 1e6, "G": 1e9}
+# seconds after which a session lagging behind the others is left out
+STALL_GRACE = 5
+
+
+class ServerLog(object):
+    """Incrementally parses per-second throughput from an iperf3 server
+    log."""
+
+    def __init__(self, path, streams):
+        """
+        :param path: Server --logfile.
+        :param streams: Number of parallel streams (iperf3 -P), the [SUM]
+        line is used for more than one stream.
+        :type path: str
+        :type streams: int
+        """
+
+        self.path = path
+        self.streams = streams
+        self.series = []
+        # when the last interval was read
+        self.updated = time.time()
+        self._offset = 0
+        self._partial = ""
+
+    def read(self):
+        try:
+            with open(self.path, "r") as log:
+                log.seek(self._offset)
+                data = log.read()
+                self._offset = log.tell()
+        except IOError:
+            return
+        lines = (self._partial + data).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            match = INTERVAL_LINE.match(line)
+            if not match:
+                continue
+            if (match.group(1) == "SUM") != (self.streams > 1):
+                continue
+            # skip the summary at the end of the test
+            if float(match.group(3)) - float(match.group(2)) > 1.5:
+                continue
+            # Gb/sec as reported by the test cases (2^30 bits)
+            self.series.append(
+                float(match.group(4)) * UNITS[match.group(5)]
+                / 1024 / 1024 / 1024)
+            self.updated = time.time()
+
+
+class ConvergenceMonitor(threading.Thread):
+    """Watches aggregate throughput of all sessions and decides when the
+    test has converged.
+
+    Warm-up ends when a sliding window of the aggregate throughput is
+    stable (see stats.steady_state_window), or after max_warmup seconds.
+    Measurement then continues until the 95% confidence interval of the mean
+    is narrower than tolerance (relative to the mean), but at least
+    min_duration and at most max_duration seconds.
+
+    A session which lags behind the others and has not reported an interval
+    for stall_grace seconds (e.g. it failed) is stalled: intervals are
+    aggregated without waiting for it, and it counts with the intervals it
+    reported.
+    """
+
+    def __init__(self, server_logs, streams, window, max_cv, tolerance,
+                 min_duration, max_duration, max_warmup,
+                 on_warmup_end=None, on_converged=None, poll_interval=0.25,
+                 stall_grace=STALL_GRACE, test_info=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.logs = [ServerLog(path, streams) for path in server_logs]
+        self.window = window
+        self.max_cv = max_cv
+        self.tolerance = tolerance
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.max_warmup = max_warmup
+        self.on_warmup_end = on_warmup_end
+        self.on_converged = on_converged
+        self.poll_interval = poll_interval
+        self.stall_grace = stall_grace
+        self.test_info = test_info
+        # indexes of stalled sessions
+        self.stalled = set()
+        self.aggregate = []
+        self.warmup = None
+        self.measured = None
+        self.reason = None
+        self._stop_event = threading.Event()
+
+    def _print(self, s):
+        if self.test_info:
+            self.test_info.printt(s)
+        else:
+            print s
+
+    def _update(self):
+        for log in self.logs:
+            log.read()
+        now = time.time()
+        latest = max(len(log.series) for log in self.logs)
+        for session, log in enumerate(self.logs):
+            if len(log.series) < latest and \
+                    now - log.updated > self.stall_grace:
+                if session not in self.stalled:
+                    self.stalled.add(session)
+                    self._print(
+                        "Adaptive duration: session {0} reported no interval "
+                        "for {1} s, aggregating without it".format(
+                            session, self.stall_grace))
+            else:
+                self.stalled.discard(session)
+        # only intervals reported by all sessions which are not stalled are
+        # complete
+        complete = min(len(log.series) for session, log
+                       in enumerate(self.logs) if session not in self.stalled)
+        for x in range(len(self.aggregate), complete):
+            self.aggregate.append(sum(log.series[x] for log in self.logs
+                                      if x < len(log.series)))
+
+    def _check(self):
+        """Advance the warm-up/measurement state machine.
+
+        :return: True once the test has converged.
+        :rtype: bool
+        """
+
+        if self.warmup is None:
+            start = max(len(self.aggregate) - self.window, 0)
+            recent = self.aggregate[start:]
+            if len(recent) == self.window and \
+                    stats.coefficient_of_variation(recent) <= self.max_cv:
+                self.warmup = start
+            elif len(self.aggregate) >= self.max_warmup:
+                self.warmup = self.max_warmup
+            else:
+                return False
+            if self.on_warmup_end:
+                self.on_warmup_end()
+        measured = self.aggregate[self.warmup:]
+        if len(measured) >= self.max_duration:
+            self.reason = "maximum duration"
+        elif len(measured) >= self.min_duration:
+            avg, half_width = stats.confidence_interval(measured)
+            if avg > 0 and half_width / avg <= self.tolerance:
+                self.reason = "converged"
+        if self.reason:
+            self.measured = (self.warmup, self.warmup + len(measured))
+            return True
+        return False
+
+    def run(self):
+        while not self._stop_event.wait(self.poll_interval):
+            self._update()
+            if self._check():
+                if self.on_converged:
+                    self.on_converged()
+                return
+
+    def stop(self):
+        """Stop monitoring. If the test did not converge (e.g. clients
+        exited), all intervals after the warm-up are used as measured."""
+
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        if self.measured is None:
+            self._update()
+            if self.warmup is None:
+                self.warmup = 0
+            self.measured = (self.warmup, len(self.aggregate))
+            self.reason = "clients stopped"
+            self._print(
+                "Adaptive duration: not converged before the clients "
+                "stopped, using {0} intervals after the warm-up of the fixed "
+                "duration".format(self.measured[1] - self.measured[0]))
+
+    def session_mean(self, session):
+        """Mean throughput of a session over the measured intervals, Gb/sec.
+
+        :return: Mean throughput, None if the session has no measured
+        intervals.
+        :rtype: float
+        """
+
+        if self.measured is None:
+            return None
+        series = self.logs[session].series[self.measured[0]:self.measured[1]]
+        return stats.mean(series) if series else None
+
+    def result(self):
+        """Mean and 95% confidence interval half-width of the aggregate
+        throughput over the measured intervals, Gb/sec."""
+
+        measured = self.aggregate[self.measured[0]:self.measured[1]]
+        if not measured:
+            return 0.0, float("inf")
+        return stats.confidence_interval(measured)
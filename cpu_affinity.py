@@ -2,7 +2,9 @@
 processes."""
 
 import subprocess
-from time import sleep
+
+from supervisor import wait_process
+from topology import get_topology, parse_cpulist
 
 
 class Affinity(object):
@@ -22,12 +24,8 @@ class Affinity(object):
 
         proc = subprocess.Popen(
             command, shell=True, stdout=subprocess.PIPE)
-        for x in range(3):
-            if proc.poll() is not None:
-                break
-            else:
-                sleep(1)
-        else:
+        if wait_process(proc, 3) is None:
+            proc.kill()
             raise RuntimeError("Timeout executing command.")
         return proc.stdout.read()
 
@@ -44,15 +42,7 @@ class Affinity(object):
         :rtype: List
         """
 
-        cores = []
-        for item in cores_str.split(","):
-            if "-" in item:
-                min_core, max_core = item.split("-")
-                for x in range(int(min_core), int(max_core) + 1):
-                    cores.append(x)
-            else:
-                cores.append(int(item))
-        return cores
+        return parse_cpulist(cores_str)
 
     @staticmethod
     def case_ls(ht_pairs, _numa_topology, reuse=False):
@@ -161,6 +151,9 @@ class Affinity(object):
     def case_nn(ht_pairs, numa_topology, reuse=False):
         """Client and server process pair runs in different NUMA nodes.
 
+        NUMA nodes are paired in order (0 with 1, 2 with 3, ...), with an
+        odd number of nodes the last node is not used.
+
         :param ht_pairs: Dictionary of Hyperthreading CPU pairs.
         :param numa_topology: List of physical CPUs in each NUMA node.
         :param reuse: More aggressive affinity assignment, both Hyperthreading
@@ -176,12 +169,13 @@ class Affinity(object):
 
         corelist = []
         corelist_client = []
-        for x, y in zip(numa_topology[0], numa_topology[1]):
-            corelist.append(ht_pairs[x][0])
-            corelist_client.append(ht_pairs[y][0])
-            if reuse:
-                corelist.append(ht_pairs[x][1])
-                corelist_client.append(ht_pairs[y][1])
+        for numa in range(0, len(numa_topology) - 1, 2):
+            for x, y in zip(numa_topology[numa], numa_topology[numa + 1]):
+                corelist.append(ht_pairs[x][0])
+                corelist_client.append(ht_pairs[y][0])
+                if reuse:
+                    corelist.append(ht_pairs[x][1])
+                    corelist_client.append(ht_pairs[y][1])
         corelist.sort()
         corelist_client.sort()
         print "s -- c core layout"
@@ -190,41 +184,60 @@ class Affinity(object):
         return corelist, corelist_client
 
     @staticmethod
-    def get_ht_pairs(skip_cores=None):
+    def get_ht_pairs(skip_cores=None, use_cores=None):
         """Build dictionary of Hyperthreaded CPU pairs.
 
         :param skip_cores: Logical CPU cores which should not be used.
+        :param use_cores: If specified, only these logical CPU cores may be
+        used.
         :type skip_cores: list of int
+        :type use_cores: list of int
 
         :return: Topology of HT pairs.
         :rtype: dict
         """
 
-        cpuinfo = Affinity.exec_shell("lscpu -p").splitlines()
-        ht_pairs = {}
+        ht_pairs = get_topology().cores()
         skip = []
-        for line in cpuinfo:
-            if line.startswith("#"):
-                continue
-            line = line.strip().split(",")
-            cpu = int(line[0])
-            phys = int(line[1])
-            # numa = line[3]
-            if skip_cores:
-                if cpu in skip_cores:
+        for phys, cpus in ht_pairs.items():
+            for cpu in cpus:
+                if skip_cores and cpu in skip_cores:
+                    skip.append(phys)
+                if use_cores is not None and cpu not in use_cores:
                     skip.append(phys)
-            try:
-                ht_pairs[phys].append(cpu)
-            except KeyError:
-                ht_pairs[phys] = [cpu]
         print "Detected HyperThreading pairs:\n{0}".format(ht_pairs)
-        for phycore in skip:
+        for phycore in set(skip):
             lcores = ht_pairs.pop(phycore)
             print "Skipping physical core {0} == logical cores {1}.".format(
                 phycore, lcores)
 
         return ht_pairs
 
+    @staticmethod
+    def select_numa(ht_pairs, nodes, local=True):
+        """Keep only physical cores in (or outside of) the specified NUMA
+        nodes.
+
+        :param ht_pairs: Topology of HT pairs.
+        :param nodes: NUMA nodes.
+        :param local: Keep cores in the nodes if True, cores in other nodes
+        if False.
+        :type ht_pairs: dict
+        :type nodes: list of int
+        :type local: bool
+
+        :return: Topology of HT pairs in the selected NUMA nodes.
+        :rtype: dict
+        """
+
+        cpus = get_topology().cpus
+        selected = dict(
+            (physcore, cores) for physcore, cores in ht_pairs.iteritems()
+            if (cpus[cores[0]]["node"] in nodes) == local)
+        print "Using physical cores {0} NUMA nodes {1}: {2}".format(
+            "in" if local else "outside of", nodes, sorted(selected.keys()))
+        return selected
+
     @staticmethod
     def get_numa_topo(ht_pairs):
         """Build list of NUMA nodes and associated physical CPUs.
@@ -236,30 +249,22 @@ class Affinity(object):
         :rtype: list of lists
         """
 
-        numa_nodes = int(
-            Affinity.exec_shell(
-                "lscpu | grep 'NUMA node(s)'"
-            ).strip().split(" ")[-1]
-        )
+        nodes = get_topology().nodes()
         numa_topology = []
-        if numa_nodes <= 1:
+        if len(nodes) <= 1:
             print "NUMA architecture not present."
-            numa_topology = None
-        elif numa_nodes > 2:
-            raise NotImplementedError
-        else:
-            for numa in range(numa_nodes):
-                topo = Affinity.exec_shell(
-                    "lscpu | grep 'NUMA node{0}'".format(numa))
-                topo = topo.strip().split(" ")[-1]
-                numa_cores = Affinity.parse_cores(topo)
-                physcores = []
-                for physcore, cores in ht_pairs.iteritems():
-                    if cores[0] in numa_cores:
-                        physcores.append(physcore)
+            return None
+        for node in sorted(nodes.keys()):
+            physcores = []
+            for physcore, cores in ht_pairs.iteritems():
+                if cores[0] in nodes[node]:
+                    physcores.append(physcore)
+            if physcores:
                 physcores.sort()
                 numa_topology.append(physcores)
-
-            print "Detected NUMA topology:\n{0}".format(numa_topology)
+        print "Detected NUMA topology:\n{0}".format(numa_topology)
+        if len(numa_topology) <= 1:
+            print "Less than two NUMA nodes with usable cores."
+            return None
 
         return numa_topology
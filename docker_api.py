@@ -0,0 +1,396 @@
+"""Minimal Docker Engine API client, talking HTTP over the daemon's unix
+socket, with a bounded pool of worker threads for concurrent requests."""
+
+import httplib
+import json
+import os
+import socket
+import threading
+import urllib
+import uuid
+from Queue import Queue, Empty
+
+import psutil
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+# every container and network created by the tests carries this label, with
+# the ID of the test run as value
+RUN_LABEL = "vcl_tcp_test.run"
+# process which created the objects, host/PID/start time, used to find
+# leftovers of runs which crashed or were killed
+OWNER_LABEL = "vcl_tcp_test.owner"
+
+
+def new_run_id():
+    """Unique value of RUN_LABEL."""
+    return uuid.uuid4().hex[:12]
+
+
+def _owner(pid):
+    return "{0}/{1}/{2:.2f}".format(
+        socket.gethostname(), pid, psutil.Process(pid).create_time())
+
+
+def run_labels():
+    """Labels of the objects of a new test run: a new run ID and the
+    current process as the owner.
+
+    :rtype: dict
+    """
+
+    return {RUN_LABEL: new_run_id(), OWNER_LABEL: _owner(os.getpid())}
+
+
+def label_options(labels):
+    """docker run options setting labels.
+
+    :type labels: dict
+    :rtype: str
+    """
+
+    return " ".join("--label {0}={1}".format(key, value)
+                    for key, value in sorted(labels.items()))
+
+
+def owner_alive(owner):
+    """Whether the process in OWNER_LABEL is still running. Owners on
+    other hosts, and values which can not be parsed, are assumed alive.
+
+    :type owner: str
+    :rtype: bool
+    """
+
+    try:
+        host, pid, started = owner.rsplit("/", 2)
+        pid = int(pid)
+    except ValueError:
+        return True
+    if host != socket.gethostname():
+        return True
+    try:
+        return _owner(pid) == owner
+    except psutil.NoSuchProcess:
+        return False
+    except psutil.AccessDenied:
+        return True
+
+
+class DockerError(RuntimeError):
+    """Failed Docker API request, status is the HTTP status code (None if
+    the daemon did not respond)."""
+
+    def __init__(self, message, status=None):
+        super(DockerError, self).__init__(message)
+        self.status = status
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+
+    def __init__(self, socket_path, timeout):
+        httplib.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+def map_concurrent(function, items, workers):
+    """Call function for every item, at most workers calls at a time.
+
+    :param function: Called with one item.
+    :param items: Arguments of the calls.
+    :param workers: Maximum number of concurrent calls.
+    :type function: callable
+    :type items: list
+    :type workers: int
+
+    :return: Results of the calls, in the order of items.
+    :rtype: list
+
+    :raises: The first exception raised by a call, after all calls
+    finished.
+    """
+
+    queue = Queue()
+    for x, item in enumerate(items):
+        queue.put((x, item))
+    results = [None] * len(items)
+    errors = []
+
+    def worker():
+        while True:
+            try:
+                x, item = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                results[x] = function(item)
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker)
+               for x in range(min(workers, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+class DockerClient(object):
+    """Docker Engine API client.
+
+    Each request uses its own connection, so the client can be shared by
+    worker threads.
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=60, workers=16):
+        """
+        :param socket_path: Unix socket of the Docker daemon.
+        :param timeout: Timeout of a single request, seconds.
+        :param workers: Maximum number of concurrent requests of
+        create_containers and remove_containers.
+        :type socket_path: str
+        :type timeout: float
+        :type workers: int
+        """
+
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.workers = workers
+
+    def request(self, method, path, body=None, query=None, ignore=()):
+        """Send a request to the Docker daemon.
+
+        :param method: HTTP method.
+        :param path: API endpoint, e.g. /containers/create.
+        :param body: Request body, serialized as JSON.
+        :param query: Query parameters.
+        :param ignore: HTTP status codes which are not errors, e.g. 404 when
+        removing objects which may not exist.
+
+        :type method: str
+        :type path: str
+        :type body: dict
+        :type query: dict
+        :type ignore: tuple of int
+
+        :return: Parsed JSON response, None for empty responses.
+        :rtype: dict or list
+
+        :raises DockerError: If the request fails.
+        """
+
+        if query:
+            path += "?" + urllib.urlencode(query)
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        connection = UnixHTTPConnection(self.socket_path, self.timeout)
+        try:
+            connection.request(method, path, data, headers)
+            response = connection.getresponse()
+            content = response.read()
+        except (socket.error, httplib.HTTPException) as e:
+            raise DockerError("Docker API {0} {1} failed: {2}".format(
+                method, path, e))
+        finally:
+            connection.close()
+        if response.status >= 300 and response.status not in ignore:
+            try:
+                message = json.loads(content)["message"]
+            except (ValueError, KeyError, TypeError):
+                message = content
+            raise DockerError("Docker API {0} {1} returned {2}: {3}".format(
+                method, path, response.status, message), response.status)
+        if not content:
+            return None
+        try:
+            return json.loads(content)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _label_filter(labels):
+        """Filter of objects with the labels, any value of labels which are
+        None."""
+        return {"filters": json.dumps({"label": [
+            key if value is None else "{0}={1}".format(key, value)
+            for key, value in sorted(labels.items())]})}
+
+    def create_network(self, name, subnet, labels):
+        """Create a bridge network.
+
+        :return: Network ID.
+        :rtype: str
+        """
+
+        return self.request("POST", "/networks/create", {
+            "Name": name,
+            "CheckDuplicate": True,
+            "IPAM": {"Config": [{"Subnet": subnet}]},
+            "Labels": labels,
+        })["Id"]
+
+    def ensure_network(self, name, subnet, labels):
+        """Create a bridge network, replacing an unused network of the same
+        name left over by an earlier test run. Leftovers of test runs whose
+        process is gone are removed first (see remove_stale).
+
+        :return: Network ID.
+        :rtype: str
+
+        :raises DockerError: If the network exists and is not a leftover.
+        """
+
+        self.remove_stale()
+        existing = self.request("GET", "/networks/" + name, ignore=(404,))
+        if existing and "Id" in existing:
+            if RUN_LABEL not in (existing.get("Labels") or {}) \
+                    or existing.get("Containers"):
+                raise DockerError(
+                    "Docker network {0} is in use.".format(name))
+            self.remove_network(existing["Id"])
+        return self.create_network(name, subnet, labels)
+
+    def networks(self, labels):
+        """IDs of networks with all the specified labels."""
+        return [network["Id"] for network in self.request(
+            "GET", "/networks", query=self._label_filter(labels))]
+
+    def remove_network(self, network):
+        self.request("DELETE", "/networks/" + network, ignore=(404,))
+
+    def create_container(self, name, image, labels, network, cpus=None,
+                         ip=None, binds=(), entrypoint=None, command=None,
+                         env=None):
+        """Create and start a container.
+
+        :param name: Container name.
+        :param image: Image name.
+        :param labels: Container labels.
+        :param network: Network name or ID.
+        :param cpus: CPUs the container may use, cpuset format.
+        :param ip: IPv4 address in the network, None to let Docker assign.
+        :param binds: Host paths mounted at the same path.
+        :param entrypoint: Overrides entrypoint of the image.
+        :param command: Command of the container.
+        :param env: Environment variables.
+
+        :type name: str
+        :type image: str
+        :type labels: dict
+        :type network: str
+        :type cpus: str
+        :type ip: str
+        :type binds: list of str
+        :type entrypoint: list of str
+        :type command: list of str
+        :type env: dict
+
+        :return: Container ID.
+        :rtype: str
+        """
+
+        endpoint = {}
+        if ip:
+            endpoint["IPAMConfig"] = {"IPv4Address": ip}
+        body = {
+            "Image": image,
+            "Labels": labels,
+            "Env": ["{0}={1}".format(key, value)
+                    for key, value in sorted((env or {}).items())],
+            "HostConfig": {
+                "Binds": ["{0}:{0}".format(path) for path in binds],
+                "NetworkMode": network,
+            },
+            "NetworkingConfig": {"EndpointsConfig": {network: endpoint}},
+        }
+        if cpus:
+            body["HostConfig"]["CpusetCpus"] = cpus
+        if entrypoint:
+            body["Entrypoint"] = entrypoint
+        if command:
+            body["Cmd"] = command
+        container = self.request(
+            "POST", "/containers/create", body, {"name": name})["Id"]
+        self.request("POST", "/containers/{0}/start".format(container),
+                     ignore=(304,))
+        return container
+
+    def containers(self, labels, running_only=False):
+        """IDs of containers with all the specified labels."""
+        query = self._label_filter(labels)
+        if not running_only:
+            query["all"] = 1
+        return [container["Id"] for container in self.request(
+            "GET", "/containers/json", query=query)]
+
+    def remove_container(self, container):
+        """Kill and remove a container."""
+        self.request("DELETE", "/containers/" + container,
+                     query={"force": 1, "v": 1}, ignore=(404,))
+
+    def create_containers(self, specs):
+        """Create and start containers concurrently.
+
+        :param specs: Keyword arguments of create_container for each
+        container.
+        :type specs: list of dict
+
+        :return: Container IDs, in the order of specs.
+        :rtype: list of str
+        """
+
+        return map_concurrent(
+            lambda spec: self.create_container(**spec), specs, self.workers)
+
+    def remove_containers(self, containers):
+        map_concurrent(self.remove_container, containers, self.workers)
+
+    def remove_stale(self):
+        """Remove containers and networks of test runs whose owner process
+        is not running anymore, e.g. after a crash or SIGKILL.
+
+        :return: Number of removed containers.
+        :rtype: int
+        """
+
+        def stale(labels):
+            owner = (labels or {}).get(OWNER_LABEL)
+            return owner is not None and not owner_alive(owner)
+
+        query = self._label_filter({RUN_LABEL: None})
+        query["all"] = 1
+        containers = [
+            container["Id"] for container
+            in self.request("GET", "/containers/json", query=query)
+            if stale(container.get("Labels"))]
+        self.remove_containers(containers)
+        for network in self.request(
+                "GET", "/networks", query=self._label_filter(
+                    {RUN_LABEL: None})):
+            if stale(network.get("Labels")):
+                self.remove_network(network["Id"])
+        return len(containers)
+
+    def cleanup(self, labels):
+        """Remove all containers and networks with the specified labels.
+
+        :return: Number of removed containers.
+        :rtype: int
+        """
+
+        containers = self.containers(labels)
+        self.remove_containers(containers)
+        for network in self.networks(labels):
+            self.remove_network(network)
+        return len(containers)
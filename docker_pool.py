@@ -0,0 +1,207 @@
+"""Pool of long-lived Docker containers, iperf3 is started inside them with
+docker exec instead of creating a container for every process."""
+
+import os
+import time
+
+import psutil
+
+from docker_api import RUN_LABEL, run_labels
+
+CONTAINER_PREFIX = "vcl_pool_"
+# VCL library in the vcl_iperf3_preload image
+VCL_PRELOAD = "/libs/libvcl_ldpreload.so.0.0.0"
+# directory holding only log directories of the harness (test_runner.py
+# places test runs there), mounted into pool containers instead of a log
+# directory, so containers can be reused by test runs
+RESULTS_ROOT = "/tmp/vcl_tcp_test"
+
+
+def container_id(pid):
+    """ID of the Docker container a process runs in, from its cgroup.
+
+    :return: Container ID, None for processes outside of containers.
+    :rtype: str
+    """
+
+    try:
+        with open("/proc/{0}/cgroup".format(pid), "r") as cgroup:
+            paths = cgroup.read()
+    except IOError:
+        return None
+    for path in paths.split():
+        for part in path.split("/"):
+            # cgroupfs driver: /docker/<id>, systemd driver: docker-<id>.scope
+            if part.startswith("docker-") and part.endswith(".scope"):
+                part = part[len("docker-"):-len(".scope")]
+            if len(part) == 64 and all(c in "0123456789abcdef" for c in part):
+                return part
+    return None
+
+
+def results_volume(log_dir):
+    """Host directory mounted into pool containers for a log directory:
+    RESULTS_ROOT if the log directory is within it, otherwise the log
+    directory itself.
+
+    :type log_dir: str
+    :rtype: str
+    """
+
+    log_dir = os.path.abspath(log_dir)
+    if log_dir.startswith(RESULTS_ROOT + os.sep):
+        return RESULTS_ROOT
+    return log_dir
+
+
+class ContainerPool(object):
+    """Containers kept running between tests, one per server/client slot.
+
+    A container is reused while its image, CPU set, IP address and volumes
+    stay the same; otherwise it is replaced. Containers run sleep as their
+    main process with LD_PRELOAD of the image cleared, so that idle
+    containers do not attach to VPP; it is set again for commands started
+    with exec_prefix(preload=True). The network and all containers carry the
+    pool's run label, close() removes only those.
+    """
+
+    def __init__(self, client, network, subnet, test_info):
+        """
+        :param client: Docker API client.
+        :param network: Docker network of the containers, created by the
+        pool.
+        :param subnet: Subnet of the network.
+        :param test_info: Output of messages.
+
+        :type client: DockerClient
+        :type network: str
+        :type subnet: str
+        :type test_info: TestInfo
+        """
+
+        self.client = client
+        self.network = network
+        self.subnet = subnet
+        self.test_info = test_info
+        self.labels = run_labels()
+        self.run_id = self.labels[RUN_LABEL]
+        # slot -> (spec, container ID)
+        self.containers = {}
+        self.network_ready = False
+        # statistics of the last prepare()
+        self.created = 0
+        self.reused = 0
+        self.creation_time = 0.0
+
+    def _name(self, slot):
+        return "{0}{1}_{2}".format(CONTAINER_PREFIX, self.run_id, slot)
+
+    def prepare(self, specs):
+        """Make sure a container is running for every slot.
+
+        :param specs: Slot name -> (image, cpus, ip, volumes); ip may be None
+        to use an address assigned by Docker, volumes is a sorted tuple of
+        host paths mounted at the same path.
+        :type specs: dict
+
+        :raises RuntimeError: If containers can not be created.
+        """
+
+        started = time.time()
+        if not self.network_ready:
+            self.test_info.printt("Configuring docker network.")
+            self.client.ensure_network(self.network, self.subnet, self.labels)
+            self.network_ready = True
+        running = set(self.client.containers(self.labels, running_only=True))
+        missing = []
+        for slot, spec in sorted(specs.items()):
+            current = self.containers.get(slot)
+            if current and current[0] == spec and current[1] in running:
+                continue
+            missing.append(slot)
+        self.client.remove_containers([
+            self.containers.pop(slot)[1] for slot in missing
+            if slot in self.containers])
+
+        ids = self.client.create_containers([{
+            "name": self._name(slot),
+            "image": specs[slot][0],
+            "labels": self.labels,
+            "network": self.network,
+            "cpus": specs[slot][1],
+            "ip": specs[slot][2],
+            "binds": specs[slot][3],
+            "entrypoint": ["sleep"],
+            "command": ["infinity"],
+            "env": {"LD_PRELOAD": ""},
+        } for slot in missing])
+        for slot, container in zip(missing, ids):
+            self.containers[slot] = (specs[slot], container)
+
+        self.created = len(missing)
+        self.reused = len(specs) - len(missing)
+        self.creation_time = time.time() - started
+        self.test_info.printt(
+            "Docker containers: {0} created, {1} reused in {2:.3f} "
+            "seconds".format(self.created, self.reused, self.creation_time))
+
+    def exec_prefix(self, slot, env=None, preload=False):
+        """Command prefix which runs a command in the slot's container.
+
+        :param slot: Slot name.
+        :param env: Environment variables of the command.
+        :param preload: Preload the VCL library, for commands which run over
+        VPP.
+        :type slot: str
+        :type env: dict
+        :type preload: bool
+
+        :rtype: str
+        """
+
+        env = dict(env or {})
+        if preload:
+            env["LD_PRELOAD"] = VCL_PRELOAD
+        options = "".join(
+            " -e {0}={1}".format(key, value)
+            for key, value in sorted(env.items()))
+        return "docker exec -i{0} {1}".format(options, self._name(slot))
+
+    def signal_processes(self, sig, match=None):
+        """Send a signal to processes running in pool containers.
+
+        docker exec does not forward signals, so processes are found on the
+        host by their container.
+
+        :param sig: Signal number.
+        :param match: If specified, only signal processes for which it
+        returns True, called with psutil.Process instances.
+        :type sig: int
+        :type match: callable
+
+        :return: Number of signalled processes.
+        :rtype: int
+        """
+
+        ids = set(container for spec, container in self.containers.values())
+        count = 0
+        for process in psutil.process_iter():
+            try:
+                if process.name() == "sleep" or \
+                        container_id(process.pid) not in ids:
+                    continue
+                if match and not match(process):
+                    continue
+                process.send_signal(sig)
+                count += 1
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        return count
+
+    def close(self):
+        """Remove containers and the network of the pool."""
+
+        removed = self.client.cleanup(self.labels)
+        self.test_info.printt("Removed {0} pool containers.".format(removed))
+        self.containers = {}
+        self.network_ready = False
@@ -0,0 +1,116 @@
+import json
+import os
+
+import psutil
+
+from rr_tc import RequestResponseTestCase, DRIVER_DIR
+from pingpong import parse_size
+
+# wrk script printing results as JSON, mounted into containers with the
+# request/response driver
+WRK_REPORT = os.path.join(DRIVER_DIR, "wrk_report.lua")
+# prefix of the JSON line in wrk output
+REPORT_PREFIX = "wrk_report: "
+# wrk errors which fail a session: responses other than 2xx/3xx, failed
+# reads and requests which timed out
+SESSION_ERRORS = ("status", "read", "timeout")
+
+NGINX_CONF = """daemon off;
+master_process off;
+worker_processes 1;
+pid {prefix}/nginx_{index}.pid;
+error_log {prefix}/nginx_{index}_error.log warn;
+worker_rlimit_nofile 65536;
+
+events {{
+    worker_connections 16384;
+}}
+
+http {{
+    access_log off;
+    default_type application/octet-stream;
+    keepalive_timeout 65;
+    keepalive_requests 1000000;
+
+    server {{
+        listen {bind}:{port};
+        root {root};
+    }}
+}}
+"""
+
+
+class HttpTestCase(RequestResponseTestCase):
+    """HTTP request rate: nginx servers serve a static file of
+    response_size bytes to closed-loop wrk clients, each keeping
+    connections_per_session keep-alive connections busy."""
+
+    section = "http"
+    label = "HTTP"
+    title = "HTTP request rate"
+    result_suffix = ".txt"
+    client_stdout_result = True
+    rate_key = "requests_per_second"
+    unit = "requests"
+    servers_exit = False
+
+    def _program(self, role):
+        options = self.test_config[self.section]
+        return [options['nginx'] if role == "server" else options['wrk']]
+
+    def _content(self):
+        """Directory and name of the served file, created in the log
+        directory."""
+
+        size = parse_size(self.test_config[self.section]['response_size'])
+        root = "{0}/{1}/www".format(
+            self.test_config['global']['log_dir'], self.section)
+        name = "{0}.bin".format(size)
+        path = os.path.join(root, name)
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        if not os.path.isfile(path) or os.path.getsize(path) != size:
+            with open(path, "wb") as content:
+                content.write(b"r" * size)
+        return root, name
+
+    def _server_args(self, i, cpu, bind, port):
+        prefix = "{0}/{1}".format(
+            os.path.abspath(self.test_config['global']['log_dir']),
+            self.section)
+        conf = "{0}/nginx_{1}.conf".format(prefix, i)
+        with open(conf, "w") as nginx_conf:
+            nginx_conf.write(NGINX_CONF.format(
+                prefix=prefix, index=i, bind=bind, port=port,
+                root=os.path.abspath(self._content()[0])))
+        return "-p {0}/ -c {1}".format(prefix, conf)
+
+    def _client_args(self, i, cpu, target, port, output_file):
+        options = self.test_config[self.section]
+        return "-t 1 -c {0} -d {1}s -s {2} http://{3}:{4}/{5}".format(
+            options['connections_per_session'], options['test_duration'],
+            WRK_REPORT, target, port, self._content()[1])
+
+    def _preexec(self, cpu):
+        # nginx and wrk do not pin themselves, containers are pinned by
+        # Docker
+        if self.use_docker:
+            return None
+        return lambda: psutil.Process().cpu_affinity([cpu])
+
+    def _load_result(self, output_file):
+        with open(output_file, "r") as output:
+            reports = [line[len(REPORT_PREFIX):] for line in output
+                       if line.startswith(REPORT_PREFIX)]
+        if not reports:
+            raise ValueError("No wrk results")
+        return json.loads(reports[-1])
+
+    def _session_error(self, results_json):
+        error = super(HttpTestCase, self)._session_error(results_json)
+        if error:
+            return error
+        errors = results_json["end"]["errors"]
+        if any(errors.get(kind) for kind in SESSION_ERRORS):
+            return errors
+        return None
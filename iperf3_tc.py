@@ -2,23 +2,198 @@ import psutil
 import subprocess
 import os
 import json
+import math
+import signal
 import time
-from itertools import cycle
+from itertools import cycle, izip_longest
 import ipaddress
 
-from base_tc import TestInfo, check_wait_kill, docker_cleanup, VPPInstance,\
-    TCPStackBaseTestCase
+from base_tc import TestInfo, docker_cleanup, TCPStackBaseTestCase
+from supervisor import ProcessSupervisor, StartBarrier
+from monitor import MemorySampler, CpuAccounting
+from convergence import ConvergenceMonitor
+from docker_api import DockerClient, run_labels, label_options
+from docker_pool import results_volume
+from ports import PortAllocator
+from log_collector import LogCollector, raise_nofile_limit, \
+    NOFILE_PER_SESSION, NOFILE_RESERVE
+import stats
+
+
+def interval_series(results_json):
+    """Extract per-second throughput from iperf3 client JSON output.
+
+    :param results_json: Parsed iperf3 --json output.
+    :type results_json: dict
+
+    :return: Throughput of each measured (not omitted) interval in Gb/sec.
+    :rtype: list of float
+    """
+
+    series = []
+    for interval in results_json.get('intervals', []):
+        if interval['sum'].get('omitted'):
+            continue
+        series.append(
+            float(interval['sum']['bits_per_second']) / 1024 / 1024 / 1024)
+    return series
+
+
+def session_throughput(results_json):
+    """Received throughput of a session in Gb/sec, None if not available."""
+    try:
+        return float(
+            results_json['end']['sum_received']['bits_per_second']
+        ) / 1024 / 1024 / 1024
+    except KeyError:
+        return None
+
+
+def iperf3_key(cmdline):
+    """Role ("-s" or "-c") and port of an iperf3 command line.
+
+    :type cmdline: list of str
+
+    :return: (role, port), None if the command line has no role or port.
+    :rtype: tuple
+    """
+
+    if "-p" not in cmdline[:-1]:
+        return None
+    port = cmdline[cmdline.index("-p") + 1]
+    for role in ("-s", "-c"):
+        if role in cmdline:
+            return role, port
+    return None
+
+
+def iperf3_matcher(role, port):
+    """Match iperf3 process by its role ("-s" or "-c") and port. Used to find
+    processes running inside containers."""
+
+    def match(process):
+        if process.name() != "iperf3":
+            return False
+        return iperf3_key(process.cmdline()) == (role, str(port))
+    return match
+
+
+def start_times(keys, pids=None, timeout=5):
+    """Find when processes were started.
+
+    Processes with a known PID are looked up directly, the others (e.g. in
+    containers) are found in a single pass over all processes, repeated
+    only while some are missing.
+
+    :param keys: Process name -> (role, port) of iperf3 processes, see
+    iperf3_key.
+    :param pids: Process name -> PID of processes started by the test.
+    :param timeout: How long to wait for processes which were not found yet,
+    seconds.
+    :type keys: dict
+    :type pids: dict
+    :type timeout: float
+
+    :return: Process name -> creation time, for processes which were found.
+    :rtype: dict
+    """
+
+    found = {}
+    for name, pid in (pids or {}).items():
+        try:
+            found[name] = psutil.Process(pid).create_time()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    missing = dict((key, name) for name, key in keys.items()
+                   if name not in found)
+    deadline = time.time() + timeout
+    while missing:
+        for process in psutil.process_iter():
+            try:
+                if process.name() != "iperf3":
+                    continue
+                name = missing.pop(iperf3_key(process.cmdline()), None)
+                if name is not None:
+                    found[name] = process.create_time()
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        if not missing or time.time() > deadline:
+            break
+        time.sleep(0.1)
+    return found
+
+
+def write_intervals(file_name, session_series, aggregate):
+    """Write interval throughput of all sessions as a semicolon CSV."""
+
+    sessions = sorted(session_series.keys())
+    with open(file_name, 'w') as intervals_file:
+        intervals_file.write("Interval;{0};Total\n".format(
+            ";".join("Session {0}".format(i) for i in sessions)))
+        for x, total in enumerate(aggregate):
+            values = [session_series[i][x] if x < len(session_series[i])
+                      else None for i in sessions]
+            intervals_file.write("{0};{1};{2:.4f}\n".format(
+                x,
+                ";".join("" if value is None else "{0:.4f}".format(value)
+                         for value in values),
+                total))
+
+
+def overlap_window(starts, session_series, omit):
+    """Window in which all sessions were measured at the same time, and
+    aggregate throughput within it.
+
+    Measured interval x of a session is assumed to cover
+    start + omit + x .. start + omit + x + 1 seconds. Only intervals which
+    lie entirely within the window are used.
+
+    :param starts: Session -> start time of its client.
+    :param session_series: Session -> throughput of measured intervals,
+    see interval_series.
+    :param omit: Omitted seconds at the start of each session.
+    :type starts: dict
+    :type session_series: dict
+    :type omit: float
+
+    :return: Start of the window relative to the first client start, its
+    duration in seconds and the sum of mean throughputs of all sessions
+    within it in Gb/sec, None if sessions do not overlap for a whole
+    interval.
+    :rtype: dict
+    """
+
+    sessions = [i for i in sorted(session_series.keys())
+                if i in starts and session_series[i]]
+    if not sessions:
+        return None
+    begin = max(starts[i] for i in sessions) + omit
+    end = min(starts[i] + omit + len(session_series[i]) for i in sessions)
+    throughput = 0.0
+    for i in sessions:
+        offset = starts[i] + omit
+        # rounded, so that float errors do not drop whole intervals
+        series = session_series[i][
+            int(math.ceil(round(begin - offset, 6))):
+            int(math.floor(round(end - offset, 6)))]
+        if not series:
+            return None
+        throughput += stats.mean(series)
+    return {
+        "start": begin - min(starts[i] for i in sessions),
+        "duration": end - begin,
+        "throughput": throughput,
+    }
 
 
 class Iperf3TestCase(TCPStackBaseTestCase):
 
     def __init__(self, test_config, use_vpp=True, use_docker=False,
-                 corelist=None, corelist_client=None):
+                 corelist=None, corelist_client=None, vpp_running=False,
+                 container_pool=None):
         super(Iperf3TestCase, self).__init__(test_config, use_vpp)
 
-        self.server_log_file = "{0}/iperf3/iperf_server_log.txt".format(
-            self.test_config['global']['log_dir'])
-        self.client_log_file = "{0}/iperf3/iperf_client_log.txt".format(
+        self.output_log_file = "{0}/iperf3/iperf_output_log.txt.gz".format(
             self.test_config['global']['log_dir'])
         self.server_mem_log_file = "{0}/iperf3/iperf_server_mem_log.txt".format(
             self.test_config['global']['log_dir'])
@@ -28,11 +203,51 @@ class Iperf3TestCase(TCPStackBaseTestCase):
         self.corelist = corelist
         self.corelist_client = corelist_client if corelist_client else corelist
         self.use_docker = use_docker
+        # VPP is started, configured and stopped by the caller
+        self.vpp_running = vpp_running
+        # with Docker, start iperf3 in containers of this ContainerPool
+        self.container_pool = container_pool if use_docker else None
+        # containers and network of this test carry the run label
+        self.docker = None
+        self.docker_labels = None
+        if use_docker and not self.container_pool:
+            self.docker = DockerClient(
+                self.test_config['global']['docker_socket'])
+            self.docker_labels = run_labels()
+        self.memory_sampler = None
+        self.cpu_accounting = None
+        self.convergence = None
+        # structured results of the test, filled in by runTest
+        self.result = None
+        self.server_names = []
+        self.client_names = []
 
     def setUp(self):
         super(Iperf3TestCase, self).setUp()
 
+    def _monitor(self, name, pid=None, match=None):
+        """Add process to all active samplers."""
+        for sampler in (self.memory_sampler, self.cpu_accounting):
+            if sampler:
+                sampler.add(name, pid, match)
+
     def tearDown(self):
+        if self.memory_sampler:
+            self.memory_sampler.stop()
+            self.memory_sampler.write(
+                self.server_mem_log, self.server_names)
+            self.memory_sampler.write(
+                self.client_mem_log, self.client_names)
+            if self.vpp_instance and self.vpp_instance.memory_log:
+                self.memory_sampler.write(
+                    self.vpp_instance.memory_log, ["VPP-PROCESS"])
+            elif self.use_vpp:
+                vpp_mem_log_file = "{0}/vpp/vpp_mem_log.txt".format(
+                    self.test_config['global']['log_dir'])
+                if not os.path.isdir(os.path.dirname(vpp_mem_log_file)):
+                    os.makedirs(os.path.dirname(vpp_mem_log_file))
+                with open(vpp_mem_log_file, 'w') as vpp_mem_log:
+                    self.memory_sampler.write(vpp_mem_log, ["VPP-PROCESS"])
         super(Iperf3TestCase, self).tearDown()
 
     def runTest(self):
@@ -42,10 +257,14 @@ class Iperf3TestCase(TCPStackBaseTestCase):
 
         self.test_info.printt("=======================================")
         self.test_info.printt("Testing TCP stack using iperf3\n")
+        test_started = time.time()
+        self.result = {"sessions": {}, "errors": {}}
         iperf_env = None
-        iperf_server_list = []
-        iperf_client_list = []
-        port_in_use = []
+        supervisor = ProcessSupervisor(self.test_info)
+        client_processes = []
+        client_cmds = []
+        # PIDs of servers and clients started directly, for start_times
+        launch_pids = {}
         iperf_output_file_list = []
 
 # set test configuration
@@ -59,24 +278,56 @@ class Iperf3TestCase(TCPStackBaseTestCase):
         iperf_message_size = self.test_config["iperf3"]["message_size"]
         iperf_time = self.test_config['iperf3']['test_duration']
         add_to = self.test_config['iperf3']['additional_timeout']
+        iperf_omit = 10
+        adaptive = self.test_config['iperf3']['adaptive']
+        start_barrier = self.test_config['iperf3'].get('start_barrier')
+        if adaptive:
+            # warm-up and duration are decided by ConvergenceMonitor,
+            # -t is only the upper limit
+            iperf_omit = 0
+            iperf_time = self.test_config['iperf3']['adaptive_max_warmup'] \
+                + self.test_config['iperf3']['adaptive_max_duration'] + 1
+        iperf_server_log_file_list = []
+
+        nofile = raise_nofile_limit(
+            NOFILE_PER_SESSION * iperf_sessions + NOFILE_RESERVE)
+        self.test_info.printt("Open files limit: {0}".format(nofile))
+        # output of all servers and clients, prefixed with their names
+        collector = LogCollector(self.output_log_file)
+        collector.start()
 
         for i in range(iperf_sessions):
             iperf_output_file_list.append(
                 '{0}/iperf3/iperf_session_{1}.txt'.format(
                     self.test_config["global"]["log_dir"], i))
-            try:
-                os.remove(iperf_output_file_list[i])
-            except OSError:
-                pass
-
-        if self.use_docker:
+            iperf_server_log_file_list.append(
+                '{0}/iperf3/iperf_server_session_{1}.txt'.format(
+                    self.test_config["global"]["log_dir"], i))
+            for output_file in (iperf_output_file_list[i],
+                                iperf_server_log_file_list[i]):
+                try:
+                    os.remove(output_file)
+                except OSError:
+                    pass
+
+        vcl_conf = self.test_config["vcllib"].get("conf")
+        if self.container_pool:
+            # prefixed with docker exec for each session
+            iperf_path = "iperf3"
+        elif self.use_docker:
             iperf_path = "docker run -i --net vcl_docker_net --rm " \
-                         "{0} {1} {2}".format(
+                         "{0} {1} {2} {3}".format(
+                            label_options(self.docker_labels),
                             "-v /dev/shm:/dev/shm",
                             "-v {0}:{0}".format(
                                 self.test_config["global"]["log_dir"]),
                             "vcl_iperf3_preload" if self.use_vpp
                             else "vcl_iperf3")
+            if self.use_vpp and vcl_conf:
+                # mount the configuration, it may be outside of log_dir
+                iperf_path = iperf_path.replace(
+                    "--rm ", "--rm -v {0}:{0}:ro -e VCL_CONFIG={0} ".format(
+                        vcl_conf))
 
         else:
             iperf_path = "/usr/local/bin/iperf3"
@@ -84,70 +335,44 @@ class Iperf3TestCase(TCPStackBaseTestCase):
         iperf_server_cmd = "{0}" \
                            " -s -B {1} -4 -1 -V -i 0".format(iperf_path,
                                                              iperf_host)
+        if adaptive:
+            # servers report every second, read live by ConvergenceMonitor
+            iperf_server_cmd = iperf_server_cmd.replace(
+                "-i 0", "-i 1 --forceflush")
         iperf_client_cmd = "{iperf_path}" \
                            " -c {host} -4 -P {connections} -t {time}" \
-                           " -O 10 -V -i 0 -l {length} --json".format(
+                           " -O {omit} -V -i 1 -l {length} --json".format(
                             iperf_path=iperf_path,
+                            omit=iperf_omit,
                             host=iperf_host,
                             connections=iperf_connections,
                             time=iperf_time,
                             length=iperf_message_size)
 
-        if self.use_vpp:
-            # start vpp and set env var
-            for x in range(3):
-                self.vpp_instance = VPPInstance(
-                    self.test_config['vpp']['binary'],
-                    self.test_config['vpp']['startup_conf'],
-                    self.test_config['global']['log_dir'],
-                    self.test_info)
-                self.vpp_instance._start_vpp()
-                if self.vpp_instance.vpp_process.returncode:
-                    continue
-                try:
-                    self.vpp_instance._configure_interface(
-                        self.test_config['global']['host'])
-                except RuntimeError:
-                    self.vpp_instance._stop_vpp()
-                    # Cleanup and restart VPP
-                    continue
-                if self.use_vpp and not self.use_docker:
-                    iperf_env = {"LD_PRELOAD": self.vcllib}
-                else:
-                    iperf_env = None
-                self.test_info.printt(
-                    "Using vcllib_ldpreload: {}".format(iperf_env))
-                self.vpp_instance._write_memory()
-                break
-            else:
-                self.test_info.printt("VPP startup/configuration failed after "
-                                      "retrying.")
+        vpp_ready = False
+        if self.use_vpp and self.vpp_running:
+            self.test_info.printt("Using already running VPP instance.")
+            vpp_ready = True
+        elif self.use_vpp:
+            vpp_ready = self.start_vpp()
+        if vpp_ready:
+            # set env var
+            if not self.use_docker:
+                iperf_env = {"LD_PRELOAD": self.vcllib}
+                if self.test_config["vcllib"].get("conf"):
+                    iperf_env["VCL_CONFIG"] = \
+                        self.test_config["vcllib"]["conf"]
+            self.test_info.printt(
+                "Using vcllib_ldpreload: {}".format(iperf_env))
 
-        if self.use_docker:
+        if self.docker:
             self.test_info.printt("Configuring docker network.")
-            proc = subprocess.Popen(("docker", "network", "create",
-                                     "--subnet=192.168.0.0/16",
-                                     "vcl_docker_net"),
-                                    stdout=subprocess.PIPE)
-            for x in range(3):
-                if proc.poll() is not None:
-                    break
-                else:
-                    time.sleep(1)
-            else:
-                raise RuntimeError("Timeout creating docker network.")
-            self.test_info.printt(proc.stdout.read())
-
-        # get ports in use
-        if iperf_host == "localhost":
-            for sconn in psutil.net_connections():
-                # If any port that was going to be used with iperf is already
-                # in use, store it in a list. These ports will be skipped.
-                if (sconn.laddr[1] >= default_port)\
-                        and (sconn.laddr[1] <= default_port + iperf_sessions):
-                    port_in_use.append(sconn.laddr[1])
-                    self.test_info.printt(
-                        "Port in use: {}".format(sconn.laddr[1]))
+            self.test_info.printt(self.docker.ensure_network(
+                "vcl_docker_net", "192.168.0.0/16", self.docker_labels))
+
+        # servers and clients of a session use the same port
+        session_ports = PortAllocator(
+            default_port, vpp_ready, self.test_info).allocate(iperf_sessions)
 
         def ip_address(address_str):
             """Wrapper fr ipaddress.ip_address(). Handles localhost
@@ -165,37 +390,108 @@ class Iperf3TestCase(TCPStackBaseTestCase):
                 yield ip_addr
                 ip_addr += 1
 
+# create or reuse pool containers
+
+        exec_env = {}
+        if self.container_pool:
+            image = "vcl_iperf3_preload" if self.use_vpp else "vcl_iperf3"
+            volumes = set(["/dev/shm", results_volume(
+                self.test_config["global"]["log_dir"])])
+            if self.use_vpp and vcl_conf:
+                volumes.add(os.path.dirname(os.path.abspath(vcl_conf)))
+                exec_env["VCL_CONFIG"] = vcl_conf
+            volumes = tuple(sorted(volumes))
+            # without VPP, every container has its own address
+            use_ip = not self.use_vpp
+            specs = {}
+            for i, cpu, cpu_client, server_ip, client_ip in zip(
+                    range(iperf_sessions),
+                    cycle(self.corelist),
+                    cycle(self.corelist_client),
+                    ip_generator(iperf_host),
+                    ip_generator(
+                        str(ip_address(
+                            unicode(iperf_host)) + iperf_sessions))):
+                specs["server-{0}".format(i)] = (
+                    image, str(cpu),
+                    str(server_ip) if use_ip else None, volumes)
+                specs["client-{0}".format(i)] = (
+                    image, str(cpu_client),
+                    str(client_ip) if use_ip else None, volumes)
+            self.container_pool.prepare(specs)
+            # leftovers of an interrupted test
+            self.container_pool.signal_processes(signal.SIGKILL)
+            self.result["docker"] = {
+                "created": self.container_pool.created,
+                "reused": self.container_pool.reused,
+                "creation_time": self.container_pool.creation_time,
+            }
+
+# start memory sampling and CPU accounting
+
+        if self.test_config['iperf3']['memory_sample_interval']:
+            self.memory_sampler = MemorySampler(
+                self.test_config['iperf3']['memory_sample_interval'],
+                self.test_config['iperf3']['memory_max_samples'])
+        if self.test_config['iperf3']['cpu_accounting'] and adaptive:
+            # window starts after warm-up and ends when clients are stopped
+            self.cpu_accounting = CpuAccounting(
+                None, self.test_config['iperf3']['adaptive_max_duration'])
+        elif self.test_config['iperf3']['cpu_accounting']:
+            # measure after the omitted period, and end a second early so
+            # that clients are still alive at the end of the window
+            self.cpu_accounting = CpuAccounting(
+                iperf_omit, max(iperf_time - 1, 1))
+        if self.vpp_instance and self.vpp_instance.vpp_process:
+            self._monitor(
+                "VPP-PROCESS", pid=self.vpp_instance.vpp_process.pid)
+        elif vpp_ready:
+            self._monitor(
+                "VPP-PROCESS", match=lambda p: p.name() == "vpp")
+        if self.memory_sampler:
+            self.memory_sampler.start()
+
 # start iperf servers
 
         for i, cpu, ip in zip(range(iperf_sessions),
                               cycle(self.corelist),
                               ip_generator(iperf_host)):
             self.test_info.printt("Starting: IPERF-SERVER-{}".format(i))
-            # check if next port is in use
-            if port_in_use:
-                while True:
-                    if (default_port + i) in port_in_use:
-                        default_port += 1
-                    else:
-                        break
             iperf_server_cmd_tmp = "{} -p {} -A {}".format(
                 iperf_server_cmd,
-                default_port + i,
+                session_ports[i],
                 cpu)
+            if adaptive:
+                iperf_server_cmd_tmp += " --logfile {}".format(
+                    iperf_server_log_file_list[i])
             if self.use_docker and not self.use_vpp:
                 iperf_server_cmd_tmp = iperf_server_cmd_tmp.replace(
                     "docker run", "docker run --ip {0}".format(ip))
                 iperf_server_cmd_tmp = iperf_server_cmd_tmp.replace(
                     "-B {0}".format(iperf_host), "-B {0}".format(ip))
+            if self.container_pool:
+                iperf_server_cmd_tmp = "{0} {1}".format(
+                    self.container_pool.exec_prefix(
+                        "server-{0}".format(i), exec_env, self.use_vpp),
+                    iperf_server_cmd_tmp)
             self.test_info.printt(iperf_server_cmd_tmp)
-            iperf_server_list.append(
-                [
-                    subprocess.Popen(
-                        iperf_server_cmd_tmp.split(' '),
-                        env=iperf_env,
-                        stdin=subprocess.PIPE,
-                        stdout=self.server_log),
-                    i])
+            name = "IPERF-SERVER-{}".format(i)
+            output = collector.pipe(name)
+            process = subprocess.Popen(
+                iperf_server_cmd_tmp.split(' '),
+                env=iperf_env,
+                stdin=collector.stdin,
+                stdout=output,
+                stderr=subprocess.STDOUT)
+            collector.started(output)
+            supervisor.add(name, process)
+            self.server_names.append(name)
+            if self.use_docker:
+                self._monitor(
+                    name, match=iperf3_matcher("-s", session_ports[i]))
+            else:
+                self._monitor(name, pid=process.pid)
+                launch_pids["-s{0}".format(i)] = process.pid
             # time.sleep(0.1)
         self.test_info.printt("IPERF-SERVER(s) running...")
 
@@ -203,9 +499,6 @@ class Iperf3TestCase(TCPStackBaseTestCase):
 
 # start iperf clients
 
-        # reset default port (in case some ports were skipped)
-        default_port = self.test_config['iperf3']['default_port']
-
         for i, cpu, server_ip, client_ip in zip(
                 range(iperf_sessions),
                 cycle(self.corelist_client),
@@ -214,16 +507,9 @@ class Iperf3TestCase(TCPStackBaseTestCase):
                     str(ip_address(
                         unicode(iperf_host)) + iperf_sessions))):
             self.test_info.printt("Starting: IPERF-CLIENT-{}".format(i))
-            # check if next port is in use
-            if port_in_use:
-                while True:
-                    if (default_port + i) in port_in_use:
-                        default_port += 1
-                    else:
-                        break
             iperf_client_cmd_tmp = "{} -p {} -A {} --logfile {}".format(
                 iperf_client_cmd,
-                default_port + i,
+                session_ports[i],
                 cpu,
                 iperf_output_file_list[i])
             if self.use_docker and not self.use_vpp:
@@ -231,72 +517,157 @@ class Iperf3TestCase(TCPStackBaseTestCase):
                     "docker run", "docker run --ip {0}".format(client_ip))
                 iperf_client_cmd_tmp = iperf_client_cmd_tmp.replace(
                     "-c {0}".format(iperf_host), "-c {0}".format(server_ip))
+            if self.container_pool:
+                iperf_client_cmd_tmp = "{0} {1}".format(
+                    self.container_pool.exec_prefix(
+                        "client-{0}".format(i), exec_env, self.use_vpp),
+                    iperf_client_cmd_tmp)
             self.test_info.printt(iperf_client_cmd_tmp)
-            iperf_client_list.append(
-                [
-                    subprocess.Popen(
-                        iperf_client_cmd_tmp.split(' '),
-                        env=iperf_env,
-                        stdin=subprocess.PIPE,
-                        stdout=self.client_log),
-                    i])
-            # time.sleep(0.1)
+            client_cmds.append(iperf_client_cmd_tmp.split(' '))
+
+        def add_client(i, process):
+            name = "IPERF-CLIENT-{}".format(i)
+            supervisor.add(name, process)
+            self.client_names.append(name)
+            client_processes.append(process)
+            if self.use_docker:
+                self._monitor(
+                    name, match=iperf3_matcher("-c", session_ports[i]))
+            else:
+                self._monitor(name, pid=process.pid)
+                launch_pids["-c{0}".format(i)] = process.pid
+
+        client_outputs = [
+            collector.pipe("IPERF-CLIENT-{}".format(i))
+            for i in range(len(client_cmds))]
+        if start_barrier:
+            # all clients exec at once after being forked
+            barrier = StartBarrier()
+            for client_cmd, output in zip(client_cmds, client_outputs):
+                barrier.spawn(client_cmd, env=iperf_env,
+                              stdin=collector.stdin, stdout=output,
+                              stderr=subprocess.STDOUT)
+            processes = barrier.release()
+            for output in client_outputs:
+                collector.started(output)
+            for i, process in enumerate(processes):
+                if process is None:
+                    self.test_info.printt(
+                        "IPERF-CLIENT-{0}: failed to start: {1}".format(
+                            i, barrier.errors[i]))
+                else:
+                    add_client(i, process)
+            clients_released = barrier.released
+        else:
+            clients_released = None
+            for i, client_cmd in enumerate(client_cmds):
+                add_client(i, subprocess.Popen(
+                    client_cmd,
+                    env=iperf_env,
+                    stdin=collector.stdin,
+                    stdout=client_outputs[i],
+                    stderr=subprocess.STDOUT))
+                collector.started(client_outputs[i])
         self.test_info.printt("IPERF-CLIENT(s) running...")
+        if self.cpu_accounting:
+            self.cpu_accounting.start()
+
+        if adaptive:
+            def stop_clients():
+                # end CPU accounting while the clients are still alive
+                if self.cpu_accounting:
+                    self.cpu_accounting.stop()
+                self.test_info.printt(
+                    "IPERF-TEST: {}, stopping clients".format(
+                        self.convergence.reason))
+                if self.container_pool:
+                    # docker exec does not forward signals
+                    self.container_pool.signal_processes(
+                        signal.SIGINT, lambda p: "-c" in p.cmdline())
+                for process in client_processes:
+                    if process.poll() is None:
+                        process.send_signal(signal.SIGINT)
+
+            self.convergence = ConvergenceMonitor(
+                iperf_server_log_file_list,
+                iperf_connections,
+                self.test_config['iperf3']['steady_state_window'],
+                self.test_config['iperf3']['steady_state_cv'],
+                self.test_config['iperf3']['adaptive_tolerance'],
+                self.test_config['iperf3']['adaptive_min_duration'],
+                self.test_config['iperf3']['adaptive_max_duration'],
+                self.test_config['iperf3']['adaptive_max_warmup'],
+                on_warmup_end=self.cpu_accounting.begin
+                if self.cpu_accounting else None,
+                on_converged=stop_clients,
+                test_info=self.test_info)
+            self.convergence.start()
 
         self.test_info.printt("IPERF-TEST is running... timeout: {} seconds"
                               .format(iperf_time + add_to))
 
+        # skew between the first and the last started server and client
+        launched = start_times(dict(
+            ("{0}{1}".format(role, i), (role, str(port)))
+            for role in ("-s", "-c")
+            for i, port in enumerate(session_ports)), launch_pids)
+        if clients_released:
+            # clients are forked before the barrier, but run from its release
+            for name in launched:
+                if name.startswith("-c"):
+                    launched[name] = max(launched[name], clients_released)
+        launch_skew = {}
+        for role, label in (("-s", "servers"), ("-c", "clients")):
+            times = [value for name, value in launched.items()
+                     if name.startswith(role)]
+            launch_skew[label] = max(times) - min(times) if times else None
+        self.test_info.printt(
+            "Launch skew: servers {0}, clients {1} (found {2} of {3} "
+            "processes)".format(
+                *["{0:.3f} s".format(launch_skew[label])
+                  if launch_skew[label] is not None else "N/A"
+                  for label in ("servers", "clients")] +
+                [len(launched), 2 * iperf_sessions]))
+
 # wait until test is done
 
-        timeout = 0
-        while iperf_client_list or iperf_server_list:
-            if timeout >= (iperf_time + add_to):
-                break
-            for iperf_client in iperf_client_list:
-                iperf_client[0].poll()
-                if iperf_client[0].returncode is not None:
-                    self.test_info.printt("IPERF-CLIENT-{}: Stopped".format(
-                        iperf_client[1]))
-                    iperf_client_list.remove(iperf_client) 
-            for iperf_server in iperf_server_list:
-                iperf_server[0].poll()
-                if iperf_server[0].returncode is not None:
-                    self.test_info.printt("IPERF-SERVER-{}: Stopped".format(
-                        iperf_server[1]))
-                    iperf_server_list.remove(iperf_server)
-            time.sleep(1)
-            timeout += 1
+        def on_exit(name, process):
+            self.test_info.printt("{}: Stopped after {:.3f} seconds".format(
+                name,
+                supervisor.exit_times[name] - supervisor.start_times[name]))
+
+        still_running = supervisor.wait(iperf_time + add_to, on_exit)
 
 # terminate/kill all processes
 
-        for iperf_client in iperf_client_list:
-            check_wait_kill(
-                "IPERF-CLIENT-{}".format(iperf_client[1]),
-                iperf_client[0],
-                1,
-                self.test_info)
-        for iperf_server in iperf_server_list:
-            check_wait_kill(
-                "IPERF-SERVER-{}".format(iperf_server[1]),
-                iperf_server[0],
-                1,
-                self.test_info)
+        if still_running:
+            supervisor.stop(on_exit=on_exit)
+        if self.container_pool:
+            # stopping docker exec does not stop processes in containers
+            self.container_pool.signal_processes(signal.SIGKILL)
+        collector.stop()
+        self.exit_times = supervisor.exit_times
+        if self.memory_sampler:
+            self.memory_sampler.stop()
+        if self.cpu_accounting:
+            self.cpu_accounting.stop()
+        if self.convergence:
+            self.convergence.stop()
 
         if self.vpp_instance:
             self.vpp_instance._stop_vpp()
 
-        if self.use_docker:
-            docker_cleanup("vcl_docker_net", self.test_info)
+        if self.docker:
+            docker_cleanup(self.docker, self.docker_labels, self.test_info)
 
 # load test results
 
         results_json_list = []
-        for iperf_output_file in iperf_output_file_list:
-            output = open(iperf_output_file, 'r')
-            out = output.read()
+        for i, iperf_output_file in enumerate(iperf_output_file_list):
             try:
-                results_json_list.append(json.loads(out))
-            except ValueError as e:
+                with open(iperf_output_file, 'r') as output:
+                    results_json_list.append((i, json.load(output)))
+            except (IOError, ValueError) as e:
                 self.test_info.printt("{}: {}".format(e, iperf_output_file))
 
         self.test_info.printt("\nTest results:")
@@ -304,15 +675,18 @@ class Iperf3TestCase(TCPStackBaseTestCase):
 # print per session test results
 
         thp = 0
-        i = -1
         failed_sessions = 0
         ok_sessions = 0
-        for results_json in results_json_list:
-            i += 1
-            try:
-                thp_tmp = float(
-                    results_json['end']['sum_received']['bits_per_second']
-                ) / 1024 / 1024 / 1024
+        session_series = {}
+        for i, results_json in results_json_list:
+            session_series[i] = interval_series(results_json)
+            if self.convergence:
+                # clients were interrupted, use intervals measured by servers
+                thp_tmp = self.convergence.session_mean(i)
+            else:
+                thp_tmp = session_throughput(results_json)
+            if thp_tmp is not None:
+                self.result["sessions"][i] = thp_tmp
                 self.test_info.printt(
                     "IPERF-SESSION-%d Throughput: %0.3f Gb/sec" % (i, thp_tmp))
                 if thp_tmp == 0:
@@ -320,9 +694,10 @@ class Iperf3TestCase(TCPStackBaseTestCase):
                 else:
                     ok_sessions += 1
                 thp += thp_tmp
-            except KeyError:
+            else:
                 try:
                     error = results_json['error']
+                    self.result["errors"][i] = error
                     self.test_info.printt(
                         "IPERF_SESSION-{}: {}".format(i, error))
                 except KeyError:
@@ -349,4 +724,163 @@ class Iperf3TestCase(TCPStackBaseTestCase):
             self.test_info.printt(
                 "Average throughput per session: %0.3f Gb/sec" % (
                     thp / ok_sessions))
+        self.result.update({
+            "throughput": thp if ok_sessions else None,
+            "average": thp / ok_sessions if ok_sessions else None,
+            "ok_sessions": ok_sessions,
+            "failed_sessions": iperf_sessions - (
+                ok_sessions + failed_sessions),
+            "zero_sessions": failed_sessions,
+        })
+
+# print adaptive duration results
+
+        if self.convergence:
+            mean, half_width = self.convergence.result()
+            self.test_info.printt(
+                "Adaptive duration: warm-up {0} s, measured {1} s ({2})"
+                .format(self.convergence.measured[0],
+                        self.convergence.measured[1]
+                        - self.convergence.measured[0],
+                        self.convergence.reason))
+            self.test_info.printt(
+                "Aggregate throughput: %0.3f +- %0.3f Gb/sec (95%% CI)" % (
+                    mean, half_width))
+            self.result["adaptive"] = {
+                "warmup": self.convergence.measured[0],
+                "measured": self.convergence.measured[1]
+                - self.convergence.measured[0],
+                "reason": self.convergence.reason,
+                "stalled": sorted(self.convergence.stalled),
+                "mean": mean,
+                "ci_half_width": half_width,
+            }
+
+# print interval statistics
+
+        self.intervals = session_series
+        self.interval_stats = None
+        aggregate = [sum(values) for values in izip_longest(
+            *session_series.values(), fillvalue=0)]
+        if aggregate:
+            write_intervals(
+                "{0}/iperf3/iperf_intervals.csv".format(
+                    self.test_config['global']['log_dir']),
+                session_series,
+                aggregate)
+            window = stats.steady_state_window(
+                aggregate,
+                self.test_config['iperf3']['steady_state_window'],
+                self.test_config['iperf3']['steady_state_cv'])
+            if window:
+                self.test_info.printt(
+                    "Steady state: intervals {0}-{1}".format(*window))
+                steady = aggregate[window[0]:window[1]]
+            else:
+                self.test_info.printt(
+                    "Steady state: not reached, using all intervals")
+                steady = aggregate
+            self.interval_stats = stats.summarize(steady)
+            self.interval_stats['window'] = window
+            self.test_info.printt(
+                "Interval throughput min/p5/median/p95: "
+                "%0.3f/%0.3f/%0.3f/%0.3f Gb/sec" % (
+                    self.interval_stats['min'],
+                    self.interval_stats['p5'],
+                    self.interval_stats['median'],
+                    self.interval_stats['p95']))
+            self.test_info.printt(
+                "Stability (coefficient of variation): %0.4f" %
+                self.interval_stats['cv'])
+        self.result["interval_stats"] = self.interval_stats
+
+# print throughput of the window in which all sessions overlapped
+
+        overlap = overlap_window(
+            dict((i, launched["-c{0}".format(i)]) for i in session_series
+                 if "-c{0}".format(i) in launched),
+            session_series, iperf_omit)
+        if overlap:
+            self.test_info.printt(
+                "Sessions overlapped for %0.1f s, starting %0.3f s after the "
+                "first client" % (overlap["duration"], overlap["start"]))
+            self.test_info.printt(
+                "Throughput in the common window: %0.3f Gb/sec" %
+                overlap["throughput"])
+        else:
+            self.test_info.printt("Sessions did not overlap.")
+        self.result["overlap"] = overlap
+
+# print memory usage
+
+        if self.memory_sampler:
+            mib = 1024.0 * 1024
+            server_peak = self.memory_sampler.peak(self.server_names)
+            client_peak = self.memory_sampler.peak(self.client_names)
+            self.test_info.printt(
+                "Peak memory (PSS): servers %0.1f MiB, clients %0.1f MiB" % (
+                    server_peak / mib, client_peak / mib))
+            self.test_info.printt(
+                "Memory per session (PSS): iperf3 %0.2f MiB" % (
+                    (server_peak + client_peak) / mib / iperf_sessions))
+            self.result["memory"] = {
+                "server_peak": server_peak,
+                "client_peak": client_peak,
+            }
+            if self.use_vpp:
+                vpp_growth = self.memory_sampler.growth("VPP-PROCESS")
+                self.test_info.printt(
+                    "VPP memory (PSS): peak %0.1f MiB, growth %0.1f MiB, "
+                    "per session %0.2f MiB" % (
+                        self.memory_sampler.peak(["VPP-PROCESS"]) / mib,
+                        vpp_growth / mib,
+                        vpp_growth / mib / iperf_sessions))
+                self.result["memory"]["vpp_peak"] = \
+                    self.memory_sampler.peak(["VPP-PROCESS"])
+                self.result["memory"]["vpp_growth"] = vpp_growth
+
+# print CPU cost
+
+        if self.cpu_accounting and self.cpu_accounting.window:
+            with open("{0}/iperf3/cpu_accounting.txt".format(
+                    self.test_config['global']['log_dir']), 'w') as cpu_log:
+                self.cpu_accounting.write(cpu_log)
+            window = self.cpu_accounting.window
+            pinned_busy = self.cpu_accounting.busy(
+                set(self.corelist) | set(self.corelist_client))
+            all_busy = self.cpu_accounting.busy()
+            process_time = sum(
+                counters["user"] + counters["system"]
+                for counters in self.cpu_accounting.processes.values())
+            self.test_info.printt(
+                "CPU time in %0.1f s window: pinned cores %0.2f CPU-s, "
+                "all CPUs %0.2f CPU-s, iperf3/VPP processes %0.2f CPU-s" % (
+                    window, pinned_busy, all_busy, process_time))
+            self.result["cpu"] = {
+                "window": window,
+                "pinned_busy": pinned_busy,
+                "all_busy": all_busy,
+                "process_time": process_time,
+            }
+            if thp:
+                # CPU-seconds per Gbit equals busy cores per Gbit/s
+                gbits = thp * window
+                self.test_info.printt(
+                    "CPU cost (CPU-s per Gbit): %0.4f on pinned cores, "
+                    "%0.4f on all CPUs, %0.4f in iperf3/VPP processes" % (
+                        pinned_busy / gbits, all_busy / gbits,
+                        process_time / gbits))
+        elif self.cpu_accounting:
+            self.test_info.printt(
+                "CPU time not measured, the test ended before the "
+                "measurement window started")
+        self.result["timings"] = {
+            "duration": time.time() - test_started,
+            "vpp_startup": self.vpp_instance.startup_latency
+            if self.vpp_instance else None,
+            "exit": dict(
+                (name, exit_time - test_started)
+                for name, exit_time in self.exit_times.items()),
+            "launch_skew": launch_skew,
+        }
         self.test_info.printt("=======================================")
@@ -0,0 +1,204 @@
+"""Collection of server and client output into a single compressed log.
+
+Every process writes its standard output and error into its own pipe. A
+collector thread waits for all pipes with epoll, so the number of processes
+is not limited by FD_SETSIZE, and writes complete lines prefixed with the
+process name into a gzip file. Lines of different processes do not
+interleave, and at most max_line bytes are buffered per process.
+"""
+
+import errno
+import fcntl
+import gzip
+import os
+import resource
+import select
+import threading
+
+# file descriptors held by the harness per session: output pipes of the
+# server and the client, and pipes of subprocess.Popen while starting them
+NOFILE_PER_SESSION = 6
+# file descriptors used by everything else
+NOFILE_RESERVE = 256
+READ_SIZE = 65536
+# seconds between checks whether the collector is stopped
+POLL_TIMEOUT = 0.2
+
+
+def raise_nofile_limit(needed):
+    """Raise the soft limit of open files (and as root, the hard limit) to
+    at least needed. Children inherit the limit.
+
+    :param needed: Number of open files needed.
+    :type needed: int
+
+    :return: Soft limit of open files.
+    :rtype: int
+    """
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY or soft >= needed:
+        return soft
+    if hard != resource.RLIM_INFINITY and hard < needed:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (needed, needed))
+            return needed
+        except (ValueError, OSError):
+            # not privileged, go as high as allowed
+            needed = hard
+    resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+    return needed
+
+
+def _cloexec(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
+class LogCollector(threading.Thread):
+    """Writes output of started processes into a gzip compressed log, each
+    line prefixed with the name of the process."""
+
+    def __init__(self, path, max_line=READ_SIZE, compresslevel=1):
+        """
+        :param path: Path of the log, usually ending with .gz.
+        :param max_line: Longer lines are split.
+        :param compresslevel: gzip compression level, low to leave the CPU
+        to the test.
+        :type path: str
+        :type max_line: int
+        :type compresslevel: int
+        """
+
+        super(LogCollector, self).__init__()
+        self.daemon = True
+        self.log = gzip.open(path, "wb", compresslevel)
+        self.max_line = max_line
+        self.epoll = select.epoll()
+        # read end of a pipe -> [name, incomplete line]
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.stopping = False
+        # stdin of all processes, a pipe which is never written to, so they
+        # see an open standard input like with subprocess.PIPE
+        self.stdin, self._stdin_w = os.pipe()
+        for fd in (self.stdin, self._stdin_w):
+            _cloexec(fd)
+
+    def pipe(self, name):
+        """Create a pipe for the output of a process.
+
+        :param name: Prefix of lines written by the process.
+        :type name: str
+
+        :return: Write end of the pipe, pass it to subprocess.Popen as
+        stdout and call started() once the process is started.
+        :rtype: int
+        """
+
+        rfd, wfd = os.pipe()
+        # children get wfd as standard output only
+        for fd in (rfd, wfd):
+            _cloexec(fd)
+        flags = fcntl.fcntl(rfd, fcntl.F_GETFL)
+        fcntl.fcntl(rfd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        with self.lock:
+            self.streams[rfd] = [name, b""]
+        self.epoll.register(rfd, select.EPOLLIN)
+        return wfd
+
+    def file(self, path):
+        """Open a file for the output of a process which is not collected,
+        e.g. when it contains results.
+
+        :type path: str
+
+        :return: File descriptor, pass it to subprocess.Popen as stdout
+        and call started() once the process is started.
+        :rtype: int
+        """
+
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        _cloexec(fd)
+        return fd
+
+    def started(self, wfd):
+        """Close the harness's copy of the write end of a pipe (or of a
+        file), so that the collector sees the end of output when the
+        process exits."""
+
+        os.close(wfd)
+
+    def _write(self, name, line):
+        self.log.write(b"{0}: {1}\n".format(name, line))
+
+    def _read(self, fd):
+        try:
+            data = os.read(fd, READ_SIZE)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            data = b""
+        with self.lock:
+            stream = self.streams.get(fd)
+            if stream and not data:
+                del self.streams[fd]
+        if stream is None:
+            # taken over by stop()
+            return
+        if not data:
+            self.epoll.unregister(fd)
+            os.close(fd)
+            if stream[1]:
+                self._write(stream[0], stream[1])
+            return
+        lines = (stream[1] + data).split(b"\n")
+        stream[1] = lines.pop()
+        if len(stream[1]) >= self.max_line:
+            lines.append(stream[1])
+            stream[1] = b""
+        for line in lines:
+            self._write(stream[0], line)
+
+    def run(self):
+        while True:
+            with self.lock:
+                if self.stopping and not self.streams:
+                    break
+            try:
+                events = self.epoll.poll(POLL_TIMEOUT)
+            except IOError as e:
+                if e.errno != errno.EINTR:
+                    raise
+                continue
+            for fd, event in events:
+                self._read(fd)
+
+    def stop(self, timeout=5):
+        """Wait until all processes closed their output and close the log.
+
+        :param timeout: Maximum time to wait for the end of output, e.g. of
+        processes which were not stopped, in seconds. Output after that is
+        lost.
+        :type timeout: float
+        """
+
+        with self.lock:
+            self.stopping = True
+        if self.is_alive():
+            self.join(timeout)
+        with self.lock:
+            streams, self.streams = self.streams, {}
+        if self.is_alive():
+            # the thread is blocked in poll() at most for POLL_TIMEOUT
+            self.join(POLL_TIMEOUT * 2)
+        for fd, (name, line) in streams.items():
+            if line:
+                self._write(name, line)
+            self._write(name, "output not closed, not collected further")
+            self.epoll.unregister(fd)
+            os.close(fd)
+        self.epoll.close()
+        self.log.close()
+        os.close(self.stdin)
+        os.close(self._stdin_w)
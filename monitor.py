@@ -0,0 +1,398 @@
+"""Background sampling of resources used by VPP and iperf3 processes, and
+of TCP connection state."""
+
+import os
+import threading
+import time
+from collections import deque
+
+import psutil
+
+
+class ProcessSampler(threading.Thread):
+    """Base class for threads which sample a set of processes."""
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._processes = {}
+        self._unresolved = {}
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def add(self, name, pid=None, match=None):
+        """Add a process to be sampled.
+
+        :param name: Unique name of the process.
+        :param pid: PID of the process.
+        :param match: If pid is not known (e.g. process runs in a container),
+        called with psutil.Process instances until it returns True.
+        :type name: str
+        :type pid: int
+        :type match: callable
+        """
+
+        with self._lock:
+            if pid is not None:
+                try:
+                    self._processes[name] = psutil.Process(pid)
+                except psutil.NoSuchProcess:
+                    pass
+            else:
+                self._unresolved[name] = match
+
+    def _resolve(self):
+        if not self._unresolved:
+            return
+        for process in psutil.process_iter():
+            for name, match in self._unresolved.items():
+                try:
+                    if match(process):
+                        self._processes[name] = process
+                        del self._unresolved[name]
+                        break
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    break
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+
+class MemorySampler(ProcessSampler):
+    """Samples RSS, PSS and shared memory of a set of processes.
+
+    Samples are kept in bounded buffers and written out in bulk once the
+    test is over, so the sampler does not compete with the test for I/O.
+    """
+
+    def __init__(self, interval, max_samples=3600):
+        """
+        :param interval: Time between samples, in seconds.
+        :param max_samples: Number of samples kept per process, older samples
+        are dropped.
+        :type interval: float
+        :type max_samples: int
+        """
+
+        super(MemorySampler, self).__init__()
+        self.interval = interval
+        self.max_samples = max_samples
+        self.samples = {}
+        # first sample and highest values of every process, kept when old
+        # samples are dropped
+        self.first = {}
+        self.highest = {}
+        self._tick = 0
+
+    def add(self, name, pid=None, match=None):
+        with self._lock:
+            self.samples[name] = deque(maxlen=self.max_samples)
+            self.first.pop(name, None)
+            self.highest.pop(name, None)
+        super(MemorySampler, self).add(name, pid, match)
+
+    def sample(self):
+        with self._lock:
+            self._resolve()
+            now = time.time()
+            for name, process in self._processes.items():
+                try:
+                    mem = process.memory_full_info()
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    del self._processes[name]
+                    continue
+                if mem.rss == 0:
+                    # exited, but not reaped yet
+                    continue
+                sample = (self._tick, now, mem.rss, mem.pss, mem.shared)
+                self.samples[name].append(sample)
+                self.first.setdefault(name, sample)
+                self.highest[name] = tuple(
+                    max(values) for values
+                    in zip(self.highest.get(name, sample), sample))
+            self._tick += 1
+
+    def run(self):
+        self.sample()
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def write(self, log, names):
+        """Write samples of the specified processes into a log file.
+
+        :param log: Opened log file.
+        :param names: Names of processes.
+        :type log: file
+        :type names: list of str
+        """
+
+        lines = []
+        for name in names:
+            for tick, now, rss, pss, shared in self.samples.get(name, ()):
+                lines.append(
+                    "{0}: TIME {1:.3f} RSS {2}B PSS {3}B SHR {4}B\n".format(
+                        name, now, rss, pss, shared))
+        log.writelines(lines)
+        log.flush()
+
+    def peak(self, names, field=3):
+        """Highest combined memory of the specified processes.
+
+        :param names: Names of processes.
+        :param field: Index of the measured value in samples, 2 for RSS,
+        3 for PSS and 4 for shared memory.
+        :type names: list of str
+        :type field: int
+
+        :return: Peak of the summed memory of the processes, in bytes.
+        :rtype: int
+        """
+
+        totals = {}
+        for name in names:
+            for sample in self.samples.get(name, ()):
+                totals[sample[0]] = totals.get(sample[0], 0) + sample[field]
+        return max(totals.values()) if totals else 0
+
+    def growth(self, name, field=3):
+        """Difference between peak and first sample of a process, in
+        bytes, including samples which were dropped."""
+
+        if name not in self.first:
+            return 0
+        return self.highest[name][field] - self.first[name][field]
+
+
+# Columns of per-CPU lines in /proc/stat
+PROC_STAT_FIELDS = ("user", "nice", "system", "idle", "iowait", "irq",
+                    "softirq", "steal")
+BUSY_FIELDS = ("user", "nice", "system", "irq", "softirq", "steal")
+
+
+def read_proc_stat(proc_stat="/proc/stat"):
+    """Read time spent by each CPU in each state.
+
+    :return: Seconds spent in each of PROC_STAT_FIELDS, for each CPU.
+    :rtype: dict of dicts
+    """
+
+    ticks = float(os.sysconf("SC_CLK_TCK"))
+    cpus = {}
+    with open(proc_stat, "r") as stat:
+        for line in stat:
+            if not line.startswith("cpu") or line.startswith("cpu "):
+                continue
+            values = line.split()
+            cpus[int(values[0][3:])] = dict(
+                (field, int(value) / ticks)
+                for field, value in zip(PROC_STAT_FIELDS, values[1:]))
+    return cpus
+
+
+class CpuAccounting(ProcessSampler):
+    """Measures CPU time used by every CPU and by every process during the
+    measurement window.
+
+    /proc/stat and per-process CPU times and context switches are read when
+    the window starts and when it ends; the results are the differences.
+    """
+
+    def __init__(self, delay, duration):
+        """
+        :param delay: Time from start() to the start of the window, seconds.
+        None to start the window by calling begin().
+        :param duration: Maximum length of the window, seconds. The window
+        also ends when stop() is called.
+        :type delay: float
+        :type duration: float
+        """
+
+        super(CpuAccounting, self).__init__()
+        self.delay = delay
+        self.duration = duration
+        self.window = None
+        self.cpus = {}
+        self.processes = {}
+        self._begin = None
+        self._begin_event = threading.Event()
+
+    def begin(self):
+        """Start the measurement window now."""
+        self._begin_event.set()
+
+    def stop(self):
+        """End the window. If it did not start yet, there are no results
+        and window stays None."""
+
+        # set before waking a thread waiting for begin(), so that it does
+        # not start a window
+        self._stop_event.set()
+        self._begin_event.set()
+        super(CpuAccounting, self).stop()
+
+    def _snapshot(self):
+        with self._lock:
+            self._resolve()
+            processes = {}
+            for name, process in self._processes.items():
+                try:
+                    cpu_times = process.cpu_times()
+                    ctx_switches = process.num_ctx_switches()
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+                processes[name] = {
+                    "user": cpu_times.user,
+                    "system": cpu_times.system,
+                    "voluntary": ctx_switches.voluntary,
+                    "involuntary": ctx_switches.involuntary,
+                }
+            return time.time(), read_proc_stat(), processes
+
+    def run(self):
+        if self.delay is None:
+            self._begin_event.wait()
+            if self._stop_event.is_set():
+                return
+        elif self._stop_event.wait(self.delay):
+            return
+        self._begin = self._snapshot()
+        self._stop_event.wait(self.duration)
+        end = self._snapshot()
+
+        self.window = end[0] - self._begin[0]
+        for cpu, times in end[1].items():
+            if cpu in self._begin[1]:
+                self.cpus[cpu] = dict(
+                    (field, times[field] - self._begin[1][cpu][field])
+                    for field in PROC_STAT_FIELDS)
+        for name, counters in end[2].items():
+            if name in self._begin[2]:
+                self.processes[name] = dict(
+                    (field, counters[field] - self._begin[2][name][field])
+                    for field in counters)
+
+    def busy(self, cpus=None):
+        """CPU-seconds spent outside of idle and iowait states.
+
+        :param cpus: Count only these CPUs, all CPUs if not specified.
+        :type cpus: list of int
+
+        :rtype: float
+        """
+
+        return sum(
+            sum(times[field] for field in BUSY_FIELDS)
+            for cpu, times in self.cpus.items()
+            if cpus is None or cpu in cpus)
+
+    def write(self, log):
+        """Write per-CPU and per-process results into a log file."""
+
+        lines = ["Measurement window: {0:.3f} s\n".format(self.window or 0)]
+        for cpu in sorted(self.cpus.keys()):
+            lines.append("CPU {0}: {1}\n".format(cpu, " ".join(
+                "{0} {1:.2f}s".format(field, self.cpus[cpu][field])
+                for field in PROC_STAT_FIELDS)))
+        for name in sorted(self.processes.keys()):
+            counters = self.processes[name]
+            lines.append(
+                "{0}: user {1:.2f}s system {2:.2f}s voluntary_ctxt "
+                "{3} involuntary_ctxt {4}\n".format(
+                    name, counters["user"], counters["system"],
+                    counters["voluntary"], counters["involuntary"]))
+        log.writelines(lines)
+        log.flush()
+
+
+SOCKSTAT_FIELDS = ("inuse", "orphan", "tw", "alloc")
+
+
+def read_sockstat(sockstat="/proc/net/sockstat"):
+    """Read TCP socket counters of the network namespace.
+
+    :return: Sockets in use, orphaned, in TIME_WAIT and allocated.
+    :rtype: dict
+    """
+
+    with open(sockstat, "r") as stat:
+        for line in stat:
+            if line.startswith("TCP:"):
+                values = line.split()[1:]
+                return dict(
+                    (values[x], int(values[x + 1]))
+                    for x in range(0, len(values) - 1, 2)
+                    if values[x] in SOCKSTAT_FIELDS)
+    return {}
+
+
+class SessionSampler(threading.Thread):
+    """Samples kernel TCP socket counters (/proc/net/sockstat) and the
+    number of VPP sessions, to see how connection state grows during the
+    test."""
+
+    def __init__(self, interval, vpp_sessions=None):
+        """
+        :param interval: Time between samples, in seconds.
+        :param vpp_sessions: Returns the number of VPP sessions, or None if
+        it is not known. None if VPP is not used.
+        :type interval: float
+        :type vpp_sessions: callable
+        """
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.vpp_sessions = vpp_sessions
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def sample(self):
+        values = read_sockstat()
+        if self.vpp_sessions:
+            try:
+                count = self.vpp_sessions()
+            except RuntimeError:
+                count = None
+            if count is not None:
+                values["vpp_sessions"] = count
+        self.samples.append((time.time(), values))
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        # baseline before the test starts
+        self.sample()
+        super(SessionSampler, self).start()
+
+    def stop(self):
+        """Stop sampling and take the final sample."""
+
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.sample()
+
+    def summary(self):
+        """First, peak and last value of each counter, and the growth from
+        the first to the peak value.
+
+        :rtype: dict
+        """
+
+        summary = {}
+        for field in SOCKSTAT_FIELDS + ("vpp_sessions",):
+            values = [sample[field] for now, sample in self.samples
+                      if field in sample]
+            if not values:
+                continue
+            summary[field] = {
+                "before": values[0],
+                "peak": max(values),
+                "after": values[-1],
+                "growth": max(values) - values[0],
+            }
+        return summary
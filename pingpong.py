@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+"""TCP request/response (ping-pong) driver, used by the request/response
+test case to measure round-trip latency.
+
+The server answers every request of request_size bytes with response_size
+bytes. The client keeps one request outstanding on each of its connections
+and records the latency of every transaction, in microseconds. With --cps,
+every transaction uses a new connection which the client closes (connection
+rate test), and the latency includes the connection setup. Runs with both
+Python 2 and 3, so it can be started in containers without the rest of the
+test suite.
+"""
+
+import argparse
+import ctypes
+import errno
+import json
+import math
+import os
+import select
+import socket
+import sys
+import time
+
+# monotonic clock where available
+clock = getattr(time, "perf_counter", time.time)
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+
+
+def parse_size(size):
+    """Parse size with an optional K/M/G(B) suffix, e.g. "128KB".
+
+    :type size: str or int
+    :rtype: int
+    """
+
+    size = str(size).upper().rstrip("B")
+    if size and size[-1] in SIZE_UNITS:
+        return int(size[:-1]) * SIZE_UNITS[size[-1]]
+    return int(size)
+
+
+def set_affinity(cpu):
+    """Pin the process to a single CPU, like iperf3 -A."""
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, [cpu])
+        return
+    mask = (ctypes.c_uint64 * 16)()
+    mask[cpu // 64] = 1 << (cpu % 64)
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.sched_setaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)):
+        raise OSError(ctypes.get_errno(), "sched_setaffinity failed")
+
+
+def histogram_percentile(histogram, pct):
+    """Percentile of a latency histogram, nearest rank.
+
+    :param histogram: Number of samples of each value.
+    :param pct: Percentile, 0 to 100.
+    :type histogram: dict
+    :type pct: float
+
+    :return: Percentile, None for an empty histogram.
+    :rtype: int
+    """
+
+    total = sum(histogram.values())
+    if not total:
+        return None
+    rank = max(int(math.ceil(total * pct / 100.0)), 1)
+    count = 0
+    for value in sorted(histogram.keys(), key=int):
+        count += histogram[value]
+        if count >= rank:
+            return int(value)
+
+
+def merge_histograms(histograms):
+    merged = {}
+    for histogram in histograms:
+        for value, count in histogram.items():
+            merged[int(value)] = merged.get(int(value), 0) + count
+    return merged
+
+
+def summarize_latency(histogram):
+    """p50, p99, p99.9, mean and max of a latency histogram.
+
+    :rtype: dict
+    """
+
+    total = sum(histogram.values())
+    if not total:
+        return None
+    return {
+        "p50": histogram_percentile(histogram, 50),
+        "p99": histogram_percentile(histogram, 99),
+        "p99.9": histogram_percentile(histogram, 99.9),
+        "mean": float(sum(int(value) * count for value, count
+                          in histogram.items())) / total,
+        "max": max(int(value) for value in histogram.keys()),
+    }
+
+
+def recv_some(sock):
+    try:
+        return len(sock.recv(65536))
+    except socket.error as e:
+        if e.args[0] in (errno.EAGAIN, errno.EINTR):
+            return None
+        return 0
+
+
+def run_server(args):
+    """Answer requests until all connections of the client are closed, or
+    with idle_exit, until no connection is open for idle_exit seconds."""
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((args.bind, args.port))
+    listener.listen(1024)
+    response = b"r" * args.response_size
+    pending = {}
+    accepted = 0
+    idle_since = None
+    while pending or not accepted or args.idle_exit:
+        readable = select.select(
+            [listener] + list(pending.keys()), [], [],
+            args.idle_exit)[0]
+        if pending or not accepted:
+            idle_since = None
+        elif idle_since is None:
+            idle_since = clock()
+        elif clock() - idle_since >= args.idle_exit:
+            break
+        for sock in readable:
+            if sock is listener:
+                conn = listener.accept()[0]
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                pending[conn] = 0
+                accepted += 1
+                continue
+            received = recv_some(sock)
+            if received is None:
+                continue
+            if not received:
+                del pending[sock]
+                sock.close()
+                continue
+            pending[sock] += received
+            while pending[sock] >= args.request_size:
+                pending[sock] -= args.request_size
+                sock.sendall(response)
+    listener.close()
+
+
+def run_client(args):
+    """Run transactions on all connections for the test duration.
+
+    :return: Test results, see module description.
+    :rtype: dict
+    """
+
+    request = b"q" * args.request_size
+    sockets = []
+    try:
+        for x in range(args.parallel):
+            sock = socket.create_connection((args.client, args.port), 10)
+            sock.settimeout(None)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sockets.append(sock)
+    except socket.error as e:
+        for sock in sockets:
+            sock.close()
+        return {"error": "unable to connect to server: {0}".format(e)}
+
+    histogram = {}
+    transactions = 0
+    started = clock()
+    measure_from = started + args.omit
+    stop_at = measure_from + args.time
+    received = dict((sock, 0) for sock in sockets)
+    sent_at = {}
+    for sock in sockets:
+        sent_at[sock] = clock()
+        sock.sendall(request)
+    while received:
+        readable = select.select(list(received.keys()), [], [], 1)[0]
+        for sock in readable:
+            count = recv_some(sock)
+            if count is None:
+                continue
+            if not count:
+                for sock in sockets:
+                    sock.close()
+                return {"error": "connection closed by server"}
+            received[sock] += count
+            if received[sock] < args.response_size:
+                continue
+            now = clock()
+            if now >= measure_from:
+                latency = int((now - sent_at[sock]) * 1e6)
+                histogram[latency] = histogram.get(latency, 0) + 1
+                transactions += 1
+            received[sock] -= args.response_size
+            if now >= stop_at:
+                del received[sock]
+                continue
+            sent_at[sock] = now
+            sock.sendall(request)
+    duration = clock() - measure_from
+    for sock in sockets:
+        sock.close()
+
+    return {
+        "start": {
+            "connections": args.parallel,
+            "request_size": args.request_size,
+            "response_size": args.response_size,
+            "omit": args.omit,
+            "timestamp": time.time() - (clock() - started),
+        },
+        "end": {
+            "duration": duration,
+            "transactions": transactions,
+            "transactions_per_second": transactions / duration
+            if duration > 0 else 0.0,
+            "latency_us": summarize_latency(histogram),
+            "histogram_us": histogram,
+        },
+    }
+
+
+def run_connect_client(args):
+    """Open, use and close connections for the test duration, parallel
+    connections at a time.
+
+    :return: Test results, see module description.
+    :rtype: dict
+    """
+
+    request = b"q" * args.request_size
+    address = (args.client, args.port)
+    histogram = {}
+    completed = 0
+    failed = 0
+    started = clock()
+    measure_from = started + args.omit
+    stop_at = measure_from + args.time
+    # socket -> time the connection was opened
+    connecting = {}
+    # socket -> [time the connection was opened, bytes received]
+    waiting = {}
+    to_open = args.parallel
+
+    while connecting or waiting or to_open:
+        now = clock()
+        while to_open and now < stop_at:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(0)
+            if sock.connect_ex(address) not in (0, errno.EINPROGRESS):
+                # e.g. out of local ports
+                sock.close()
+                if now >= measure_from:
+                    failed += 1
+                break
+            connecting[sock] = now
+            to_open -= 1
+        if now >= stop_at:
+            to_open = 0
+        if not connecting and not waiting:
+            time.sleep(0.001)
+            continue
+
+        readable, writable = select.select(
+            list(waiting.keys()), list(connecting.keys()), [], 1)[:2]
+        for sock in writable:
+            opened = connecting.pop(sock)
+            if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+                sock.close()
+                if clock() >= measure_from:
+                    failed += 1
+                to_open += 1
+                continue
+            sock.setblocking(1)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.sendall(request)
+            waiting[sock] = [opened, 0]
+        for sock in readable:
+            count = recv_some(sock)
+            if count is None:
+                continue
+            waiting[sock][1] += count
+            if count and waiting[sock][1] < args.response_size:
+                continue
+            opened = waiting.pop(sock)[0]
+            sock.close()
+            to_open += 1
+            now = clock()
+            if now < measure_from:
+                continue
+            if not count:
+                # reset or closed by the server before the response
+                failed += 1
+                continue
+            latency = int((now - opened) * 1e6)
+            histogram[latency] = histogram.get(latency, 0) + 1
+            completed += 1
+    duration = clock() - measure_from
+
+    return {
+        "start": {
+            "connections": args.parallel,
+            "request_size": args.request_size,
+            "response_size": args.response_size,
+            "omit": args.omit,
+            "timestamp": time.time() - (clock() - started),
+        },
+        "end": {
+            "duration": duration,
+            "connections": completed,
+            "connections_per_second": completed / duration
+            if duration > 0 else 0.0,
+            "failed_connects": failed,
+            "latency_us": summarize_latency(histogram),
+            "histogram_us": histogram,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    role = parser.add_mutually_exclusive_group(required=True)
+    role.add_argument("-s", "--server", action="store_true")
+    role.add_argument("-c", "--client", metavar="<host>")
+    parser.add_argument("-B", "--bind", default="0.0.0.0")
+    parser.add_argument("-p", "--port", type=int, default=5201)
+    parser.add_argument("-P", "--parallel", type=int, default=1,
+                        help="Number of connections.")
+    parser.add_argument("-t", "--time", type=float, default=10,
+                        help="Measured time in seconds.")
+    parser.add_argument("-O", "--omit", type=float, default=0,
+                        help="Warm-up time in seconds, not measured.")
+    parser.add_argument("-q", "--request_size", type=parse_size, default=64)
+    parser.add_argument("-r", "--response_size", type=parse_size,
+                        default=64)
+    parser.add_argument("--cps", action="store_true",
+                        help="Use a new connection for every transaction.")
+    parser.add_argument("--idle_exit", type=float, metavar="<seconds>",
+                        help="Server exits after no connection is open for "
+                             "this long.")
+    parser.add_argument("-A", "--affinity", type=int, metavar="<cpu>")
+    parser.add_argument("--logfile", metavar="<path>",
+                        help="Write client results as JSON into a file.")
+    args = parser.parse_args()
+
+    if args.affinity is not None:
+        set_affinity(args.affinity)
+    if args.server:
+        run_server(args)
+        return 0
+    result = run_connect_client(args) if args.cps else run_client(args)
+    if args.logfile:
+        with open(args.logfile, "w") as logfile:
+            json.dump(result, logfile)
+    else:
+        json.dump(result, sys.stdout)
+    return 1 if "error" in result else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
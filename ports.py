@@ -0,0 +1,137 @@
+"""Allocation of server ports for test sessions.
+
+Ports are checked in one pass over the port range: held kernel ports are
+found by binding to them, ports held in VPP's session layer from the output
+of show session verbose. Servers and clients of a session both use the port
+from the resulting map.
+"""
+
+import errno
+import re
+import socket
+
+from base_tc import vppctl
+
+# local port of a session in show session verbose, e.g.
+# [0:0][T] 6.0.1.1:5201->6.0.1.2:47856 ESTABLISHED
+VPP_SESSION_PORT = re.compile(r":(\d+)->")
+LAST_PORT = 65535
+
+
+def vpp_ports(output):
+    """Local ports of sessions and listeners in output of VPP show session
+    verbose.
+
+    :type output: str
+    :rtype: set of int
+    """
+
+    return set(int(port) for port in VPP_SESSION_PORT.findall(output))
+
+
+def port_free(port, address=""):
+    """Check whether a listener could bind to a kernel port.
+
+    SO_REUSEADDR is set like by servers, so ports of connections in
+    TIME_WAIT are available.
+
+    :param port: Port number.
+    :param address: Local address, all addresses by default.
+    :type port: int
+    :type address: str
+
+    :rtype: bool
+    """
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((address, port))
+    except socket.error as e:
+        if e.args[0] not in (errno.EADDRINUSE, errno.EACCES):
+            raise
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+class PortAllocator(object):
+    """Finds ports for sessions which are not used in the kernel, nor (with
+    use_vpp) in VPP."""
+
+    def __init__(self, first_port, use_vpp=False, test_info=None):
+        """
+        :param first_port: Lowest port to use.
+        :param use_vpp: Also skip ports of sessions in VPP.
+        :param test_info: Output of messages.
+        :type first_port: int
+        :type use_vpp: bool
+        :type test_info: TestInfo
+        """
+
+        self.first_port = first_port
+        self.use_vpp = use_vpp
+        self.test_info = test_info
+        # ports skipped by the last allocate()
+        self.skipped = []
+
+    def _print(self, s):
+        if self.test_info:
+            self.test_info.printt(s)
+        else:
+            print s
+
+    def _vpp_ports(self):
+        """Ports of VPP sessions.
+
+        :raises RuntimeError: If the sessions can not be read, ports in use
+        in VPP would not be skipped.
+        """
+
+        try:
+            returncode, output = vppctl("show session verbose", timeout=10)
+        except RuntimeError as e:
+            raise RuntimeError("Unable to read VPP sessions: {0}".format(e))
+        if returncode:
+            raise RuntimeError("Unable to read VPP sessions: {0}".format(
+                output.strip()))
+        return vpp_ports(output)
+
+    def allocate(self, count, contiguous=False):
+        """Find ports for count sessions.
+
+        :param count: Number of ports.
+        :param contiguous: Return consecutive ports only.
+        :type count: int
+        :type contiguous: bool
+
+        :return: Port of every session.
+        :rtype: list of int
+        :raises RuntimeError: If there are not enough free ports, or VPP
+        sessions can not be read.
+        """
+
+        used = self._vpp_ports() if self.use_vpp else set()
+        ports = []
+        self.skipped = []
+        port = self.first_port
+        while len(ports) < count and port <= LAST_PORT:
+            if port in used or not port_free(port):
+                self.skipped.append(port)
+                if contiguous:
+                    ports = []
+            else:
+                ports.append(port)
+            port += 1
+        if len(ports) < count:
+            raise RuntimeError(
+                "Only {0} of {1} {2}ports available from port {3}.".format(
+                    len(ports), count, "consecutive " if contiguous else "",
+                    self.first_port))
+        if self.skipped:
+            self._print("{0} ports in use, skipped: {1}{2}".format(
+                len(self.skipped),
+                ", ".join(str(port) for port in self.skipped[:20]),
+                ", ..." if len(self.skipped) > 20 else ""))
+        return ports
@@ -0,0 +1,233 @@
+"""SQLite store of test results, indexed by a hash of the effective test
+configuration."""
+
+import hashlib
+import json
+import socket
+import sqlite3
+import time
+
+import stats
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    config_hash TEXT NOT NULL,
+    config TEXT NOT NULL,
+    name TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL NOT NULL,
+    valid INTEGER NOT NULL,
+    throughput REAL,
+    average REAL,
+    failed_sessions INTEGER,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_config_hash ON runs (config_hash, valid);
+CREATE TABLE IF NOT EXISTS sessions (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    session INTEGER NOT NULL,
+    throughput REAL,
+    PRIMARY KEY (run_id, session)
+);
+"""
+
+CSV_COLUMNS = ("sessions", "connections", "message_size", "procdist", "vpp",
+               "docker", "vpp_numa", "vpp_params", "vcl_params", "workload")
+
+# latency percentiles of request/response tests, in microseconds
+LATENCY_COLUMNS = ("p50", "p99", "p99.9")
+
+
+def config_hash(config):
+    """Stable hash of a JSON serializable configuration.
+
+    :type config: dict
+    :rtype: str
+    """
+
+    return hashlib.sha1(json.dumps(config, sort_keys=True)).hexdigest()
+
+
+def file_hash(path):
+    """SHA1 of file contents, used to identify VPP and VCL builds.
+
+    :return: Hex digest, None if the file can not be read.
+    :rtype: str
+    """
+
+    digest = hashlib.sha1()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), ""):
+                digest.update(chunk)
+    except (IOError, OSError):
+        return None
+    return digest.hexdigest()
+
+
+class ResultStore(object):
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def has_valid(self, key):
+        """Check whether a valid result exists for configuration hash."""
+        return self.count_valid(key) > 0
+
+    def count_valid(self, key):
+        return self.db.execute(
+            "SELECT COUNT(*) FROM runs WHERE config_hash = ? AND valid = 1",
+            (key,)).fetchone()[0]
+
+    def valid_throughputs(self, key):
+        """Total throughput of all valid runs of a configuration hash, in
+        the order they were run.
+
+        :rtype: list of float
+        """
+
+        return [row[0] for row in self.db.execute(
+            "SELECT throughput FROM runs WHERE config_hash = ? AND valid = 1 "
+            "ORDER BY id", (key,))]
+
+    def summaries(self, outlier_threshold=3.5):
+        """Statistics of repeated runs of every configuration with valid
+        results, see stats.aggregate.
+
+        :return: Configuration hash -> (configuration, IDs of outlier
+        runs, statistics).
+        :rtype: dict
+        """
+
+        runs = {}
+        for key, config, run_id, throughput in self.db.execute(
+                "SELECT config_hash, config, id, throughput FROM runs "
+                "WHERE valid = 1 ORDER BY id"):
+            runs.setdefault(key, (json.loads(config), [], []))
+            runs[key][1].append(run_id)
+            runs[key][2].append(throughput)
+        summaries = {}
+        for key, (config, ids, throughputs) in runs.items():
+            summary = stats.aggregate(throughputs, outlier_threshold)
+            summaries[key] = (config, [ids[x] for x in summary["outliers"]],
+                              summary)
+        return summaries
+
+    def latest_valid(self, key):
+        """Latest valid result of a configuration hash.
+
+        :return: Total throughput and number of failed sessions, None if
+        there is no valid result.
+        :rtype: dict
+        """
+
+        row = self.db.execute(
+            "SELECT throughput, failed_sessions FROM runs "
+            "WHERE config_hash = ? AND valid = 1 ORDER BY id DESC LIMIT 1",
+            (key,)).fetchone()
+        if row is None:
+            return None
+        return {"throughput": row[0], "failed_sessions": row[1]}
+
+    def add(self, config, name, started, result, metadata=None):
+        """Store result of a test run.
+
+        :param config: Effective test configuration.
+        :param name: Test run name.
+        :param started: Start time of the test run.
+        :param result: Parsed test results with keys throughput, average,
+        failed_sessions and sessions (throughput of each session),
+        None if the test failed.
+        :param metadata: Any additional information about the run.
+
+        :type config: dict
+        :type name: str
+        :type started: float
+        :type result: dict
+        :type metadata: dict
+
+        :return: ID of the stored run.
+        :rtype: int
+        """
+
+        if metadata is None:
+            metadata = {}
+        metadata.setdefault("host", socket.gethostname())
+        result = result or {}
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO runs (config_hash, config, name, started, "
+                "finished, valid, throughput, average, failed_sessions, "
+                "metadata) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (config_hash(config), json.dumps(config, sort_keys=True),
+                 name, started, time.time(), 1 if result else 0,
+                 result.get("throughput"), result.get("average"),
+                 result.get("failed_sessions"), json.dumps(metadata)))
+            run_id = cursor.lastrowid
+            self.db.executemany(
+                "INSERT INTO sessions (run_id, session, throughput) "
+                "VALUES (?, ?, ?)",
+                [(run_id, session, throughput) for session, throughput
+                 in sorted(result.get("sessions", {}).items())])
+        return run_id
+
+    def export_csv(self, path, outlier_threshold=3.5):
+        """Write all runs into a semicolon separated file. Runs which are
+        outliers among the runs of their configuration are marked."""
+
+        outliers = set()
+        for config, ids, summary in self.summaries(
+                outlier_threshold).values():
+            outliers.update(ids)
+        with open(path, "w") as result_file:
+            result_file.write(
+                "Sessions;Connections/Session;Message size;Test Case;VPP;"
+                "Docker;VPP NUMA;VPP Parameters;VCL Parameters;Workload;"
+                "Total Throughput;Average per Session;"
+                "Failed Sessions;P50 Latency;P99 Latency;P99.9 Latency;"
+                "Outlier\n")
+            for row in self.db.execute(
+                    "SELECT config, valid, throughput, average, "
+                    "failed_sessions, metadata, id FROM runs ORDER BY id"):
+                config = json.loads(row[0])
+                for column in CSV_COLUMNS:
+                    result_file.write("{0};".format(config.get(column, "")))
+                if row[1]:
+                    latency = json.loads(row[5] or "{}").get("latency") or {}
+                    result_file.write("{0:.3f};{1:.3f};{2};{3};{4}\n".format(
+                        row[2], row[3], row[4], ";".join(
+                            str(latency.get(column, ""))
+                            for column in LATENCY_COLUMNS),
+                        "yes" if row[6] in outliers else "no"))
+                else:
+                    result_file.write("N/A;N/A;N/A;;;;\n")
+
+    def export_summary_csv(self, path, outlier_threshold=3.5):
+        """Write statistics of repeated runs of every configuration into a
+        semicolon separated file, outliers excluded."""
+
+        rows = sorted(
+            ([config.get(column, "") for column in CSV_COLUMNS], summary)
+            for config, ids, summary in self.summaries(
+                outlier_threshold).values())
+        with open(path, "w") as summary_file:
+            summary_file.write(
+                "Sessions;Connections/Session;Message size;Test Case;VPP;"
+                "Docker;VPP NUMA;VPP Parameters;VCL Parameters;Workload;"
+                "Runs;Outliers;Mean Throughput;Median Throughput;"
+                "Stddev;95% CI;95% CI Relative\n")
+            for columns, summary in rows:
+                summary_file.write("{0};{1};{2};{3:.3f};{4:.3f};{5:.3f};"
+                                   "{6:.3f};{7:.4f}\n".format(
+                                       ";".join(str(x) for x in columns),
+                                       summary["runs"],
+                                       len(summary["outliers"]),
+                                       summary["mean"], summary["median"],
+                                       summary["stdev"], summary["ci95"],
+                                       summary["ci95_relative"]))
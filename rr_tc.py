@@ -0,0 +1,456 @@
+import json
+import os
+import signal
+import subprocess
+import time
+from itertools import cycle
+import ipaddress
+
+from base_tc import TestInfo, docker_cleanup, TCPStackBaseTestCase, \
+    vppctl, count_sessions
+from supervisor import ProcessSupervisor, StartBarrier
+from docker_api import DockerClient, run_labels, label_options
+from docker_pool import results_volume
+from monitor import SessionSampler
+from ports import PortAllocator
+from log_collector import LogCollector, raise_nofile_limit, \
+    NOFILE_PER_SESSION, NOFILE_RESERVE
+import pingpong
+
+# the driver is mounted into containers from this directory
+DRIVER_DIR = os.path.dirname(os.path.abspath(pingpong.__file__))
+DRIVER = os.path.join(DRIVER_DIR, "pingpong.py")
+
+
+def ip_addresses(first, count):
+    """count consecutive IPv4 addresses starting with first.
+
+    :rtype: list of str
+    """
+
+    if first == "localhost":
+        first = "127.0.0.1"
+    first = ipaddress.ip_address(unicode(first))
+    return [str(first + x) for x in range(count)]
+
+
+# names of SessionSampler counters in the test log
+SESSION_TABLE_NAMES = {
+    "inuse": "Kernel TCP sockets in use",
+    "orphan": "Kernel orphaned TCP sockets",
+    "tw": "Kernel TCP sockets in TIME_WAIT",
+    "alloc": "Kernel allocated TCP sockets",
+    "vpp_sessions": "VPP sessions",
+}
+
+
+class RequestResponseTestCase(TCPStackBaseTestCase):
+    """Round-trip latency of small messages, measured with the bundled
+    ping-pong driver (pingpong.py) in place of iperf3."""
+
+    # section of config.yml, also name of the log directory
+    section = "rr"
+    # prefix of process names in logs
+    label = "RR"
+    title = "request/response latency"
+    # a new connection for every transaction (pingpong.py --cps)
+    connect_rate = False
+    # per session result of clients, in the test result log directory
+    result_suffix = ".json"
+    # client results are printed on standard output instead of --logfile
+    client_stdout_result = False
+    rate_key = "transactions_per_second"
+    unit = "transactions"
+    # servers exit by themselves after the clients, otherwise they are
+    # terminated once all clients exited
+    servers_exit = True
+
+    def __init__(self, test_config, use_vpp=True, use_docker=False,
+                 corelist=None, corelist_client=None, vpp_running=False,
+                 container_pool=None):
+        super(RequestResponseTestCase, self).__init__(test_config, use_vpp)
+
+        log_dir = "{0}/{1}/{1}".format(
+            self.test_config['global']['log_dir'], self.section)
+        self.output_log_file = log_dir + "_output_log.txt.gz"
+        self.use_vpp = use_vpp
+        self.use_docker = use_docker
+        self.corelist = corelist
+        self.corelist_client = corelist_client if corelist_client else corelist
+        self.vpp_running = vpp_running
+        self.container_pool = container_pool if use_docker else None
+        self.docker = None
+        self.docker_labels = None
+        if use_docker and not self.container_pool:
+            self.docker = DockerClient(
+                self.test_config['global']['docker_socket'])
+            self.docker_labels = run_labels()
+        # structured results of the test, filled in by runTest
+        self.result = None
+
+    def _program(self, role):
+        """Program of servers or clients with its first arguments.
+
+        :param role: "server" or "client".
+        :type role: str
+
+        :rtype: list of str
+        """
+
+        options = self.test_config[self.section]
+        return [options['docker_python'] if self.use_docker
+                else options['python'], DRIVER]
+
+    def _server_args(self, i, cpu, bind, port):
+        options = self.test_config[self.section]
+        args = "-s -B {0} -p {1} -A {2} -q {3} -r {4}".format(
+            bind, port, cpu, options['request_size'],
+            options['response_size'])
+        if self.connect_rate:
+            # servers do not see the end of the test in closed connections
+            args += " --idle_exit {0}".format(options['server_idle_exit'])
+        return args
+
+    def _client_args(self, i, cpu, target, port, output_file):
+        options = self.test_config[self.section]
+        args = "-c {0} -p {1} -P {2} -t {3} -O {4} -A {5} -q {6} -r {7}" \
+               " --logfile {8}".format(
+                   target, port, options['connections_per_session'],
+                   options['test_duration'], options['warmup'], cpu,
+                   options['request_size'], options['response_size'],
+                   output_file)
+        if self.connect_rate:
+            args += " --cps"
+        return args
+
+    def _preexec(self, cpu):
+        """Function run in forked servers and clients before they execute
+        the program, None if the program pins itself to its CPU."""
+
+        return None
+
+    def _load_result(self, output_file):
+        """Client results in the format of pingpong.py.
+
+        :raises IOError: If the file can not be read.
+        :raises ValueError: If it does not contain results.
+        """
+
+        with open(output_file, "r") as output:
+            return json.load(output)
+
+    def _session_error(self, results_json):
+        """Error of a failed session, None if the session succeeded.
+
+        :param results_json: Loaded client results, see _load_result.
+        :type results_json: dict
+        """
+
+        return results_json.get("error")
+
+    def _command_prefix(self, role, i, cpu, ip, vcl_conf):
+        """Command which runs the program locally or in a container."""
+
+        program = self._program(role)
+        if self.container_pool:
+            env = {"VCL_CONFIG": vcl_conf} if self.use_vpp and vcl_conf \
+                else {}
+            return " ".join([self.container_pool.exec_prefix(
+                "{0}-{1}".format(role, i), env, self.use_vpp)] + program)
+        if self.use_docker:
+            options = [
+                label_options(self.docker_labels),
+                "--cpuset-cpus {0}".format(cpu),
+                "-v /dev/shm:/dev/shm",
+                "-v {0}:{0}".format(self.test_config["global"]["log_dir"]),
+                "-v {0}:{0}:ro".format(DRIVER_DIR),
+                "--entrypoint {0}".format(program[0]),
+            ]
+            if self.use_vpp and vcl_conf:
+                options.append("-v {0}:{0}:ro -e VCL_CONFIG={0}".format(
+                    vcl_conf))
+            if not self.use_vpp:
+                options.append("--ip {0}".format(ip))
+            return " ".join([
+                "docker run -i --net vcl_docker_net --rm"] + options + [
+                "vcl_iperf3_preload" if self.use_vpp else "vcl_iperf3"]
+                + program[1:])
+        return " ".join(program)
+
+    def runTest(self):
+        """ Testing TCP stack using request/response clients and servers """
+        test_result_file = "{0}/{1}_test.txt".format(
+            self.test_result_dir, self.section)
+        self.test_info = TestInfo(test_result_file)
+
+        self.test_info.printt("=======================================")
+        self.test_info.printt("Testing TCP stack {0}\n".format(self.title))
+        test_started = time.time()
+        self.result = {"sessions": {}, "session_latency": {}, "errors": {}}
+        options = self.test_config[self.section]
+        sessions = options['sessions']
+        log_dir = self.test_config['global']['log_dir']
+        supervisor = ProcessSupervisor(self.test_info)
+        servers = ProcessSupervisor(self.test_info)
+        env = None
+        vcl_conf = self.test_config["vcllib"].get("conf")
+
+        host = self.test_config['global']['host'] if self.use_vpp \
+            or self.use_docker else "localhost"
+        output_files = [
+            "{0}/{1}/{1}_session_{2}{3}".format(
+                log_dir, self.section, i, self.result_suffix)
+            for i in range(sessions)]
+        for output_file in output_files:
+            try:
+                os.remove(output_file)
+            except OSError:
+                pass
+
+        vpp_ready = False
+        if self.use_vpp and self.vpp_running:
+            self.test_info.printt("Using already running VPP instance.")
+            vpp_ready = True
+        elif self.use_vpp:
+            vpp_ready = self.start_vpp()
+        if vpp_ready and not self.use_docker:
+            env = dict(os.environ, LD_PRELOAD=self.vcllib)
+            if vcl_conf:
+                env["VCL_CONFIG"] = vcl_conf
+
+        if self.docker:
+            self.test_info.printt("Configuring docker network.")
+            self.docker.ensure_network(
+                "vcl_docker_net", "192.168.0.0/16", self.docker_labels)
+
+        nofile = raise_nofile_limit(
+            NOFILE_PER_SESSION * sessions + NOFILE_RESERVE)
+        self.test_info.printt("Open files limit: {0}".format(nofile))
+        # output of all servers and clients, prefixed with their names
+        collector = LogCollector(self.output_log_file)
+        collector.start()
+
+        ports = PortAllocator(
+            options['default_port'], vpp_ready, self.test_info).allocate(
+                sessions)
+
+        server_ips = ip_addresses(host, sessions)
+        client_ips = ip_addresses(server_ips[-1], sessions + 1)[1:]
+        placement = zip(range(sessions), cycle(self.corelist),
+                        cycle(self.corelist_client), server_ips, client_ips)
+
+        if self.container_pool:
+            image = "vcl_iperf3_preload" if self.use_vpp else "vcl_iperf3"
+            volumes = set(["/dev/shm", DRIVER_DIR, results_volume(log_dir)])
+            if self.use_vpp and vcl_conf:
+                volumes.add(os.path.dirname(os.path.abspath(vcl_conf)))
+            volumes = tuple(sorted(volumes))
+            specs = {}
+            for i, cpu, cpu_client, server_ip, client_ip in placement:
+                specs["server-{0}".format(i)] = (
+                    image, str(cpu),
+                    None if self.use_vpp else server_ip, volumes)
+                specs["client-{0}".format(i)] = (
+                    image, str(cpu_client),
+                    None if self.use_vpp else client_ip, volumes)
+            self.container_pool.prepare(specs)
+            self.container_pool.signal_processes(signal.SIGKILL)
+
+# start servers
+
+        for i, cpu, cpu_client, server_ip, client_ip in placement:
+            bind = host if self.use_vpp or not self.use_docker else server_ip
+            command = "{0} {1}".format(
+                self._command_prefix("server", i, cpu, server_ip, vcl_conf),
+                self._server_args(
+                    i, cpu, "127.0.0.1" if bind == "localhost" else bind,
+                    ports[i]))
+            self.test_info.printt(command)
+            name = "{0}-SERVER-{1}".format(self.label, i)
+            output = collector.pipe(name)
+            servers.add(name, subprocess.Popen(
+                command.split(" "), env=env, stdin=collector.stdin,
+                stdout=output, stderr=subprocess.STDOUT,
+                preexec_fn=self._preexec(cpu)))
+            collector.started(output)
+        self.test_info.printt("{0}-SERVER(s) running...".format(self.label))
+        time.sleep(1)
+
+        sampler = None
+        if self.connect_rate:
+            sampler = SessionSampler(
+                options['sample_interval'],
+                (lambda: count_sessions(vppctl("show session")[1]))
+                if vpp_ready else None)
+            sampler.start()
+
+# start clients, all at once
+
+        barrier = StartBarrier()
+        client_outputs = []
+        for i, cpu, cpu_client, server_ip, client_ip in placement:
+            target = host if self.use_vpp or not self.use_docker \
+                else server_ip
+            command = "{0} {1}".format(
+                self._command_prefix(
+                    "client", i, cpu_client, client_ip, vcl_conf),
+                self._client_args(
+                    i, cpu_client,
+                    "127.0.0.1" if target == "localhost" else target,
+                    ports[i], output_files[i]))
+            self.test_info.printt(command)
+            if self.client_stdout_result:
+                output = collector.file(output_files[i])
+            else:
+                output = collector.pipe(
+                    "{0}-CLIENT-{1}".format(self.label, i))
+            client_outputs.append(output)
+            barrier.spawn(command.split(" "), env=env, stdin=collector.stdin,
+                          stdout=output, stderr=subprocess.STDOUT,
+                          preexec_fn=self._preexec(cpu_client))
+        processes = barrier.release()
+        for output in client_outputs:
+            collector.started(output)
+        for i, process in enumerate(processes):
+            if process is None:
+                self.test_info.printt(
+                    "{0}-CLIENT-{1}: failed to start: {2}".format(
+                        self.label, i, barrier.errors[i]))
+            else:
+                supervisor.add(
+                    "{0}-CLIENT-{1}".format(self.label, i), process)
+        self.test_info.printt("{0}-CLIENT(s) running...".format(self.label))
+
+# wait until test is done
+
+        def on_exit(name, process):
+            group = servers if name in servers.start_times else supervisor
+            self.test_info.printt("{}: Stopped after {:.3f} seconds".format(
+                name, group.exit_times[name] - group.start_times[name]))
+
+        timeout = options['test_duration'] + options.get('warmup', 0) \
+            + options['additional_timeout']
+        self.test_info.printt(
+            "{0}-TEST is running... timeout: {1} seconds".format(
+                self.label, timeout))
+        deadline = time.time() + timeout
+        if supervisor.wait(timeout, on_exit):
+            supervisor.stop(on_exit=on_exit)
+        if servers.wait(max(deadline - time.time(), 0)
+                        if self.servers_exit else 0, on_exit):
+            servers.stop(on_exit=on_exit)
+        if sampler:
+            sampler.stop()
+        if self.container_pool:
+            self.container_pool.signal_processes(signal.SIGKILL)
+        collector.stop()
+        if self.vpp_instance:
+            self.vpp_instance._stop_vpp()
+        if self.docker:
+            docker_cleanup(self.docker, self.docker_labels, self.test_info)
+
+# print per session results
+
+        self.test_info.printt("\nTest results:")
+        histograms = []
+        total_rate = 0.0
+        failed_connects = 0
+        ok_sessions = 0
+        zero_sessions = 0
+        for i, output_file in enumerate(output_files):
+            try:
+                results_json = self._load_result(output_file)
+            except (IOError, ValueError) as e:
+                self.test_info.printt("{}: {}".format(e, output_file))
+                continue
+            error = self._session_error(results_json)
+            if error:
+                self.result["errors"][i] = error
+                self.test_info.printt("{0}-SESSION-{1}: {2}".format(
+                    self.label, i, error))
+                continue
+            rate = results_json["end"][self.rate_key]
+            latency = results_json["end"]["latency_us"]
+            self.result["sessions"][i] = rate
+            self.result["session_latency"][i] = latency
+            histograms.append(results_json["end"]["histogram_us"])
+            total_rate += rate
+            failed_connects += results_json["end"].get("failed_connects", 0)
+            if latency is None:
+                zero_sessions += 1
+                self.test_info.printt("{0}-SESSION-{1}: no {2}".format(
+                    self.label, i, self.unit))
+                continue
+            ok_sessions += 1
+            self.test_info.printt(
+                "%s-SESSION-%d: %0.0f %s/sec, latency p50 %d us, "
+                "p99 %d us, p99.9 %d us" % (
+                    self.label, i, rate, self.unit, latency["p50"],
+                    latency["p99"], latency["p99.9"]))
+
+# print test results
+
+        latency = pingpong.summarize_latency(
+            pingpong.merge_histograms(histograms))
+        self.test_info.printt("\nTotal sessions: {}".format(sessions))
+        self.test_info.printt("Connections per session: {}".format(
+            options['connections_per_session']))
+        self.test_info.printt("Succesful sessions: {}".format(ok_sessions))
+        self.test_info.printt("Failed to connect sessions: {}".format(
+            sessions - ok_sessions - zero_sessions))
+        if ok_sessions:
+            self.test_info.printt(
+                "%s: %0.0f/sec, %0.0f/sec per session" % (
+                    self.unit.capitalize(), total_rate,
+                    total_rate / ok_sessions))
+            self.test_info.printt(
+                "Latency of all sessions: p50 %d us, p99 %d us, "
+                "p99.9 %d us" % (
+                    latency["p50"], latency["p99"], latency["p99.9"]))
+        if self.connect_rate:
+            self.test_info.printt(
+                "Failed connects: {}".format(failed_connects))
+            self.result["failed_connects"] = failed_connects
+        if sampler:
+            self.result["session_table"] = sampler.summary()
+            for field, values in sorted(
+                    self.result["session_table"].items()):
+                self.test_info.printt(
+                    "{0}: before {1}, peak {2} (+{3}), after {4}".format(
+                        SESSION_TABLE_NAMES.get(field, field),
+                        values["before"], values["peak"],
+                        values["growth"], values["after"]))
+        self.result.update({
+            # rate per second, stored like iperf3 throughput
+            "throughput": total_rate if ok_sessions else None,
+            "average": total_rate / ok_sessions if ok_sessions else None,
+            "ok_sessions": ok_sessions,
+            "failed_sessions": sessions - ok_sessions - zero_sessions,
+            "zero_sessions": zero_sessions,
+            "latency": latency,
+            "timings": {
+                "duration": time.time() - test_started,
+                "vpp_startup": self.vpp_instance.startup_latency
+                if self.vpp_instance else None,
+                "exit": dict(
+                    (name, exit_time - test_started)
+                    for name, exit_time in
+                    supervisor.exit_times.items() +
+                    servers.exit_times.items()),
+            },
+        })
+        self.test_info.printt("=======================================")
+
+
+class ConnectRateTestCase(RequestResponseTestCase):
+    """Connection establishment rate: every transaction of pingpong.py uses
+    a new connection, closed by the client. Kernel TIME_WAIT sockets and
+    VPP sessions are sampled during the test to show how connection state
+    grows."""
+
+    section = "cps"
+    label = "CPS"
+    title = "connection rate"
+    connect_rate = True
+    rate_key = "connections_per_second"
+    unit = "connections"
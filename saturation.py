@@ -0,0 +1,61 @@
+"""Search for the point where aggregate throughput stops scaling.
+
+Instead of measuring every value of an axis (e.g. number of sessions), the
+axis is bisected for the first value after which throughput scales worse
+than min_scaling times linearly, assuming throughput grows, then levels off
+or drops. Scaling is relative to the step between values, so the result does
+not depend on how dense the axis is. A value whose test failed, or failed
+for too many sessions, ends the growth.
+Throughput of a plateau does not have a single maximum, so bisection on the
+gain between neighbouring values is used rather than golden-section search.
+"""
+
+
+def find_knee(values, measure, min_scaling=0.1):
+    """Bisect an axis for its saturation point.
+
+    :param values: Positive axis values in increasing order.
+    :param measure: Called as measure(value), returns aggregate throughput,
+    or None if the test failed or is not acceptable. Results should be
+    cached, a value is measured at most once by this function.
+    :param min_scaling: Relative throughput gain between neighbouring
+    values, as a fraction of their relative difference (1 is linear
+    scaling), below which throughput is considered not improving.
+    :type values: list
+    :type measure: callable
+    :type min_scaling: float
+
+    :return: Index of the first value after which throughput stops
+    improving (the last index if it improves everywhere, None if the first
+    value fails), and measured points as (value, throughput) pairs in axis
+    order.
+    :rtype: tuple
+    """
+
+    measured = {}
+
+    def throughput(index):
+        if index not in measured:
+            measured[index] = measure(values[index])
+        return measured[index]
+
+    def improving(index):
+        current = throughput(index)
+        following = throughput(index + 1)
+        if current is None or following is None:
+            return False
+        step = float(values[index + 1]) / values[index] - 1
+        return following >= current * (1 + min_scaling * step)
+
+    knee = None
+    if values and throughput(0) is not None:
+        low, high = 0, len(values) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if improving(middle):
+                low = middle + 1
+            else:
+                high = middle
+        knee = low
+    return knee, [(values[index], measured[index])
+                  for index in sorted(measured.keys())]
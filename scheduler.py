@@ -0,0 +1,96 @@
+"""Runs independent test runs concurrently on disjoint CPU partitions."""
+
+from supervisor import ProcessSupervisor
+
+
+def partition_cores(ht_pairs, numa_topology, count):
+    """Split physical cores into disjoint partitions of logical CPUs.
+
+    Every NUMA node is split separately and each partition receives an equal
+    share of every node, so that cross-NUMA distributions remain possible
+    within a partition. Hyperthreading twins always stay together.
+
+    :param ht_pairs: Dictionary of Hyperthreading CPU pairs.
+    :param numa_topology: List of physical CPUs in each NUMA node.
+    :param count: Number of partitions to create.
+
+    :type ht_pairs: dict
+    :type numa_topology: list of lists
+    :type count: int
+
+    :return: Logical CPUs of each partition.
+    :rtype: list of lists
+    """
+
+    if not numa_topology:
+        numa_topology = [sorted(ht_pairs.keys())]
+    partitions = [[] for x in range(count)]
+    for numa in numa_topology:
+        physcores = [physcore for physcore in numa if physcore in ht_pairs]
+        chunk = len(physcores) / count
+        if chunk == 0:
+            raise RuntimeError(
+                "Not enough physical cores in NUMA node for {0} partitions: "
+                "{1}".format(count, physcores))
+        for x in range(count):
+            for physcore in physcores[x * chunk:(x + 1) * chunk]:
+                partitions[x].extend(ht_pairs[physcore])
+    for partition in partitions:
+        partition.sort()
+    return partitions
+
+
+class PartitionScheduler(object):
+    """Dispatches jobs onto CPU partitions, one job per partition at a time.
+
+    Each partition owns a range of ports starting at
+    default_port + index * port_stride, so concurrent runs never compete for
+    the same ports.
+    """
+
+    def __init__(self, partitions, default_port, port_stride):
+        self.partitions = partitions
+        self.default_port = default_port
+        self.port_stride = port_stride
+        # sum of the durations of all finished jobs
+        self.busy_time = 0.0
+
+    def run(self, jobs, start_job, finish_job):
+        """Run all jobs, keeping every partition busy until the queue drains.
+
+        :param jobs: Jobs to run, passed back to the callbacks untouched.
+        :param start_job: Called as start_job(job, cores, port, slot), must
+        return a started subprocess.Popen instance.
+        :param finish_job: Called as finish_job(job, duration) when the
+        job's process exits. Return False to put the job back into the queue.
+
+        :type jobs: list
+        :type start_job: callable
+        :type finish_job: callable
+        """
+
+        pending = list(jobs)
+        free = range(len(self.partitions))
+        running = {}
+        supervisor = ProcessSupervisor()
+
+        def on_exit(slot, process):
+            job = running.pop(slot)
+            duration = supervisor.exit_times[slot] - \
+                supervisor.start_times[slot]
+            self.busy_time += duration
+            free.append(slot)
+            if finish_job(job, duration) is False:
+                pending.append(job)
+
+        while pending or running:
+            while pending and free:
+                slot = free.pop(0)
+                job = pending.pop(0)
+                running[slot] = job
+                supervisor.add(slot, start_job(
+                    job,
+                    self.partitions[slot],
+                    self.default_port + slot * self.port_stride,
+                    slot))
+            supervisor.wait(None, on_exit, first=True)
@@ -0,0 +1,313 @@
+"""Parser and generator of the VPP startup configuration and of the VCL
+configuration, used to find the CPU cores occupied by VPP and to sweep VPP
+and VCL parameters."""
+
+import os
+import re
+
+from topology import parse_cpulist
+
+# cpu section options followed by a value
+CPU_OPTIONS = ("main-core", "corelist-workers", "coremask-workers", "workers",
+               "skip-cores", "scheduler-policy", "scheduler-priority")
+
+
+def tokenize(text):
+    """Split startup configuration into words and braces, without
+    comments."""
+
+    text = "\n".join(line.split("#")[0] for line in text.splitlines())
+    return re.findall(r"[{}]|[^\s{}]+", text)
+
+
+def get_section(text, name):
+    """Words of a top level section, e.g. cpu { ... }.
+
+    :param text: Startup configuration.
+    :param name: Section name.
+    :type text: str
+    :type name: str
+
+    :return: Words within the section braces, None if the section is
+    missing.
+    :rtype: list of str
+    """
+
+    tokens = tokenize(text)
+    depth = 0
+    for x, token in enumerate(tokens):
+        if token == "{":
+            depth += 1
+        elif token == "}":
+            depth -= 1
+        elif depth == 0 and token == name and tokens[x + 1:x + 2] == ["{"]:
+            section = []
+            depth = 1
+            for token in tokens[x + 2:]:
+                depth += {"{": 1, "}": -1}.get(token, 0)
+                if depth == 0:
+                    return section
+                section.append(token)
+            return section
+    return None
+
+
+def parse_cpu(text):
+    """Options of the cpu section.
+
+    :param text: Startup configuration.
+    :type text: str
+
+    :return: Value of each option in CPU_OPTIONS present in the section,
+    other options are ignored.
+    :rtype: dict
+    """
+
+    section = get_section(text, "cpu") or []
+    options = {}
+    for x, token in enumerate(section):
+        if token in CPU_OPTIONS and x + 1 < len(section):
+            options[token] = section[x + 1]
+    return options
+
+
+def vpp_cores(cpu, cpus):
+    """Cores used by the VPP main thread and worker threads.
+
+    Follows VPP thread placement: the first skip-cores CPUs are not used,
+    the main thread runs on main-core (CPU 1 if available, otherwise the
+    first available CPU, if not configured), workers run on
+    corelist-workers/coremask-workers or on the next available CPUs after
+    the main core.
+
+    :param cpu: Options of the cpu section, see parse_cpu.
+    :param cpus: Online logical CPUs.
+    :type cpu: dict
+    :type cpus: list of int
+
+    :return: Main core and list of worker cores.
+    :rtype: tuple
+    """
+
+    available = sorted(cpus)[int(cpu.get("skip-cores", 0)):]
+    if "main-core" in cpu:
+        main_core = int(cpu["main-core"])
+    elif 1 in available:
+        main_core = 1
+    else:
+        main_core = available[0]
+
+    if "corelist-workers" in cpu:
+        workers = parse_cpulist(cpu["corelist-workers"])
+    elif "coremask-workers" in cpu:
+        mask = int(cpu["coremask-workers"], 16)
+        workers = [x for x in range(mask.bit_length()) if mask >> x & 1]
+    else:
+        free = [x for x in available if x > main_core] + \
+            [x for x in available if x < main_core]
+        workers = free[:int(cpu.get("workers", 0))]
+    return main_core, sorted(workers)
+
+
+def read_vpp_cores(startup_conf, cpus):
+    """Cores used by VPP configured in a startup configuration file.
+
+    :param startup_conf: Path to the startup configuration.
+    :param cpus: Online logical CPUs.
+    :type startup_conf: str
+    :type cpus: list of int
+
+    :return: Main core and list of worker cores, None if the file can not
+    be read.
+    :rtype: tuple
+    """
+
+    try:
+        with open(startup_conf, "r") as conf:
+            return vpp_cores(parse_cpu(conf.read()), cpus)
+    except IOError:
+        return None
+
+
+# Options which are replaced together, VPP uses only one way of placing
+# workers
+CPU_WORKER_OPTIONS = ("workers", "corelist-workers", "coremask-workers")
+
+
+def parse_tree(text):
+    """Parse startup configuration into a list of entries.
+
+    Each entry is a list of words and a list of child entries (None for
+    entries without braces). Entries are separated by new lines and
+    braces.
+
+    :type text: str
+    :rtype: list
+    """
+
+    text = "\n".join(line.split("#")[0] for line in text.splitlines())
+    tokens = re.findall(r"\n|[{}]|[^\s{}]+", text)
+    root = []
+    stack = [root]
+    words = []
+    for token in tokens + ["\n"]:
+        if token == "{":
+            children = []
+            stack[-1].append([words, children])
+            stack.append(children)
+            words = []
+            continue
+        if words and token in ("\n", "}"):
+            stack[-1].append([words, None])
+            words = []
+        if token == "}":
+            if len(stack) > 1:
+                stack.pop()
+        elif token != "\n":
+            words.append(token)
+    return root
+
+
+def render_tree(entries, indent=""):
+    lines = []
+    for words, children in entries:
+        if children is None:
+            lines.append(indent + " ".join(words))
+        else:
+            lines.append(indent + " ".join(words + ["{"]))
+            lines.extend(render_tree(children, indent + "  "))
+            lines.append(indent + "}")
+    return lines
+
+
+def strip_options(words, options, with_value=True):
+    """Remove options from the words of an entry, which may hold several
+    options on one line, e.g. cpu { main-core 1 workers 2 }.
+
+    :param words: Words of the entry.
+    :param options: Names of the removed options.
+    :param with_value: The options are followed by a value, which is
+    removed as well.
+    :type words: list of str
+    :type options: tuple of str
+    :type with_value: bool
+
+    :return: Remaining words.
+    :rtype: list of str
+    """
+
+    remaining = []
+    x = 0
+    while x < len(words):
+        if words[x] in options:
+            x += 2 if with_value else 1
+            continue
+        remaining.append(words[x])
+        x += 1
+    return remaining
+
+
+def set_options(text, options):
+    """Set options of top level sections.
+
+    :param text: Startup configuration.
+    :param options: Values by "section option", e.g. "cpu workers". Value
+    None leaves the option unchanged, True sets an option without a value.
+    Setting one of CPU_WORKER_OPTIONS removes the others.
+    :type text: str
+    :type options: dict
+
+    :return: Startup configuration with the options set, without comments.
+    :rtype: str
+    """
+
+    tree = parse_tree(text)
+    for key in sorted(options.keys()):
+        value = options[key]
+        if value is None:
+            continue
+        section, option = key.split(" ", 1)
+        replaced = [option]
+        if section == "cpu" and option in CPU_WORKER_OPTIONS:
+            replaced = CPU_WORKER_OPTIONS
+        for words, children in tree:
+            if words == [section] and children is not None:
+                break
+        else:
+            children = []
+            tree.append([[section], children])
+        remaining = []
+        for words, entry_children in children:
+            if entry_children is None:
+                words = strip_options(words, replaced, value is not True)
+                if not words:
+                    continue
+            elif words[0] in replaced:
+                continue
+            remaining.append([words, entry_children])
+        children[:] = remaining
+        children.append(
+            [[option] if value is True else [option, str(value)], None])
+    return "\n".join(render_tree(tree)) + "\n"
+
+
+def render_startup_conf(config):
+    """Render startup configuration of a test run.
+
+    Options in config["vpp"]["startup_params"] are set in a copy of
+    config["vpp"]["startup_conf"], written into the VPP log directory of
+    the test run.
+
+    :param config: Test configuration, see config.yml.
+    :type config: dict
+
+    :return: Path to the startup configuration to use, the original one if
+    there are no options to set.
+    :rtype: str
+    """
+
+    params = config["vpp"].get("startup_params")
+    if not params or all(value is None for value in params.values()):
+        return config["vpp"]["startup_conf"]
+    with open(config["vpp"]["startup_conf"], "r") as conf:
+        text = set_options(conf.read(), params)
+    return _write_conf(
+        "{0}/vpp/startup.conf".format(config["global"]["log_dir"]), text)
+
+
+def render_vcl_conf(config):
+    """Render VCL configuration of a test run.
+
+    Options in config["vcllib"]["conf_params"] are set in the vcl section
+    of a copy of config["vcllib"]["conf"] (of an empty configuration if not
+    set), written into the VCL log directory of the test run.
+
+    :param config: Test configuration, see config.yml.
+    :type config: dict
+
+    :return: Path to the VCL configuration to use, None to use VCL
+    defaults.
+    :rtype: str
+    """
+
+    base = config["vcllib"].get("conf")
+    params = dict(
+        ("vcl " + option, value) for option, value
+        in (config["vcllib"].get("conf_params") or {}).items())
+    if all(value is None for value in params.values()):
+        return base
+    text = ""
+    if base:
+        with open(base, "r") as conf:
+            text = conf.read()
+    return _write_conf(
+        "{0}/vcl/vcl.conf".format(config["global"]["log_dir"]),
+        set_options(text, params))
+
+
+def _write_conf(path, text):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as conf:
+        conf.write(text)
+    return path
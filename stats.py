@@ -0,0 +1,159 @@
+"""Statistical helpers for processing test results."""
+
+import math
+
+
+def mean(values):
+    return float(sum(values)) / len(values)
+
+
+def stdev(values):
+    """Sample standard deviation, 0 for less than two values."""
+    if len(values) < 2:
+        return 0.0
+    avg = mean(values)
+    return math.sqrt(
+        sum((x - avg) ** 2 for x in values) / (len(values) - 1))
+
+
+def percentile(values, pct):
+    """Percentile with linear interpolation between closest ranks.
+
+    :param values: Sample values, need not be sorted.
+    :param pct: Percentile, 0 to 100.
+    :type values: list of float
+    :type pct: float
+
+    :rtype: float
+    """
+
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(math.floor(rank))
+    high = int(math.ceil(rank))
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def median(values):
+    return percentile(values, 50)
+
+
+def coefficient_of_variation(values):
+    avg = mean(values)
+    if avg == 0:
+        return float("inf")
+    return stdev(values) / avg
+
+
+def steady_state_window(series, window=5, max_cv=0.05):
+    """Find the part of a time series where the values are stable.
+
+    The steady state starts at the first sliding window whose coefficient
+    of variation is at most max_cv and ends with the last such window.
+
+    :param series: Values sampled at regular intervals.
+    :param window: Number of samples in the sliding window.
+    :param max_cv: Maximum coefficient of variation within the window.
+    :type series: list of float
+    :type window: int
+    :type max_cv: float
+
+    :return: Start and end index (exclusive) of the steady state, None if
+    the series never stabilised.
+    :rtype: tuple
+    """
+
+    stable = [
+        x for x in range(len(series) - window + 1)
+        if coefficient_of_variation(series[x:x + window]) <= max_cv]
+    if not stable:
+        return None
+    return stable[0], stable[-1] + window
+
+
+def summarize(values):
+    """Summary statistics of a sample.
+
+    :return: min, p5, median, p95, max, mean and cv of the values.
+    :rtype: dict
+    """
+
+    return {
+        "min": min(values),
+        "p5": percentile(values, 5),
+        "median": median(values),
+        "p95": percentile(values, 95),
+        "max": max(values),
+        "mean": mean(values),
+        "cv": coefficient_of_variation(values),
+    }
+
+
+# Two-sided 95% critical values of Student's t-distribution, by degrees of
+# freedom. Larger samples use the normal approximation.
+T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262,
+        2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101,
+        2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052,
+        2.048, 2.045, 2.042]
+
+
+def confidence_interval(values):
+    """95% confidence interval of the mean.
+
+    :return: Mean and half-width of the interval, half-width is infinite
+    for less than two values.
+    :rtype: tuple
+    """
+
+    if len(values) < 2:
+        return mean(values), float("inf")
+    df = len(values) - 1
+    t = T_95[df - 1] if df <= len(T_95) else 1.96
+    return mean(values), t * stdev(values) / math.sqrt(len(values))
+
+
+def mad_outliers(values, threshold=3.5):
+    """Outliers by the modified z-score, 0.6745 * |x - median| / MAD, where
+    MAD is the median absolute deviation. Unlike the standard deviation it
+    is not inflated by the outliers themselves.
+
+    :param values: Sample values.
+    :param threshold: Maximum modified z-score of values which are not
+    outliers.
+    :type values: list of float
+    :type threshold: float
+
+    :return: Indexes of outliers in values, none if most values are equal.
+    :rtype: list of int
+    """
+
+    center = median(values)
+    mad = median([abs(x - center) for x in values])
+    if mad == 0:
+        return []
+    return [x for x, value in enumerate(values)
+            if 0.6745 * abs(value - center) / mad > threshold]
+
+
+def aggregate(values, outlier_threshold=3.5):
+    """Statistics of repeated measurements, outliers (see mad_outliers)
+    excluded.
+
+    :return: runs, outliers (indexes in values), mean, median, stdev, ci95
+    (half-width of the 95% confidence interval of the mean) and
+    ci95_relative (half-width relative to the mean).
+    :rtype: dict
+    """
+
+    outliers = mad_outliers(values, outlier_threshold)
+    kept = [value for x, value in enumerate(values) if x not in outliers]
+    avg, half_width = confidence_interval(kept)
+    return {
+        "runs": len(values),
+        "outliers": outliers,
+        "mean": avg,
+        "median": median(kept),
+        "stdev": stdev(kept),
+        "ci95": half_width,
+        "ci95_relative": half_width / avg if avg else float("inf"),
+    }
@@ -0,0 +1,425 @@
+"""Event driven supervision of child processes.
+
+Instead of polling every process once a second, the supervisor sleeps in
+poll() on a self-pipe which is written to by the SIGCHLD handler, so exited
+processes are reaped as soon as they exit.
+"""
+
+import errno
+import fcntl
+import math
+import os
+import select
+import signal
+import subprocess
+import time
+from contextlib import contextmanager
+
+# Poll interval used when SIGCHLD can not be handled (not in main thread)
+POLL_INTERVAL = 0.05
+
+
+def _sigchld_handler(signum, frame):
+    pass
+
+
+def _cloexec(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
+@contextmanager
+def _sigchld_wakeup():
+    """Make SIGCHLD write to a pipe for the duration of the context.
+
+    :return: Read end of the pipe, or None if signal handling is not
+    available in the current thread.
+    :rtype: int
+    """
+
+    rfd, wfd = os.pipe()
+    for fd in (rfd, wfd):
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    try:
+        old_handler = signal.signal(signal.SIGCHLD, _sigchld_handler)
+    except (ValueError, TypeError):
+        # signals can only be handled in the main thread (ValueError), module
+        # globals are already gone during interpreter shutdown (TypeError)
+        os.close(rfd)
+        os.close(wfd)
+        yield None
+        return
+    # restart interrupted system calls in the rest of the program
+    signal.siginterrupt(signal.SIGCHLD, False)
+    old_wakeup_fd = signal.set_wakeup_fd(wfd)
+    try:
+        yield rfd
+    finally:
+        signal.set_wakeup_fd(old_wakeup_fd)
+        signal.signal(signal.SIGCHLD, old_handler)
+        os.close(rfd)
+        os.close(wfd)
+
+
+def _wait_readable(fd, timeout):
+    """Wait until fd is readable. Unlike select(), works with descriptors
+    above FD_SETSIZE, which tests with thousands of sessions reach.
+
+    :param timeout: Maximum time to wait in seconds, None to wait without
+    a limit.
+    :type fd: int
+    :type timeout: float
+
+    :return: True if fd is readable.
+    :rtype: bool
+    """
+
+    poller = select.poll()
+    poller.register(fd, select.POLLIN)
+    return bool(poller.poll(
+        None if timeout is None else int(math.ceil(timeout * 1000))))
+
+
+def _drain(fd):
+    try:
+        while os.read(fd, 4096):
+            pass
+    except OSError as e:
+        if e.errno != errno.EAGAIN:
+            raise
+
+
+class ProcessSupervisor(object):
+    """Tracks a group of child processes and reaps them as they exit.
+
+    Start and exit times of every process are recorded in start_times and
+    exit_times, keyed by process name.
+    """
+
+    def __init__(self, test_info=None):
+        self.test_info = test_info
+        self.running = {}
+        self.start_times = {}
+        self.exit_times = {}
+        self.returncodes = {}
+
+    def _print(self, s):
+        if self.test_info:
+            self.test_info.printt(s)
+        else:
+            print s
+
+    def add(self, name, process):
+        """Start supervising a process.
+
+        :param name: Unique name of the process.
+        :param process: Started process.
+        :type name: str
+        :type process: subprocess.Popen
+        """
+
+        self.running[process.pid] = (name, process)
+        self.start_times[name] = time.time()
+
+    def _reap(self, on_exit):
+        reaped = 0
+        for pid in self.running.keys():
+            name, process = self.running[pid]
+            if process.poll() is None:
+                continue
+            del self.running[pid]
+            self.exit_times[name] = time.time()
+            self.returncodes[name] = process.returncode
+            reaped += 1
+            if on_exit:
+                on_exit(name, process)
+        return reaped
+
+    def wait(self, timeout, on_exit=None, first=False):
+        """Wait until all supervised processes exit.
+
+        :param timeout: Maximum time to wait in seconds, None to wait without
+        a limit.
+        :param on_exit: Called as on_exit(name, process) for every process
+        as soon as it exits.
+        :param first: Return as soon as at least one process exits.
+        :type timeout: float
+        :type on_exit: callable
+        :type first: bool
+
+        :return: Names of processes still running after the timeout.
+        :rtype: list of str
+        """
+
+        deadline = None if timeout is None else time.time() + timeout
+        with _sigchld_wakeup() as wakeup_fd:
+            reaped = self._reap(on_exit)
+            while self.running and not (first and reaped):
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                if wakeup_fd is None:
+                    time.sleep(POLL_INTERVAL if remaining is None
+                               else min(remaining, POLL_INTERVAL))
+                else:
+                    try:
+                        _wait_readable(wakeup_fd, remaining)
+                    except select.error as e:
+                        if e.args[0] != errno.EINTR:
+                            raise
+                    _drain(wakeup_fd)
+                reaped += self._reap(on_exit)
+        return [name for name, process in self.running.values()]
+
+    def stop(self, terminate_timeout=3, on_exit=None):
+        """Terminate all remaining processes at once and kill the ones that
+        are still running after terminate_timeout.
+
+        :param terminate_timeout: Time to wait after terminating and after
+        killing the processes, in seconds.
+        :param on_exit: See wait().
+        :type terminate_timeout: float
+        :type on_exit: callable
+        """
+
+        for name, process in self.running.values():
+            self._print(
+                "{}: Process is still running, will be terminated".format(
+                    name))
+            try:
+                process.terminate()
+            except OSError:
+                pass
+        if not self.wait(terminate_timeout, on_exit):
+            return
+        for name, process in self.running.values():
+            self._print("{}: Killing the process".format(name))
+            try:
+                process.kill()
+            except OSError:
+                pass
+        self.wait(terminate_timeout, on_exit)
+
+
+class ForkedProcess(subprocess.Popen):
+    """subprocess.Popen of a process forked by StartBarrier, supports
+    poll(), wait() and signals."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+        self.stdin = self.stdout = self.stderr = None
+        self.universal_newlines = False
+        self._child_created = True
+
+
+def _fileno(f):
+    return f if isinstance(f, int) else f.fileno()
+
+
+class StartBarrier(object):
+    """Starts a group of processes so that they all exec at the same moment.
+
+    Children are forked by spawn() one after another in the calling thread,
+    since subprocess.Popen of Python 2.7 is not safe to call from several
+    threads at once. The children report on a pipe that they are ready and
+    block reading another pipe, until release() closes its write end and
+    wakes all of them at once. Every child has a close-on-exec error pipe,
+    which reports a failed exec, and its end shows that the program was
+    executed.
+    """
+
+    def __init__(self):
+        self.ready_r, self.ready_w = os.pipe()
+        self.gate_r, self.gate_w = os.pipe()
+        # executed programs must not inherit the barrier
+        for fd in (self.ready_r, self.ready_w, self.gate_r, self.gate_w):
+            _cloexec(fd)
+        self.processes = []
+        # read end of the error pipe of every process, None if not forked
+        self.error_pipes = []
+        # index of the process in spawn() order -> exception
+        self.errors = {}
+        self.released = None
+
+    def _child(self, args, env, stdin, stdout, stderr, preexec_fn, error_w):
+        """Runs in the forked child, never returns."""
+
+        ready = False
+        try:
+            os.close(self.gate_w)
+            os.close(self.ready_r)
+            if stdin is not None:
+                os.dup2(_fileno(stdin), 0)
+            if stdout is not None:
+                os.dup2(_fileno(stdout), 1)
+            if stderr == subprocess.STDOUT:
+                os.dup2(1, 2)
+            elif stderr is not None:
+                os.dup2(_fileno(stderr), 2)
+            if preexec_fn:
+                preexec_fn()
+            os.write(self.ready_w, "r")
+            ready = True
+            # returns at EOF, once the parent and all children closed gate_w
+            os.read(self.gate_r, 1)
+            if env is None:
+                os.execvp(args[0], args)
+            else:
+                os.execvpe(args[0], args, env)
+        except BaseException as e:
+            try:
+                if not ready:
+                    os.write(self.ready_w, "r")
+                os.write(error_w, "{0}\n{1}".format(
+                    getattr(e, "errno", None) or 0,
+                    getattr(e, "strerror", None) or e))
+            except BaseException:
+                pass
+        finally:
+            os._exit(255)
+
+    def spawn(self, args, env=None, stdin=None, stdout=None, stderr=None,
+              preexec_fn=None):
+        """Fork a process which is started by release().
+
+        :param args: Program arguments.
+        :param env: Environment of the program, by default the environment
+        of the current process.
+        :param stdin: Standard input, file descriptor or file.
+        :param stdout: Standard output, file descriptor or file.
+        :param stderr: Standard error, file descriptor, file or
+        subprocess.STDOUT.
+        :param preexec_fn: Called in the child before it waits for release().
+        :type args: list of str
+        :type env: dict
+        :type preexec_fn: callable
+        """
+
+        index = len(self.processes)
+        error_r, error_w = os.pipe()
+        for fd in (error_r, error_w):
+            _cloexec(fd)
+        try:
+            pid = os.fork()
+        except OSError as e:
+            os.close(error_r)
+            os.close(error_w)
+            self.processes.append(None)
+            self.error_pipes.append(None)
+            self.errors[index] = e
+            return
+        if pid == 0:
+            self._child(args, env, stdin, stdout, stderr, preexec_fn,
+                        error_w)
+        os.close(error_w)
+        self.processes.append(ForkedProcess(pid))
+        self.error_pipes.append(error_r)
+
+    def _fail(self, index, error):
+        """Record an error of a process which did not execute its program,
+        kill and reap it."""
+
+        self.errors[index] = error
+        process = self.processes[index]
+        self.processes[index] = None
+        try:
+            process.kill()
+        except OSError:
+            pass
+        process.wait()
+
+    def _wait_executed(self, deadline):
+        """Wait until every released child executed its program or failed."""
+
+        poller = select.poll()
+        pending = {}
+        for index, fd in enumerate(self.error_pipes):
+            if fd is not None:
+                poller.register(fd, select.POLLIN)
+                pending[fd] = [index, ""]
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                events = poller.poll(int(math.ceil(remaining * 1000)))
+            except select.error as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+                continue
+            for fd, event in events:
+                data = os.read(fd, 4096)
+                if data:
+                    pending[fd][1] += data
+                    continue
+                index, message = pending.pop(fd)
+                poller.unregister(fd)
+                os.close(fd)
+                if message:
+                    code, text = message.split("\n", 1)
+                    self._fail(index, OSError(int(code) or None, text))
+        for fd, (index, message) in pending.items():
+            os.close(fd)
+            self._fail(index, RuntimeError(
+                "Program was not executed in time."))
+        self.error_pipes = []
+
+    def release(self, timeout=10):
+        """Wait until all spawned processes are ready and let them run.
+
+        :param timeout: Maximum time to wait for the processes to be ready,
+        and then for them to execute their programs, seconds. Processes
+        which are not ready in time are not synchronized, processes which do
+        not execute their program in time are killed.
+        :type timeout: float
+
+        :return: Started processes in the order of spawn(), None for
+        processes which failed to start (see errors).
+        :rtype: list of subprocess.Popen
+
+        :raises RuntimeError: If the barrier was already released.
+        """
+
+        if self.released is not None:
+            raise RuntimeError("Start barrier was already released.")
+        deadline = time.time() + timeout
+        forked = len(self.processes) - len(self.errors)
+        ready = 0
+        while ready < forked:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                if _wait_readable(self.ready_r, remaining):
+                    ready += len(os.read(self.ready_r, 4096))
+            except (select.error, OSError) as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+        os.close(self.gate_w)
+        self.released = time.time()
+        self._wait_executed(self.released + timeout)
+        for fd in (self.ready_r, self.ready_w, self.gate_r):
+            os.close(fd)
+        return self.processes
+
+
+def wait_process(process, timeout):
+    """Wait for a single process to exit.
+
+    :param process: Started process.
+    :param timeout: Maximum time to wait, in seconds.
+    :type process: subprocess.Popen
+    :type timeout: float
+
+    :return: Return code of the process, None if it is still running.
+    :rtype: int
+    """
+
+    supervisor = ProcessSupervisor()
+    supervisor.add("", process)
+    supervisor.wait(timeout)
+    return process.returncode
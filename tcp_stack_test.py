@@ -3,16 +3,21 @@
 import unittest
 import os
 import argparse
+import json
+import time
 import yaml
 from iperf3_tc import Iperf3TestCase
+from rr_tc import RequestResponseTestCase, ConnectRateTestCase
+from http_tc import HttpTestCase
+from base_tc import TestInfo
+from docker_api import DockerClient
+from docker_pool import ContainerPool
 from cpu_affinity import Affinity
+from startup_conf import read_vpp_cores, render_startup_conf, \
+    render_vcl_conf
+from topology import get_topology
 
 ATTR_NO_VPP = '--no-vpp'
-USE_VPP = True
-USE_DOCKER = False
-procdist = None
-corelist = corelist_client = None
-skip_cores = None
 
 cases = {
     "ls": Affinity.case_ls,
@@ -21,33 +26,315 @@ cases = {
     "nn": Affinity.case_nn
 }
 
+# Test case enabled by --workload, by its section in config.yml
+WORKLOADS = ("iperf3", "rr", "cps", "http")
+
+# Placement of clients and servers relative to NUMA nodes of VPP workers
+VPP_NUMA_PLACEMENT = ("any", "local", "remote")
+
 logfiles = {
     "vpp": {
         "log": "vpp_log.txt",
         "memory_log": "vpp_mem_log.txt"
     },
     "iperf3": {
-        "server_log": "iperf3_server_log.txt",
-        "server_mem_log": "iperf3_server_mem_log.txt",
-        "client_log": "iperf3_client_log.txt",
-        "client_mem_log": "iperf3_client_mem_log.txt",
+        "output_log": "iperf_output_log.txt.gz",
+        "server_mem_log": "iperf_server_mem_log.txt",
+        "client_mem_log": "iperf_client_mem_log.txt",
         "client_json_out": ""
     }
 }
 
 
-def build_suite(config):
+def build_suite(config, use_vpp=True, use_docker=False, corelist=None,
+                corelist_client=None, vpp_running=False, container_pool=None):
     suite = unittest.TestSuite()
     if config['iperf3']['enable']:
         suite.addTest(Iperf3TestCase(
             config,
-            use_vpp=USE_VPP,
-            use_docker=USE_DOCKER,
+            use_vpp=use_vpp,
+            use_docker=use_docker,
             corelist=corelist,
-            corelist_client=corelist_client))
+            corelist_client=corelist_client,
+            vpp_running=vpp_running,
+            container_pool=container_pool))
+    for test_case in (RequestResponseTestCase, ConnectRateTestCase,
+                      HttpTestCase):
+        if config[test_case.section]['enable']:
+            suite.addTest(test_case(
+                config,
+                use_vpp=use_vpp,
+                use_docker=use_docker,
+                corelist=corelist,
+                corelist_client=corelist_client,
+                vpp_running=vpp_running,
+                container_pool=container_pool))
     return suite
 
 
+def get_vpp_cores(config):
+    """Find cores used by VPP in its startup configuration.
+
+    :param config: Test configuration, see config.yml.
+    :type config: dict
+
+    :return: Main core and list of worker cores, None if the startup
+    configuration can not be read.
+    :rtype: tuple
+    """
+
+    vpp_cores = read_vpp_cores(config["vpp"]["startup_conf"],
+                               sorted(get_topology().cpus.keys()))
+    if vpp_cores is None:
+        print "Can not read VPP startup configuration {0}, VPP cores are " \
+              "not known.".format(config["vpp"]["startup_conf"])
+    else:
+        print "VPP main core: {0}, worker cores: {1}".format(*vpp_cores)
+    return vpp_cores
+
+
+def get_corelists(procdist, skip_cores=None, use_cores=None, vpp_cores=None,
+                  vpp_numa="any"):
+    """Generate corelists for client and server processes.
+
+    :param procdist: Distribution of client/server process pairs, one of
+    the keys of cases.
+    :param skip_cores: Logical CPU cores which should not be used.
+    :param use_cores: If specified, only these logical CPU cores may be used.
+    :param vpp_cores: VPP main core and worker cores, excluded from use.
+    :param vpp_numa: Placement relative to NUMA nodes of VPP workers (or of
+    the main core without workers), one of VPP_NUMA_PLACEMENT.
+
+    :type procdist: str
+    :type skip_cores: list of int
+    :type use_cores: list of int
+    :type vpp_cores: tuple
+    :type vpp_numa: str
+
+    :return: Lists of CPUs for servers and clients.
+    :rtype: tuple of lists
+    """
+
+    if procdist not in cases.keys():
+        raise ValueError("Unrecognized value for option --procdist. "
+                         "Available options are: {0}".format(cases.keys()))
+    if vpp_numa not in VPP_NUMA_PLACEMENT:
+        raise ValueError("Unrecognized value for option --vpp_numa. "
+                         "Available options are: {0}".format(
+                            VPP_NUMA_PLACEMENT))
+
+    skip_cores = list(skip_cores or [])
+    if vpp_cores:
+        skip_cores.append(vpp_cores[0])
+        skip_cores.extend(vpp_cores[1])
+    ht_pairs = Affinity.get_ht_pairs(skip_cores, use_cores)
+
+    if vpp_numa != "any":
+        if not vpp_cores:
+            raise RuntimeError(
+                "NUMA placement relative to VPP specified but VPP cores are "
+                "not known.")
+        nodes = vpp_nodes(vpp_cores)
+        if not nodes:
+            raise RuntimeError(
+                "VPP cores {0} are not online CPUs.".format(vpp_cores))
+        ht_pairs = Affinity.select_numa(ht_pairs, nodes, vpp_numa == "local")
+
+    if procdist == "ps":
+        for cores in ht_pairs.values():
+            if len(cores) < 2:
+                raise RuntimeError(
+                    "Hyperthreading CPU distribution specified but HT is not"
+                    " active on all cores.")
+
+    if len(ht_pairs.keys()) < 2 and procdist in ("ns", "nn"):
+        raise RuntimeError(
+            "Cross-physcore CPU distribution specified but only one physical "
+            "core was detected.")
+
+    numa_topology = Affinity.get_numa_topo(ht_pairs)
+
+    if procdist == "nn" and numa_topology is None:
+        raise RuntimeError(
+            "Cross-NUMA CPU distribution specified but only one NUMA node "
+            "was detected.")
+
+    corelist, corelist_client = cases[procdist](
+        ht_pairs,
+        numa_topology
+    )
+
+    if not corelist:
+        raise RuntimeError("No CPUs available for clients and servers.")
+    if len(corelist) != len(corelist_client):
+        raise RuntimeError("Server/Client CPU list length mismatch.")
+
+    return corelist, corelist_client
+
+
+def vpp_nodes(vpp_cores):
+    """NUMA nodes of VPP workers, or of the main core if there are no
+    workers."""
+
+    cpus = get_topology().cpus
+    return sorted(set(
+        cpus[core]["node"] for core in vpp_cores[1] or [vpp_cores[0]]
+        if core in cpus))
+
+
+def get_layout(corelist, corelist_client, vpp_cores, vpp_numa):
+    """Describe placement of VPP, servers and clients, recorded with
+    results.
+
+    :rtype: dict
+    """
+
+    cpus = get_topology().cpus
+
+    def nodes(cores):
+        return sorted(set(
+            cpus[core]["node"] for core in cores if core in cpus))
+
+    layout = {
+        "vpp_numa": vpp_numa,
+        "server_cores": corelist,
+        "client_cores": corelist_client,
+        "server_nodes": nodes(corelist),
+        "client_nodes": nodes(corelist_client),
+    }
+    if vpp_cores:
+        layout.update({
+            "vpp_main_core": vpp_cores[0],
+            "vpp_workers": vpp_cores[1],
+            "vpp_nodes": vpp_nodes(vpp_cores),
+        })
+    return layout
+
+
+def run_test(config, use_vpp=True, use_docker=False, procdist="ls",
+             skip_cores=None, use_cores=None, vpp_running=False,
+             vpp_numa="any", container_pool=None, runner=None):
+    """Run the test suite and collect structured results.
+
+    :param config: Test configuration, see config.yml.
+    :param use_vpp: Use VPP and the VCL library.
+    :param use_docker: Run clients and servers in Docker containers.
+    :param procdist: Distribution of client/server process pairs.
+    :param skip_cores: Logical CPU cores which should not be used.
+    :param use_cores: If specified, only these logical CPU cores may be used.
+    :param vpp_running: VPP is started and configured by the caller.
+    :param vpp_numa: Placement relative to NUMA nodes of VPP workers.
+    :param container_pool: Docker containers kept between runs. If not
+    specified and the docker_pool option is enabled, containers are created
+    for this run only.
+    :param runner: unittest runner, by default the suite runs silently.
+
+    :type config: dict
+    :type use_vpp: bool
+    :type use_docker: bool
+    :type procdist: str
+    :type skip_cores: list of int
+    :type use_cores: list of int
+    :type vpp_running: bool
+    :type vpp_numa: str
+    :type container_pool: ContainerPool
+    :type runner: unittest.TextTestRunner
+
+    :return: Results of each test case by its config.yml section (None if
+    it did not finish), errors and failures reported by unittest, CPU
+    layout, VPP startup and VCL configuration and duration of the run.
+    :rtype: dict
+    """
+
+    started = time.time()
+    # VPP parameters of the test run are set in a copy of startup_conf
+    config = dict(config, vpp=dict(
+        config["vpp"], startup_conf=render_startup_conf(config)))
+    if use_vpp:
+        config["vcllib"] = dict(
+            config["vcllib"], conf=render_vcl_conf(config))
+    vpp_cores = None
+    if config["vpp"]["exclude_cores"]:
+        vpp_cores = get_vpp_cores(config)
+    corelist, corelist_client = get_corelists(
+        procdist, skip_cores, use_cores, vpp_cores, vpp_numa)
+    own_pool = None
+    if use_docker and container_pool is None \
+            and config["iperf3"]["docker_pool"]:
+        own_pool = container_pool = create_pool(
+            config["global"]["log_dir"], config["global"]["docker_socket"])
+    suite = build_suite(config, use_vpp, use_docker, corelist,
+                        corelist_client, vpp_running, container_pool)
+    try:
+        if runner:
+            test_result = runner.run(suite)
+        else:
+            test_result = unittest.TestResult()
+            suite.run(test_result)
+    finally:
+        if own_pool:
+            own_pool.close()
+
+    result = {
+        "errors": [trace for test, trace in
+                   test_result.errors + test_result.failures],
+        "layout": get_layout(corelist, corelist_client, vpp_cores, vpp_numa),
+        "duration": time.time() - started,
+    }
+    if use_vpp:
+        with open(config["vpp"]["startup_conf"], "r") as conf:
+            result["startup_conf"] = conf.read()
+        if config["vcllib"]["conf"]:
+            with open(config["vcllib"]["conf"], "r") as conf:
+                result["vcl_conf"] = conf.read()
+    for test in suite:
+        if isinstance(test, Iperf3TestCase):
+            result["iperf3"] = test.result
+        elif isinstance(test, RequestResponseTestCase):
+            result[test.section] = test.result
+    return result
+
+
+def create_pool(log_dir, docker_socket):
+    """Create pool of Docker containers for iperf3.
+
+    :param log_dir: Where to place the pool's log.
+    :param docker_socket: Unix socket of the Docker daemon.
+    :type log_dir: str
+    :type docker_socket: str
+    :rtype: ContainerPool
+    """
+
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    return ContainerPool(
+        DockerClient(docker_socket), "vcl_docker_net", "192.168.0.0/16",
+        TestInfo(log_dir + "/docker_pool.txt"))
+
+
+def parse_params(args, params=None):
+    """Add "<option>[=value]" command line arguments to configuration
+    parameters.
+
+    :param args: Command line arguments.
+    :param params: Parameters from config.yml.
+    :type args: list of str
+    :type params: dict
+
+    :return: Value of each option, True for options without a value.
+    :rtype: dict
+    """
+
+    params = dict(params or {})
+    for param in args:
+        if "=" in param:
+            key, value = param.split("=", 1)
+        else:
+            key, value = param, True
+        params[key] = value
+    return params
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="VCL test script.",
@@ -60,7 +347,16 @@ if __name__ == "__main__":
         help="Number of connections opened from each client.")
     parser.add_argument(
         "-ms", type=str, metavar="#[KMG]",
-        help="Message size and send/receive buffer length.")
+        help="Message size and send/receive buffer length.\n"
+             "Request and response size of rr and cps workloads,\n"
+             "response size of the http workload.")
+    parser.add_argument(
+        "--workload", type=str, choices=WORKLOADS,
+        help="Run only this test case: iperf3 throughput, rr\n"
+             "request/response latency or cps connection rate\n"
+             "(both with pingpong.py), http request rate (nginx\n"
+             "and wrk).\n"
+             "If not specified, will use configuration from config.yml")
     parser.add_argument(
         "--no_vpp", action='store_true',
         help="Run test without VCL preload.")
@@ -77,15 +373,48 @@ if __name__ == "__main__":
         "\nps -  share one physical core (Hyperthreading pair)"
         "\nns -  share the same NUMA node, different phys cores"
         "\nnn -  run on separate NUMA nodes")
+    parser.add_argument(
+        "--vpp_numa", type=str, metavar="<placement>", default="any",
+        help="Place clients and servers relative to NUMA nodes of VPP\n"
+        "workers (read from VPP startup configuration):"
+        "\nany -    on any NUMA node"
+        "\nlocal -  on the NUMA nodes of VPP workers"
+        "\nremote - on other NUMA nodes than VPP workers")
+    parser.add_argument(
+        "--vpp_param", type=str, metavar="\"<section> <option>[=value]\"",
+        action="append",
+        help="Set option in a copy of VPP startup configuration,\n"
+             "e.g. \"cpu workers=2\". May be repeated.")
+    parser.add_argument(
+        "--vcl_param", type=str, metavar="\"<option>[=value]\"",
+        action="append",
+        help="Set option in the vcl section of VCL configuration,\n"
+             "e.g. \"rx-fifo-size=4000000\". May be repeated.")
     parser.add_argument(
         "--skip_cores", type=str, metavar="x,y-z",
         help="Specify logical CPUs to exclude, as comma separated list\n"
              "of distinct core IDs or ranges. Will also exclude\n"
              "the specified cores' Hyperthreading twins.")
+    parser.add_argument(
+        "--cores", type=str, metavar="x,y-z",
+        help="Use only the specified logical CPUs, as comma separated\n"
+             "list of distinct core IDs or ranges. Physical cores are\n"
+             "used only if all their Hyperthreading twins are listed.")
+    parser.add_argument(
+        "--port", type=int, metavar="#",
+        help="First port used by iperf3/rr/cps/http sessions.\n"
+             "If not specified, will use configuration from config.yml")
     parser.add_argument(
         "--docker", action="store_true",
         help="Use docker to run every client and server instance\n"
              "in a separate container.")
+    parser.add_argument(
+        "--vpp_running", action="store_true",
+        help="VPP is already running with configured loopback interface.\n"
+             "Do not start, configure or stop VPP.")
+    parser.add_argument(
+        "--json_result", type=str, metavar="<path>",
+        help="Write structured test results into a JSON file.")
     parser.add_argument(
         "--zerocopy", action="store_true",
         help="(only with --no_vpp) Use experimental zero-copy\n"
@@ -99,61 +428,51 @@ if __name__ == "__main__":
 
     # Parse arguments
     args = parser.parse_args()
-    if args.no_vpp:
-        USE_VPP = False
-    if args.procdist:
-        procdist = args.procdist
-    if procdist not in cases.keys():
-        raise ValueError("Unrecognized value for option --procdist. "
-                         "Available options are: {0}".format(cases.keys()))
+    skip_cores = use_cores = None
     if args.skip_cores:
         skip_cores = Affinity.parse_cores(args.skip_cores)
-    if args.docker:
-        USE_DOCKER = True
+    if args.cores:
+        use_cores = Affinity.parse_cores(args.cores)
     if args.zerocopy:
         raise NotImplementedError("Zero-copy option not implemented.")
 
     # Override config with command line arguments, if provided
     if args.logdir:
         test_config["global"]["log_dir"] = args.logdir
-    if args.s:
-        test_config["iperf3"]["sessions"] = args.s
-    if args.c:
-        test_config["iperf3"]["connections_per_session"] = args.c
+    if args.workload:
+        for workload in WORKLOADS:
+            test_config[workload]["enable"] = workload == args.workload
+    for workload in WORKLOADS:
+        if args.s:
+            test_config[workload]["sessions"] = args.s
+        if args.c:
+            test_config[workload]["connections_per_session"] = args.c
+        if args.port:
+            test_config[workload]["default_port"] = args.port
     if args.ms:
         test_config["iperf3"]["message_size"] = args.ms
-
-    # Generate corelists for client and server processes
-    ht_pairs = Affinity.get_ht_pairs(skip_cores)
-
-    if procdist == "ps":
-        for cores in ht_pairs.values():
-            if len(cores) < 2:
-                raise RuntimeError(
-                    "Hyperthreading CPU distribution specified but HT is not"
-                    " active on all cores.")
-
-    if len(ht_pairs.keys()) < 2 and procdist in ("ns", "nn"):
-        raise RuntimeError(
-            "Cross-physcore CPU distribution specified but only one physical "
-            "core was detected.")
-
-    numa_topology = Affinity.get_numa_topo(ht_pairs)
-
-    if procdist == "nn" and numa_topology is None:
-        raise RuntimeError(
-            "Cross-NUMA CPU distribution specified but only one NUMA node "
-            "was detected.")
-
-    corelist, corelist_client = cases[procdist](
-        ht_pairs,
-        numa_topology
-    )
-
-    if len(corelist) != len(corelist_client):
-        raise RuntimeError("Server/Client CPU list length mismatch.")
+        for workload in ("rr", "cps"):
+            test_config[workload]["request_size"] = args.ms
+            test_config[workload]["response_size"] = args.ms
+        test_config["http"]["response_size"] = args.ms
+    if args.vpp_param:
+        test_config["vpp"]["startup_params"] = parse_params(
+            args.vpp_param, test_config["vpp"].get("startup_params"))
+    if args.vcl_param:
+        test_config["vcllib"]["conf_params"] = parse_params(
+            args.vcl_param, test_config["vcllib"].get("conf_params"))
 
     # Run the tests
-    runner = unittest.TextTestRunner()
-    test_suite = build_suite(test_config)
-    runner.run(test_suite)
+    result = run_test(
+        test_config,
+        use_vpp=not args.no_vpp,
+        use_docker=args.docker,
+        procdist=args.procdist,
+        skip_cores=skip_cores,
+        use_cores=use_cores,
+        vpp_running=args.vpp_running,
+        vpp_numa=args.vpp_numa,
+        runner=unittest.TextTestRunner())
+    if args.json_result:
+        with open(args.json_result, "w") as json_result:
+            json.dump(result, json_result)
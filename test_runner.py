@@ -1,107 +1,603 @@
+import copy
+import json
 import os
 import subprocess
+import time
+from itertools import product
+
+import yaml
+
+import stats
+from base_tc import TestInfo, VPPInstance
+from cpu_affinity import Affinity
+from docker_pool import RESULTS_ROOT
+from result_store import ResultStore, CSV_COLUMNS, config_hash, file_hash
+from saturation import find_knee
+from scheduler import PartitionScheduler, partition_cores
+from startup_conf import render_startup_conf
+import tcp_stack_test
 from test_runner_config import *
 
-with open("tcp_stack_results.csv", "w") as result_file:
-    result_file.write(
-        "Sessions;Connections/Session;Message size;Test Case;VPP;Docker;"
-        "Total Throughput;Average per Session;Failed Sessions\n")
-    for session_count in sessions:
-        for connection_count in connections:
-            for message_size in message_sizes:
-                for test_case in test_cases:
-                    for vpp_state in vpp:
-                        for docker_state in docker:
-                            # Retry once if test fails
-                            for x in range(2):
-                                testrun_name = "s[{0}]c[{1}]ms[{2}]" \
-                                               "_{3}_vpp-{4}_docker-{5}".format(
-                                                session_count,
-                                                connection_count,
-                                                message_size,
-                                                test_case,
-                                                vpp_state,
-                                                docker_state
-                                                )
-                                command = (
-                                    "python ./tcp_stack_test.py"
-                                    " -s {sessions} -c {connections}"
-                                    " -ms {message_size}"
-                                    " --procdist {test_case}{vpp_state}{docker}"
-                                    "{skip_cores}"
-                                    " --logdir {logdir}".format(
-                                        sessions=session_count,
-                                        connections=connection_count,
-                                        message_size=message_size,
-                                        test_case=test_case,
-                                        vpp_state="" if vpp_state
-                                        else " --no_vpp",
-                                        docker=" --docker" if docker_state
-                                        else "",
-                                        skip_cores=" --skip_cores {0}".format(
-                                            skip_cores) if skip_cores else "",
-                                        logdir="/tmp/" + testrun_name,
-                                        ))
-                                print "Running test case '{0}' with command:\n"\
-                                      "{1}".format(testrun_name, command)
-                                test = subprocess.Popen(
-                                    command,
-                                    shell=True,
-                                    stdout=subprocess.PIPE)
-                                test.poll()
-                                result = test.stdout.readlines()
-                                line = 0
-                                try:
-                                    while "Failed to connect sessions:" \
-                                            not in result[line]:
-                                        line += 1
-                                    failed_sessions = int(
-                                        result[line].split(" ")[4])
-                                    if failed_sessions > session_count/10:
-                                        print "More than 10% of sessions " \
-                                              "failed to connect. " \
-                                              "({0} out of {1})".format(
-                                                failed_sessions, session_count)
-                                    throughput = result[line+2].split(" ")[1]
-                                    average = result[line+3].split(" ")[4]
-                                except IndexError:
-                                    print "Results not available. Test Failed."
-                                    continue
-                                else:
-                                    result_file.write("{0};".format(
-                                        session_count))
-                                    result_file.write("{0};".format(
-                                        connection_count))
-                                    result_file.write("{0};".format(
-                                        message_size))
-                                    result_file.write("{0};".format(
-                                        test_case))
-                                    result_file.write("{0};".format(
-                                        vpp_state))
-                                    result_file.write("{0};".format(
-                                        docker_state))
-                                    result_file.write("{0};".format(
-                                        throughput))
-                                    result_file.write("{0};".format(
-                                        average))
-                                    result_file.write("{0}\n".format(
-                                        failed_sessions))
-                                    break
-                            else:
-                                print "Test failed after retrying."
-                                result_file.write("{0};".format(
-                                    session_count))
-                                result_file.write("{0};".format(
-                                    connection_count))
-                                result_file.write("{0};".format(
-                                    message_size))
-                                result_file.write("{0};".format(
-                                    test_case))
-                                result_file.write("{0};".format(
-                                    vpp_state))
-                                result_file.write("{0};".format(
-                                    docker_state))
-                                result_file.write("N/A;" * 2)
-                                result_file.write("N/A\n")
-                            result_file.flush()
-                            os.fsync(result_file.fileno())
+
+SHARED_VPP_LOG_DIR = "/tmp/shared_vpp"
+DOCKER_POOL_LOG_DIR = "/tmp/docker_pool"
+
+
+class SharedVPP(object):
+    """VPP instance kept alive across consecutive test runs.
+
+    VPP is restarted only if it crashed, if its startup configuration
+    changed, or if sessions of the previous test run did not close.
+    """
+
+    def __init__(self, test_config):
+        self.test_config = test_config
+        self.instance = None
+        self.startup_conf = None
+        self.startup_conf_content = None
+        if not os.path.isdir(SHARED_VPP_LOG_DIR):
+            os.makedirs(SHARED_VPP_LOG_DIR)
+        self.test_info = TestInfo(SHARED_VPP_LOG_DIR + "/shared_vpp.txt")
+
+    def ensure(self, startup_conf):
+        """Make sure VPP is running with the specified configuration.
+
+        :param startup_conf: Path to VPP startup configuration file.
+        :type startup_conf: str
+
+        :return: True if VPP is running and configured.
+        :rtype: bool
+        """
+
+        with open(startup_conf, "r") as conf:
+            content = conf.read()
+        if self.instance and self.instance._is_running() \
+                and self.startup_conf_content == content:
+            return True
+        if self.instance:
+            self.test_info.printt("Restarting VPP.")
+        self.stop()
+        for x in range(3):
+            instance = VPPInstance(
+                self.test_config['vpp']['binary'],
+                startup_conf,
+                SHARED_VPP_LOG_DIR,
+                self.test_info,
+                self.test_config['vpp']['startup_timeout'])
+            if instance._start_vpp() is None:
+                continue
+            try:
+                instance._configure_interface(
+                    self.test_config['global']['host'])
+            except RuntimeError:
+                instance._stop_vpp()
+                continue
+            self.instance = instance
+            self.startup_conf = startup_conf
+            self.startup_conf_content = content
+            return True
+        self.test_info.printt("VPP startup/configuration failed after "
+                              "retrying.")
+        return False
+
+    def drain(self):
+        """Wait until sessions of the previous test run are closed, stop VPP
+        if they are not."""
+
+        if self.instance is None:
+            return
+        try:
+            drained = self.instance._wait_sessions_drained(vpp_drain_timeout)
+        except RuntimeError:
+            drained = False
+        if not drained:
+            self.stop()
+
+    def stop(self):
+        if self.instance:
+            self.instance._stop_vpp()
+            self.instance = None
+
+
+def expand_params(params):
+    """All combinations of VPP startup or VCL parameters.
+
+    :param params: List of values by option.
+    :type params: dict
+
+    :return: (option, value) pairs of each combination, without options
+    left unchanged (None).
+    :rtype: list of tuples
+    """
+    keys = sorted(params.keys())
+    return [
+        tuple((key, value) for key, value in zip(keys, values)
+              if value is not None)
+        for values in product(*[params[key] for key in keys])]
+
+
+def get_params(testrun, section, key, index):
+    """VPP startup or VCL parameters of a test run, including those set in
+    config.yml.
+
+    :param section: Section of config.yml.
+    :param key: Parameters in the section.
+    :param index: Parameters in the test run.
+
+    :rtype: dict
+    """
+    params = dict(test_config[section].get(key) or {})
+    params.update(testrun[index])
+    return dict(
+        (key, value) for key, value in params.items() if value is not None)
+
+
+def get_vpp_params(testrun):
+    return get_params(testrun, "vpp", "startup_params", 7)
+
+
+def get_vcl_params(testrun):
+    return get_params(testrun, "vcllib", "conf_params", 8)
+
+
+def format_params(params):
+    if not params:
+        return "default"
+    return ",".join(
+        "{0}={1}".format(key.replace(" ", "."), params[key])
+        for key in sorted(params.keys()))
+
+
+def get_testrun_name(testrun):
+    return "s[{0}]c[{1}]ms[{2}]_{3}_vpp-{4}_docker-{5}_vppnuma-{6}" \
+           "_vppconf-{7}_vclconf-{8}_{9}".format(*testrun[:7] + (
+            format_params(dict(testrun[7])),
+            format_params(dict(testrun[8])),
+            testrun[9]))
+
+
+def build_command(testrun, cores=None, port=None, vpp_running=False,
+                  json_result=None):
+    session_count, connection_count, message_size, test_case, vpp_state,\
+        docker_state, vpp_numa_state, vpp_params_state, vcl_params_state, \
+        workload = testrun
+    if cores:
+        core_option = " --cores {0}".format(",".join(str(x) for x in cores))
+    elif skip_cores:
+        core_option = " --skip_cores {0}".format(skip_cores)
+    else:
+        core_option = ""
+    return (
+        "python ./tcp_stack_test.py"
+        " --workload {workload} -s {sessions} -c {connections}"
+        " -ms {message_size}"
+        " --procdist {test_case} --vpp_numa {vpp_numa}"
+        "{vpp_state}{vpp_running}{docker}"
+        "{vpp_params}{vcl_params}{core_option}{port}{json_result}"
+        " --logdir {logdir}".format(
+            workload=workload,
+            sessions=session_count,
+            connections=connection_count,
+            message_size=message_size,
+            test_case=test_case,
+            vpp_numa=vpp_numa_state,
+            vpp_state="" if vpp_state else " --no_vpp",
+            vpp_running=" --vpp_running" if vpp_running else "",
+            docker=" --docker" if docker_state else "",
+            vpp_params="".join(
+                " --vpp_param \"{0}={1}\"".format(key, value)
+                for key, value in vpp_params_state),
+            vcl_params="".join(
+                " --vcl_param \"{0}={1}\"".format(key, value)
+                for key, value in vcl_params_state),
+            core_option=core_option,
+            port=" --port {0}".format(port) if port else "",
+            json_result=" --json_result {0}".format(json_result)
+            if json_result else "",
+            logdir=get_log_dir(testrun),
+        ))
+
+
+def get_log_dir(testrun):
+    """Log directory of a test run, in RESULTS_ROOT which is mounted into
+    pool containers."""
+    return os.path.join(RESULTS_ROOT, get_testrun_name(testrun))
+
+
+def make_config(testrun, port=None):
+    """Test configuration of a test run, based on config.yml.
+
+    :rtype: dict
+    """
+    config = copy.deepcopy(test_config)
+    config["global"]["log_dir"] = get_log_dir(testrun)
+    for workload in tcp_stack_test.WORKLOADS:
+        config[workload]["enable"] = workload == testrun[9]
+        config[workload]["sessions"] = testrun[0]
+        config[workload]["connections_per_session"] = testrun[1]
+        if port:
+            config[workload]["default_port"] = port
+    config["iperf3"]["message_size"] = testrun[2]
+    for workload in ("rr", "cps"):
+        config[workload]["request_size"] = testrun[2]
+        config[workload]["response_size"] = testrun[2]
+    config["http"]["response_size"] = testrun[2]
+    config["vpp"]["startup_params"] = get_vpp_params(testrun)
+    config["vcllib"]["conf_params"] = get_vcl_params(testrun)
+    return config
+
+
+def get_result(test_result, session_count):
+    """Find iperf3, request/response, connection rate or HTTP results in
+    tcp_stack_test.run_test output.
+
+    :param test_result: Output of run_test, possibly loaded from JSON.
+    :param session_count: Number of sessions in the test run.
+    :type test_result: dict
+    :type session_count: int
+
+    :return: Total throughput, average throughput per session, number
+    of failed sessions and throughput of each session (transactions,
+    connections or requests per second for request/response, connection
+    rate and HTTP tests), or None if results are not available.
+    :rtype: dict
+    """
+    for error in test_result.get("errors", []):
+        print error
+    result = None
+    for workload in tcp_stack_test.WORKLOADS:
+        result = result or test_result.get(workload)
+    if not result or result.get("throughput") is None:
+        print "Results not available. Test Failed."
+        return None
+    if result["failed_sessions"] > session_count/10:
+        print "More than 10% of sessions failed to connect. " \
+              "({0} out of {1})".format(result["failed_sessions"],
+                                        session_count)
+    # JSON object keys are strings
+    result["sessions"] = dict(
+        (int(session), throughput)
+        for session, throughput in result["sessions"].items())
+    return result
+
+
+def effective_config(testrun):
+    """Everything that affects results of the test run.
+
+    :rtype: dict
+    """
+    config = dict(zip(CSV_COLUMNS, testrun))
+    config["vpp_params"] = format_params(get_vpp_params(testrun))
+    config["vcl_params"] = format_params(get_vcl_params(testrun))
+    config["skip_cores"] = skip_cores
+    config[testrun[9]] = dict(
+        (key, value) for key, value in test_config[testrun[9]].items()
+        if key not in ("enable", "sessions", "connections_per_session",
+                       "message_size", "request_size", "response_size",
+                       "default_port"))
+    config.update(build_info)
+    return config
+
+
+def get_build_info():
+    """Identify VPP and VCL builds and VPP configuration used by tests."""
+    startup_conf = test_config["vpp"]["startup_conf"]
+    return {
+        "vpp_binary": file_hash(test_config["vpp"]["binary"]),
+        "vpp_startup_conf": file_hash(startup_conf),
+        "vcllib": file_hash(test_config["vcllib"]["path"]),
+        "vcl_conf": file_hash(test_config["vcllib"]["conf"])
+        if test_config["vcllib"].get("conf") else None,
+    }
+
+
+def record_result(store, testrun, started, result, test_result=None):
+    metadata = {}
+    for key in ("layout", "startup_conf", "vcl_conf"):
+        if test_result and test_result.get(key):
+            metadata[key] = test_result[key]
+    for key in ("overlap", "latency", "failed_connects", "session_table"):
+        # 0 failed connects or an empty session table differ from not
+        # measured
+        if result and result.get(key) is not None:
+            metadata[key] = result[key]
+    store.add(effective_config(testrun), get_testrun_name(testrun), started,
+              result, metadata)
+    store.export_csv(result_csv, outlier_threshold)
+
+
+def needs_run(testrun, store):
+    """Whether a test run needs another repetition: it has fewer than
+    repetitions valid results, or its confidence interval is wider than
+    target_ci and it has fewer than max_repetitions.
+
+    :rtype: bool
+    """
+    key = config_hash(effective_config(testrun))
+    throughputs = store.valid_throughputs(key)
+    if len(throughputs) < repetitions:
+        return True
+    if target_ci is None or len(throughputs) >= max_repetitions:
+        return False
+    return stats.aggregate(
+        throughputs, outlier_threshold)["ci95_relative"] > target_ci
+
+
+def print_summary(testruns, store):
+    """Print statistics of repeated test runs."""
+    for testrun in testruns:
+        throughputs = store.valid_throughputs(
+            config_hash(effective_config(testrun)))
+        if not throughputs:
+            continue
+        summary = stats.aggregate(throughputs, outlier_threshold)
+        print "{0}: {1} runs, {2} outliers, mean {3:.3f} +- {4:.3f} " \
+              "({5:.1%}), median {6:.3f}, stdev {7:.3f}".format(
+                get_testrun_name(testrun), summary["runs"],
+                len(summary["outliers"]), summary["mean"], summary["ci95"],
+                summary["ci95_relative"], summary["median"],
+                summary["stdev"])
+
+
+def run_serial(testrun, store, shared_vpp=None, container_pool=None):
+    """Run the test in this process, retrying once if it fails.
+
+    :param shared_vpp: If specified, VPP tests use this VPP instance.
+    :param container_pool: If specified, Docker tests use its containers.
+
+    :return: Time spent running the test, in seconds.
+    :rtype: float
+    """
+    started = time.time()
+    config = make_config(testrun)
+    for x in range(2):
+        vpp_running = False
+        print "Running test case '{0}'.".format(get_testrun_name(testrun))
+        try:
+            if shared_vpp and testrun[4]:
+                vpp_running = shared_vpp.ensure(render_startup_conf(config))
+            test_result = tcp_stack_test.run_test(
+                config,
+                use_vpp=testrun[4],
+                use_docker=testrun[5],
+                procdist=testrun[3],
+                skip_cores=Affinity.parse_cores(skip_cores)
+                if skip_cores else None,
+                vpp_running=vpp_running,
+                vpp_numa=testrun[6],
+                container_pool=container_pool)
+        except (RuntimeError, ValueError, NotImplementedError) as e:
+            print "Test case setup failed: {0}".format(e)
+            test_result = {}
+        except EnvironmentError as e:
+            # e.g. a missing configuration file, retrying does not help
+            print "Test case failed: {0}".format(e)
+            if vpp_running:
+                shared_vpp.drain()
+            record_result(store, testrun, started, None)
+            return time.time() - started
+        if vpp_running:
+            shared_vpp.drain()
+        values = get_result(test_result, testrun[0])
+        if values:
+            record_result(store, testrun, started, values, test_result)
+            break
+    else:
+        print "Test failed after retrying."
+        record_result(store, testrun, started, None)
+    return time.time() - started
+
+
+def run_saturation(groups, store, shared_vpp=None, container_pool=None):
+    """Search for the saturation point of every group, see
+    saturation_search in test_runner_config.py. Runs with stored valid
+    results are not repeated.
+
+    :param groups: Test runs without sessions and connections (testrun[2:]).
+    :type groups: list of tuple
+
+    :return: Time spent running tests, in seconds.
+    :rtype: float
+    """
+    session_axis = sorted(set(sessions))
+    connection_axis = sorted(set(connections))
+    durations = []
+    searches = []
+
+    def measure(testrun):
+        key = config_hash(effective_config(testrun))
+        if not store.has_valid(key):
+            durations.append(run_serial(
+                testrun, store, shared_vpp, container_pool))
+        result = store.latest_valid(key)
+        if result is None or \
+                result["failed_sessions"] > saturation_max_failed * testrun[0]:
+            return None
+        return result["throughput"]
+
+    for group in groups:
+        search = dict(zip(CSV_COLUMNS[2:], group))
+        search["vpp_params"] = format_params(dict(group[5]))
+        search["vcl_params"] = format_params(dict(group[6]))
+        # sessions with a single connection first, then connections at the
+        # saturating number of sessions
+        knee, search["sessions_curve"] = find_knee(
+            session_axis,
+            lambda count: measure((count, connection_axis[0]) + group),
+            saturation_min_scaling)
+        search["knee"] = None
+        if knee is not None:
+            knee_sessions = session_axis[knee]
+            knee, search["connections_curve"] = find_knee(
+                connection_axis,
+                lambda count: measure((knee_sessions, count) + group),
+                saturation_min_scaling)
+            search["knee"] = {
+                "sessions": knee_sessions,
+                "connections": connection_axis[knee],
+                "throughput": dict(search["connections_curve"])[
+                    connection_axis[knee]],
+            }
+        name = get_testrun_name(("*", "*") + group)
+        if search["knee"]:
+            print "Saturation of '{0}': {1} sessions, {2} connections, " \
+                  "throughput {3}".format(
+                    name, search["knee"]["sessions"],
+                    search["knee"]["connections"],
+                    search["knee"]["throughput"])
+        else:
+            print "Saturation of '{0}': first test failed.".format(name)
+        searches.append(search)
+        with open(saturation_result, "w") as result_file:
+            json.dump(searches, result_file, indent=2, sort_keys=True)
+    return sum(durations)
+
+
+def run_parallel(testruns, store):
+    """Run kernel stack tests concurrently, each on its own CPU partition.
+
+    :return: Time spent running the tests, summed over all tests.
+    :rtype: float
+    """
+    skip = Affinity.parse_cores(skip_cores) if skip_cores else []
+    if test_config["vpp"]["exclude_cores"]:
+        vpp_cores = tcp_stack_test.get_vpp_cores(test_config)
+        if vpp_cores:
+            skip += [vpp_cores[0]] + vpp_cores[1]
+    ht_pairs = Affinity.get_ht_pairs(skip)
+    partitions = partition_cores(
+        ht_pairs, Affinity.get_numa_topo(ht_pairs), parallel_partitions)
+    scheduler = PartitionScheduler(
+        partitions,
+        default_port,
+        partition_port_stride)
+    attempts = {}
+    started = {}
+
+    def start_job(testrun, cores, port, slot):
+        logdir = get_log_dir(testrun)
+        command = build_command(testrun, cores, port,
+                                json_result=logdir + "/result.json")
+        print "Running test case '{0}' on partition {1} with command:\n" \
+              "{2}".format(get_testrun_name(testrun), slot, command)
+        if not os.path.isdir(logdir):
+            os.makedirs(logdir)
+        started.setdefault(testrun, time.time())
+        with open(logdir + "/tcp_stack_test_output.txt", "w") as output:
+            return subprocess.Popen(command, shell=True, stdout=output)
+
+    def finish_job(testrun, duration):
+        attempts[testrun] = attempts.get(testrun, 0) + 1
+        logdir = get_log_dir(testrun)
+        try:
+            with open(logdir + "/result.json", "r") as result_file:
+                test_result = json.load(result_file)
+            os.remove(logdir + "/result.json")
+        except (IOError, ValueError):
+            test_result = {}
+        values = get_result(test_result, testrun[0])
+        if values:
+            record_result(store, testrun, started[testrun], values,
+                          test_result)
+        elif attempts[testrun] < 2:
+            # Retry once if test fails
+            return False
+        else:
+            print "Test failed after retrying."
+            record_result(store, testrun, started[testrun], None)
+        return True
+
+    scheduler.run(testruns, start_job, finish_job)
+    return scheduler.busy_time
+
+
+if __name__ == "__main__":
+    with open(os.getcwd() + "/config.yml", "r") as ymlf:
+        test_config = yaml.load(ymlf)
+    build_info = get_build_info()
+    store = ResultStore(result_db)
+
+    testruns = []
+    groups = []
+    for testrun in product(
+            sessions, connections, message_sizes, test_cases, vpp, docker,
+            vpp_numa, expand_params(vpp_params), expand_params(vcl_params),
+            workloads):
+        if not testrun[4]:
+            # kernel stack tests do not depend on VPP and VCL parameters
+            testrun = testrun[:7] + ((), ()) + testrun[9:]
+            if testrun in testruns:
+                continue
+        if saturation_search:
+            # sessions and connections are searched by run_saturation
+            if testrun[2:] not in groups:
+                groups.append(testrun[2:])
+            continue
+        if not needs_run(testrun, store):
+            print "Skipping test case '{0}', results already stored.".format(
+                get_testrun_name(testrun))
+        else:
+            testruns.append(testrun)
+
+    # Only kernel stack tests without Docker are independent of each other,
+    # VPP and Docker tests share global state and always run serially.
+    if parallel_partitions > 1:
+        parallel_testruns = [
+            testrun for testrun in testruns
+            if not testrun[4] and not testrun[5]]
+    else:
+        parallel_testruns = []
+    serial_testruns = [
+        testrun for testrun in testruns if testrun not in parallel_testruns]
+
+    shared_vpp = None
+    if persistent_vpp and (any(testrun[4] for testrun in serial_testruns)
+                           or any(group[2] for group in groups)):
+        shared_vpp = SharedVPP(test_config)
+
+    container_pool = None
+    if test_config["iperf3"]["docker_pool"] \
+            and (any(testrun[5] for testrun in serial_testruns)
+                 or any(group[3] for group in groups)):
+        container_pool = tcp_stack_test.create_pool(
+            DOCKER_POOL_LOG_DIR, test_config["global"]["docker_socket"])
+
+    started = time.time()
+    serial_time = 0.0
+    # every round runs each test run that needs a repetition once
+    rounds = max(repetitions, max_repetitions) if target_ci else repetitions
+    try:
+        for repetition in range(rounds):
+            pending = [testrun for testrun in testruns
+                       if needs_run(testrun, store)]
+            if not pending:
+                break
+            print "Repetition {0}: {1} test runs.".format(
+                repetition + 1, len(pending))
+            parallel_pending = [
+                testrun for testrun in pending
+                if testrun in parallel_testruns]
+            if parallel_pending:
+                serial_time += run_parallel(parallel_pending, store)
+            for testrun in pending:
+                if testrun not in parallel_pending:
+                    serial_time += run_serial(
+                        testrun, store, shared_vpp, container_pool)
+        if repetitions > 1 or target_ci:
+            print_summary(testruns, store)
+        if groups:
+            serial_time += run_saturation(
+                groups, store, shared_vpp, container_pool)
+    finally:
+        if shared_vpp:
+            shared_vpp.stop()
+        if container_pool:
+            container_pool.close()
+        store.export_csv(result_csv, outlier_threshold)
+        store.export_summary_csv(result_summary_csv, outlier_threshold)
+        store.close()
+
+    wall_time = time.time() - started
+    print "Wall time: {0:.0f} s, serial execution estimate: {1:.0f} s, " \
+          "saved: {2:.0f} s".format(
+            wall_time, serial_time, serial_time - wall_time)
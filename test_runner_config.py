@@ -12,13 +12,109 @@ message_sizes = [60, 1600, "128KB"]
 # CPU affinity distribution. See 'tcp_stack_test.py -h' for details.
 test_cases = ["ls", "ps", "ns", "nn"]
 
+# Test cases: "iperf3" measures throughput, "rr" request/response latency
+# and "cps" connections per second with pingpong.py (message size is the
+# request and response size), "http" requests per second with nginx and wrk
+# (message size is the response size).
+workloads = ["iperf3"]
+
+# Instead of running every combination of sessions and connections, search
+# for the saturation point of each combination of the other parameters.
+# Sessions (with the first connections value) are bisected for the value
+# after which aggregate throughput grows by less than saturation_min_scaling
+# times linearly (e.g. 0.1: doubling sessions adds less than 10 %), or more
+# than saturation_max_failed of sessions fail; connections are then
+# bisected at that number of sessions. The sessions and connections lists
+# are the search axes and can be long, e.g. range(1, 201): a search needs
+# about 2 * log2(len) runs per axis. Measured scaling curves and the
+# saturation points are written to saturation_result, the runs are stored
+# like in the full matrix.
+saturation_search = False
+saturation_min_scaling = 0.1
+saturation_max_failed = 0.1
+saturation_result = "tcp_stack_saturation.json"
+
 # Use VPP+VCL LD_PRELOAD. "False" is useful for comparison with Unix TCP stack.
 vpp = [False, True]
 
+# Place clients and servers relative to NUMA nodes of VPP workers, read from
+# VPP startup configuration: "any", "local" or "remote".
+# See 'tcp_stack_test.py -h' for details.
+vpp_numa = ["any"]
+
+# VPP startup configuration parameters, each value is swept as a matrix axis.
+# Keys are "<section> <option>" of startup.conf, values are lists. For each
+# test run the options are set in a copy of startup_conf from config.yml,
+# None leaves the option unchanged. Setting "cpu workers" replaces
+# corelist-workers/coremask-workers. Examples:
+#   "cpu workers": [0, 1, 2, 4],
+#   "session preallocated-sessions": [None, 100000],
+#   "session v4-session-table-buckets": [None, 100000],
+#   "session event-queue-length": [None, 16384],
+#   "buffers buffers-per-numa": [None, 65536],
+#   "memory main-heap-size": [None, "2G"],
+vpp_params = {
+    "cpu workers": [None],
+}
+
+# VCL parameters, each value is swept as a matrix axis. Keys are options of
+# the vcl section of VCL configuration, values are lists. For each VPP test
+# run the options are set in a copy of vcllib conf from config.yml, passed to
+# iperf3 in VCL_CONFIG. None leaves the option unchanged. Examples:
+#   "rx-fifo-size": [None, 65536, 4000000],
+#   "tx-fifo-size": [None, 65536, 4000000],
+#   "segment-size": [None, 4000000000],
+#   "event-queue-size": [None, 100000],
+vcl_params = {
+    "rx-fifo-size": [None],
+}
+
 # Use Docker containers.
 # Otherwise all servers and clients run in host global namespace
 docker = [False, True]
 
 # Do not use the specified CPU cores (and their Hyperthreading twins)
-# List cores used by kernel tasks or by VPP(configured in /etc/vpp/startup.conf)
+# List cores used by kernel tasks. Cores used by VPP are read from its startup
+# configuration and excluded automatically (see exclude_cores in config.yml).
 skip_cores = "0,1-3"
+
+# Run kernel stack tests (vpp and docker disabled) concurrently on this many
+# disjoint CPU partitions. Each NUMA node is split evenly between partitions.
+# VPP and Docker tests always run serially. 1 disables parallel execution.
+parallel_partitions = 1
+
+# First iperf3 port, each partition uses ports starting at
+# default_port + partition index * partition_port_stride.
+default_port = 1024
+partition_port_stride = 1000
+
+# Start VPP once and keep it running for all VPP tests. VPP is restarted only
+# if it crashes, if its startup configuration changes, or if sessions of the
+# previous test are not closed within vpp_drain_timeout seconds.
+persistent_vpp = True
+vpp_drain_timeout = 30
+
+# Results are stored in an SQLite database, indexed by a hash of the full
+# test configuration (including VPP and VCL builds). Configurations which
+# already have a valid result are skipped, so an interrupted run resumes
+# where it stopped. Delete the database to measure everything again.
+# All stored results are also exported into result_csv.
+result_db = "tcp_stack_results.sqlite"
+result_csv = "tcp_stack_results.csv"
+
+# Run every test run this many times. Repetitions are interleaved (all test
+# runs once, then all of them again), so that slow drift of the machine is
+# spread over all test runs instead of biasing some of them. Total
+# throughput of the repetitions is summarized in result_summary_csv: mean,
+# median, standard deviation and 95% confidence interval of the mean. Runs
+# whose throughput is further than outlier_threshold (modified z-score) from
+# the median, in median absolute deviations, are marked as outliers in
+# result_csv and excluded from the summary.
+repetitions = 1
+outlier_threshold = 3.5
+result_summary_csv = "tcp_stack_summary.csv"
+
+# Repeat test runs whose 95% confidence interval is wider than target_ci of
+# the mean (e.g. 0.02 for +-2 %), up to max_repetitions runs. None disables.
+target_ci = None
+max_repetitions = 10
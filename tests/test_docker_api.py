@@ -0,0 +1,228 @@
+"""Tests of the Docker Engine API client against a fake daemon serving
+canned responses on a temporary unix socket."""
+
+import BaseHTTPServer
+import json
+import os
+import shutil
+import SocketServer
+import sys
+import tempfile
+import threading
+import unittest
+import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from docker_api import DockerClient, DockerError, RUN_LABEL, OWNER_LABEL, \
+    run_labels
+
+NETWORK = "vcl_docker_net"
+
+
+class FakeDaemon(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """Keeps containers and networks in memory, records requests."""
+
+    daemon_threads = True
+
+    def __init__(self, path):
+        SocketServer.UnixStreamServer.__init__(self, path, FakeHandler)
+        self.lock = threading.Lock()
+        self.requests = []
+        # ID -> {"Id", "Labels", "Network", "Body"}
+        self.containers = {}
+        # name -> {"Id", "Name", "Labels"}
+        self.networks = {}
+        self.next_id = 0
+
+    def new_id(self):
+        self.next_id += 1
+        return "{0:064x}".format(self.next_id)
+
+    def add_network(self, name, labels):
+        network = {"Id": self.new_id(), "Name": name, "Labels": labels}
+        self.networks[name] = network
+        return network["Id"]
+
+    def add_container(self, labels, network=NETWORK, body=None):
+        container = self.new_id()
+        self.containers[container] = {
+            "Id": container, "Labels": labels, "Network": network,
+            "Body": body}
+        return container
+
+
+def _matches(labels, filters):
+    for item in filters.get("label", []):
+        key, sep, value = item.partition("=")
+        if key not in labels or (sep and labels[key] != value):
+            return False
+    return True
+
+
+class FakeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=None):
+        content = "" if body is None else json.dumps(body)
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _handle(self, method):
+        url = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(url.query))
+        filters = json.loads(query.get("filters", "{}"))
+        length = int(self.headers.getheader("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        daemon = self.server
+        parts = url.path.strip("/").split("/")
+        with daemon.lock:
+            daemon.requests.append((method, url.path, query, body))
+            if parts == ["containers", "json"]:
+                return self._reply(200, [
+                    {"Id": c["Id"], "Labels": c["Labels"]}
+                    for c in daemon.containers.values()
+                    if _matches(c["Labels"], filters)])
+            if parts == ["containers", "create"]:
+                return self._reply(201, {"Id": daemon.add_container(
+                    body["Labels"], body["HostConfig"]["NetworkMode"],
+                    body)})
+            if parts[0] == "containers" and parts[-1] == "start":
+                return self._reply(204)
+            if parts[0] == "containers" and method == "DELETE":
+                if daemon.containers.pop(parts[1], None) is None:
+                    return self._reply(404, {"message": "no such container"})
+                return self._reply(204)
+            if parts == ["networks"]:
+                return self._reply(200, [
+                    n for n in daemon.networks.values()
+                    if _matches(n["Labels"], filters)])
+            if parts == ["networks", "create"]:
+                if body["Name"] in daemon.networks:
+                    return self._reply(409, {"message": "network exists"})
+                return self._reply(201, {"Id": daemon.add_network(
+                    body["Name"], body["Labels"])})
+            if parts[0] == "networks":
+                network = [n for n in daemon.networks.values()
+                           if parts[1] in (n["Id"], n["Name"])]
+                if not network:
+                    return self._reply(404, {"message": "no such network"})
+                network = network[0]
+                if method == "DELETE":
+                    del daemon.networks[network["Name"]]
+                    return self._reply(204)
+                return self._reply(200, dict(network, Containers=dict(
+                    (c["Id"], {}) for c in daemon.containers.values()
+                    if c["Network"] == network["Name"])))
+            return self._reply(404, {"message": "unknown endpoint"})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+class DockerClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.daemon = FakeDaemon(os.path.join(self.directory, "docker.sock"))
+        thread = threading.Thread(target=self.daemon.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.client = DockerClient(self.daemon.server_address, timeout=5,
+                                   workers=4)
+        self.labels = run_labels()
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        self.daemon.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_ensure_network_creates_network(self):
+        network = self.client.ensure_network(
+            NETWORK, "192.168.0.0/16", self.labels)
+        self.assertEqual(self.daemon.networks[NETWORK]["Id"], network)
+        self.assertEqual(self.daemon.networks[NETWORK]["Labels"],
+                         self.labels)
+
+    def test_ensure_network_removes_leftovers_of_dead_runs(self):
+        dead = {RUN_LABEL: "0123456789ab",
+                OWNER_LABEL: "{0}/999999999/1.00".format(
+                    self.labels[OWNER_LABEL].split("/")[0])}
+        self.daemon.add_network(NETWORK, dead)
+        stale = self.daemon.add_container(dead)
+        foreign = self.daemon.add_container({"other": "label"}, network=None)
+
+        network = self.client.ensure_network(
+            NETWORK, "192.168.0.0/16", self.labels)
+        self.assertNotIn(stale, self.daemon.containers)
+        self.assertIn(foreign, self.daemon.containers)
+        self.assertEqual(self.daemon.networks[NETWORK]["Id"], network)
+        self.assertEqual(self.daemon.networks[NETWORK]["Labels"],
+                         self.labels)
+
+    def test_ensure_network_keeps_network_of_live_run(self):
+        self.daemon.add_network(NETWORK, self.labels)
+        live = self.daemon.add_container(self.labels)
+        self.assertRaises(DockerError, self.client.ensure_network,
+                          NETWORK, "192.168.0.0/16", run_labels())
+        self.assertIn(live, self.daemon.containers)
+
+    def test_ensure_network_refuses_foreign_network(self):
+        self.daemon.add_network(NETWORK, {})
+        self.assertRaises(DockerError, self.client.ensure_network,
+                          NETWORK, "192.168.0.0/16", self.labels)
+
+    def test_create_containers_and_cleanup(self):
+        self.client.ensure_network(NETWORK, "192.168.0.0/16", self.labels)
+        foreign = self.daemon.add_container({"other": "label"}, network=None)
+        specs = [{
+            "name": "vcl_pool_{0}".format(i),
+            "image": "vcl_iperf3",
+            "labels": self.labels,
+            "network": NETWORK,
+            "cpus": str(i),
+            "ip": "192.168.0.{0}".format(i + 1),
+            "entrypoint": ["sleep"],
+            "command": ["infinity"],
+            "env": {"LD_PRELOAD": ""},
+        } for i in range(6)]
+        ids = self.client.create_containers(specs)
+
+        self.assertEqual(len(set(ids)), len(specs))
+        for i, container in enumerate(ids):
+            body = self.daemon.containers[container]["Body"]
+            self.assertEqual(body["HostConfig"]["CpusetCpus"], str(i))
+            self.assertEqual(body["Env"], ["LD_PRELOAD="])
+            self.assertEqual(body["Entrypoint"], ["sleep"])
+            self.assertEqual(
+                body["NetworkingConfig"]["EndpointsConfig"][NETWORK],
+                {"IPAMConfig": {"IPv4Address": "192.168.0.{0}".format(
+                    i + 1)}})
+        self.assertEqual(sorted(self.client.containers(self.labels)),
+                         sorted(ids))
+
+        self.assertEqual(self.client.cleanup(self.labels), len(specs))
+        self.assertEqual(list(self.daemon.containers), [foreign])
+        self.assertNotIn(NETWORK, self.daemon.networks)
+
+    def test_request_error(self):
+        self.assertRaises(DockerError, self.client.request,
+                          "GET", "/unknown")
+        self.assertEqual(
+            self.client.request("GET", "/unknown", ignore=(404,)),
+            {"message": "unknown endpoint"})
+
+
+if __name__ == "__main__":
+    unittest.main()
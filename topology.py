@@ -0,0 +1,261 @@
+"""CPU topology read from sysfs: sockets, NUMA nodes, last level caches and
+SMT siblings of every online logical CPU."""
+
+import json
+import os
+import stat
+
+SYSFS_ROOT = "/sys/devices/system"
+BOOT_ID = "/proc/sys/kernel/random/boot_id"
+# topology does not change until reboot, so it is read once per boot; the
+# cache is used only if it and its directory belong to the current user
+CACHE_FILE = "/var/cache/vpp_tcp_test/topology.json"
+
+# topology of each sysfs root read by this process
+_topologies = {}
+
+
+def parse_cpulist(cpulist):
+    """Parse a list of CPUs in sysfs/lscpu format, e.g. "0-3,8,10-11".
+
+    :type cpulist: str
+    :return: List of distinct CPUs, empty for an empty list.
+    :rtype: list of int
+    """
+
+    cpus = []
+    for item in cpulist.strip().split(","):
+        if not item:
+            continue
+        if "-" in item:
+            first, last = item.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(item))
+    return cpus
+
+
+def _read(path, default=None):
+    try:
+        with open(path, "r") as sysfs_file:
+            return sysfs_file.read().strip()
+    except IOError:
+        if default is None:
+            raise
+        return default
+
+
+class CpuTopology(object):
+    """Topology of online logical CPUs.
+
+    Every CPU is described by the physical core, socket, NUMA node and last
+    level cache it belongs to. Physical cores are numbered 0..N-1 in order of
+    their first logical CPU, like the Core column of lscpu -p, because
+    core_id in sysfs is only unique within a socket. Last level caches are
+    identified by their first logical CPU.
+    """
+
+    FIELDS = ("core", "socket", "node", "llc")
+
+    def __init__(self, cpus):
+        """
+        :param cpus: Values of FIELDS for each logical CPU.
+        :type cpus: dict
+        """
+
+        self.cpus = cpus
+
+    @staticmethod
+    def read(root=SYSFS_ROOT):
+        """Read topology from sysfs.
+
+        :param root: Path of /sys/devices/system, or of a copy of its cpu
+        and node directories for testing.
+        :type root: str
+        :rtype: CpuTopology
+        """
+
+        cpu_dir = os.path.join(root, "cpu")
+        node_dir = os.path.join(root, "node")
+        online = parse_cpulist(_read(os.path.join(cpu_dir, "online")))
+
+        # Kernels without NUMA support have no node directory
+        cpu_nodes = {}
+        if os.path.isdir(node_dir):
+            for node in parse_cpulist(
+                    _read(os.path.join(node_dir, "online"), "0")):
+                for cpu in parse_cpulist(_read(os.path.join(
+                        node_dir, "node{0}".format(node), "cpulist"), "")):
+                    cpu_nodes[cpu] = node
+
+        siblings = {}
+        cpus = {}
+        for cpu in online:
+            path = os.path.join(cpu_dir, "cpu{0}".format(cpu))
+            siblings[cpu] = tuple(sorted(parse_cpulist(_read(
+                os.path.join(path, "topology", "thread_siblings_list"),
+                str(cpu)))))
+            cpus[cpu] = {
+                "socket": int(_read(os.path.join(
+                    path, "topology", "physical_package_id"), "0")),
+                "node": cpu_nodes.get(cpu, 0),
+                "llc": CpuTopology._read_llc(path, cpu),
+            }
+
+        cores = sorted(set(siblings.values()))
+        for cpu in online:
+            cpus[cpu]["core"] = cores.index(siblings[cpu])
+        return CpuTopology(cpus)
+
+    @staticmethod
+    def _read_llc(path, cpu):
+        """First logical CPU sharing the last level data cache with cpu."""
+
+        cache_dir = os.path.join(path, "cache")
+        level = 0
+        llc = cpu
+        if not os.path.isdir(cache_dir):
+            return llc
+        for index in os.listdir(cache_dir):
+            if not index.startswith("index"):
+                continue
+            index = os.path.join(cache_dir, index)
+            if _read(os.path.join(index, "type"), "") == "Instruction":
+                continue
+            index_level = int(_read(os.path.join(index, "level"), "0"))
+            shared = parse_cpulist(
+                _read(os.path.join(index, "shared_cpu_list"), ""))
+            if index_level > level and shared:
+                level = index_level
+                llc = min(shared)
+        return llc
+
+    def _group(self, field):
+        groups = {}
+        for cpu in sorted(self.cpus.keys()):
+            groups.setdefault(self.cpus[cpu][field], []).append(cpu)
+        return groups
+
+    def cores(self):
+        """Logical CPUs of each physical core (SMT siblings).
+
+        :rtype: dict
+        """
+        return self._group("core")
+
+    def sockets(self):
+        return self._group("socket")
+
+    def nodes(self):
+        return self._group("node")
+
+    def llcs(self):
+        return self._group("llc")
+
+    def to_json(self):
+        return json.dumps(
+            [[cpu] + [self.cpus[cpu][field] for field in self.FIELDS]
+             for cpu in sorted(self.cpus.keys())])
+
+    @staticmethod
+    def from_json(data):
+        return CpuTopology(dict(
+            (values[0], dict(zip(CpuTopology.FIELDS, values[1:])))
+            for values in json.loads(data)))
+
+
+def _owned(st):
+    """Whether a file belongs to the current user and others can not write
+    to it."""
+
+    return st.st_uid == os.geteuid() and \
+        not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _owned_dir(path):
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and _owned(st)
+
+
+def _read_cache(path):
+    """Content of a cache file, None if it does not exist, is a symlink or
+    may have been written by another user."""
+
+    if not _owned_dir(os.path.dirname(path)):
+        return None
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return None
+    with os.fdopen(fd, "r") as cache:
+        if not _owned(os.fstat(fd)):
+            return None
+        return cache.read()
+
+
+def _write_cache(path, data):
+    """Replace a cache file, creating its directory. Errors are ignored,
+    e.g. when not running as root."""
+
+    directory = os.path.dirname(path)
+    temporary = "{0}.{1}".format(path, os.getpid())
+    try:
+        if not os.path.lexists(directory):
+            os.makedirs(directory, 0o755)
+        if not _owned_dir(directory):
+            return
+        fd = os.open(temporary,
+                     os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW,
+                     0o644)
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "w") as cache:
+            cache.write(data)
+        os.rename(temporary, path)
+    except (IOError, OSError):
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+
+
+def get_topology(root=SYSFS_ROOT, cache_file=CACHE_FILE):
+    """Topology of this machine, read from sysfs at most once per boot.
+
+    The topology of the real sysfs is cached in cache_file together with the
+    boot ID; fake roots are only cached within the process.
+
+    :param root: Path of /sys/devices/system.
+    :param cache_file: Path of the cache, None to disable it.
+    :type root: str
+    :type cache_file: str
+
+    :rtype: CpuTopology
+    """
+
+    if root in _topologies:
+        return _topologies[root]
+    if root != SYSFS_ROOT:
+        cache_file = None
+    boot_id = _read(BOOT_ID, "") if cache_file else ""
+
+    topology = None
+    content = _read_cache(cache_file) if boot_id else None
+    if content:
+        try:
+            cached_boot_id, data = content.split("\n", 1)
+            if cached_boot_id == boot_id:
+                topology = CpuTopology.from_json(data)
+        except (ValueError, TypeError):
+            pass
+    if topology is None:
+        topology = CpuTopology.read(root)
+        if boot_id:
+            _write_cache(cache_file, "{0}\n{1}".format(
+                boot_id, topology.to_json()))
+    _topologies[root] = topology
+    return topology
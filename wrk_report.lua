@@ -0,0 +1,46 @@
+-- wrk script which prints results in the format of pingpong.py, read by
+-- the HTTP test case (http_tc.py) from the client's output.
+
+local prefix = "wrk_report: "
+
+done = function(summary, latency, requests)
+   local errors = summary.errors
+   if summary.requests == 0 and errors.connect > 0 then
+      io.write(prefix .. '{"error": "unable to connect to server"}\n')
+      return
+   end
+
+   local duration = summary.duration / 1e6
+   -- wrk counts responses with a status other than 2xx/3xx as requests
+   local requests = summary.requests - errors.status
+   local summary_latency = "null"
+   local histogram = {}
+   if requests > 0 then
+      summary_latency = string.format(
+         '{"p50": %d, "p99": %d, "p99.9": %d, "mean": %f, "max": %d}',
+         latency:percentile(50), latency:percentile(99),
+         latency:percentile(99.9), latency.mean, latency.max)
+      -- wrk does not export its histogram; quantiles in 0.1 % steps, each
+      -- weighted by a thousandth of the requests, allow merging latency of
+      -- sessions
+      local weight = requests / 1000
+      for i = 1, 1000 do
+         local value = latency:percentile(i / 10)
+         histogram[value] = (histogram[value] or 0) + weight
+      end
+   end
+   local items = {}
+   for value, count in pairs(histogram) do
+      items[#items + 1] = string.format('"%d": %f', value, count)
+   end
+
+   io.write(prefix .. string.format(
+      '{"start": {"timestamp": %d}, "end": {"duration": %f, ' ..
+      '"requests": %d, "requests_per_second": %f, "bytes": %d, ' ..
+      '"errors": {"connect": %d, "read": %d, "write": %d, "status": %d, ' ..
+      '"timeout": %d}, "latency_us": %s, "histogram_us": {%s}}}\n',
+      math.floor(os.time() - duration), duration, requests,
+      duration > 0 and requests / duration or 0, summary.bytes,
+      errors.connect, errors.read, errors.write, errors.status,
+      errors.timeout, summary_latency, table.concat(items, ", ")))
+end